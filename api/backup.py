@@ -0,0 +1,258 @@
+"""
+Backup e restauração em streaming.
+
+O exportBackup do backup.js carrega seis tabelas inteiras na memória e faz um
+JSON.stringify indentado; o restoreBackup faz upsert a partir desse JSON único.
+Aqui o backup é um NDJSON comprimido com gzip, gerado tabela a tabela em blocos
+por rowid (memória constante), e a restauração lê o arquivo linha a linha,
+agrupa as linhas em lotes e faz upserts em massa (executemany), opcionalmente
+em várias conexões em paralelo. Só as tabelas de BACKUP_TABLES são aceitas;
+depois de restaurar itens ou movimentações os derivados (rollups, snapshots do
+razão e valorização) são reconstruídos e o cache de relatórios é descartado.
+
+O backup cobre só as tabelas do app (BACKUP_TABLES). Ficam de fora as notas
+gravadas (nfe_documents, com o histórico de preços e pesos derivado delas), os
+eventos das notas (nfe_events) e os ajustes manuais de weight_rules.
+
+Formato: a primeira linha é o cabeçalho
+    {"format": "controle-estoque-backup", "version": 1, "createdAt": ..., "tables": [...]}
+e cada linha seguinte é {"table": "<tabela>", "row": {...}}.
+
+    python -m api.backup backup <arquivo.ndjson.gz> [database_path]
+    python -m api.backup restore <arquivo.ndjson.gz> [database_path] [--workers N]
+"""
+import gzip
+import json
+import queue
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+
+from .db import encode_row, get_connection, iter_chunks, row_to_dict
+from .ledger import rebuild_snapshots
+from .reports import invalidate_movement_store
+from .rollups import rebuild_rollups
+from .valuation import rebuild_valuation
+
+BACKUP_FORMAT = "controle-estoque-backup"
+BACKUP_VERSION = 1
+
+# Ordem das chaves estrangeiras: fornecedores antes de itens, itens antes de movimentações
+BACKUP_TABLES = ("profiles", "suppliers", "items", "operations", "movements", "purchase_orders")
+
+CHUNK_SIZE = 5_000
+BATCH_SIZE = 1_000
+MAX_WORKERS = 16
+
+
+def iter_backup_lines(conn, tables=BACKUP_TABLES, chunk_size=CHUNK_SIZE):
+    """Gera as linhas NDJSON (bytes) do backup, tabela por tabela."""
+    header = {
+        "format": BACKUP_FORMAT,
+        "version": BACKUP_VERSION,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "tables": list(tables),
+    }
+    yield json.dumps(header).encode('utf-8') + b'\n'
+    for table in tables:
+        query = f"SELECT rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+        for rows in iter_chunks(conn, query, chunk_size=chunk_size):
+            lines = []
+            for row in rows:
+                data = row_to_dict(table, row)
+                del data['rowid']
+                lines.append(json.dumps({"table": table, "row": data}, ensure_ascii=False))
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def iter_backup_gzip(conn, tables=BACKUP_TABLES, chunk_size=CHUNK_SIZE):
+    """Mesmo conteúdo de iter_backup_lines, já comprimido em gzip (para streaming HTTP)."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: cabeçalho gzip
+    for chunk in iter_backup_lines(conn, tables, chunk_size):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_backup(conn, path, tables=BACKUP_TABLES):
+    with open(path, 'wb') as f:
+        for chunk in iter_backup_gzip(conn, tables):
+            f.write(chunk)
+
+
+class _Upserter:
+    """Faz upserts em lote numa conexão; as colunas são validadas contra o schema."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.columns = {}
+        self.statements = {}
+        # Com workers em paralelo a ordem entre tabelas não é garantida
+        self.conn.execute("PRAGMA foreign_keys=OFF")
+
+    def _table_columns(self, table):
+        if table not in BACKUP_TABLES:
+            raise ValueError(f"Tabela desconhecida no backup: {table}")
+        if table not in self.columns:
+            self.columns[table] = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if not self.columns[table]:
+                raise ValueError(f"Tabela desconhecida no backup: {table}")
+        return self.columns[table]
+
+    def _statement(self, table, columns):
+        key = (table, columns)
+        if key not in self.statements:
+            updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != 'id')
+            self.statements[key] = (
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT (id) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+            )
+        return self.statements[key]
+
+    def upsert(self, table, rows):
+        known = self._table_columns(table)
+        groups = {}
+        for row in rows:
+            row = encode_row(table, row)
+            columns = tuple(c for c in row if c in known)
+            groups.setdefault(columns, []).append(tuple(row[c] for c in columns))
+        with self.conn:
+            for columns, values in groups.items():
+                self.conn.executemany(self._statement(table, columns), values)
+
+
+def _rebuild_derived(conn):
+    """Tabelas mantidas por insert_movements, refeitas a partir do que foi restaurado."""
+    invalidate_movement_store(conn)
+    rebuild_rollups(conn)
+    rebuild_snapshots(conn)
+    rebuild_valuation(conn)
+
+
+def restore_backup(lines, path=None, batch_size=BATCH_SIZE, workers=1):
+    """
+    Restaura um backup a partir de um iterável de linhas NDJSON (bytes ou str).
+
+    Com workers > 1 os lotes são distribuídos entre várias conexões; a fila é
+    limitada, então a memória continua proporcional a workers * batch_size.
+    Arquivo inválido ou corrompido e erros de gravação viram ValueError.
+    Devolve a contagem de linhas restauradas por tabela.
+
+    A restauração não é atômica: cada lote é gravado na sua própria transação,
+    então um erro no meio do arquivo deixa gravados os lotes anteriores. Os
+    derivados são reconstruídos sempre que algum lote de itens ou movimentações
+    chegou a ser gravado, mesmo com erro, para não ficarem defasados.
+    """
+    written = set()
+    try:
+        return _restore(lines, path, batch_size, workers, written)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Backup com JSON inválido: {e}")
+    except (EOFError, OSError, sqlite3.Error) as e:
+        raise ValueError(f"Falha ao restaurar o backup: {e}")
+    finally:
+        if written & {'movements', 'items'}:
+            conn = get_connection(path)
+            try:
+                _rebuild_derived(conn)
+            finally:
+                conn.close()
+
+
+def _restore(lines, path, batch_size, workers, written):
+    """Grava os lotes; `written` recebe as tabelas com algum lote já gravado."""
+    lines = iter(lines)
+    header = json.loads(next(lines, b'{}') or b'{}')
+    if not isinstance(header, dict) or header.get('format') != BACKUP_FORMAT:
+        raise ValueError("Arquivo não é um backup válido.")
+    if not isinstance(header.get('version', 0), int) or header.get('version', 0) > BACKUP_VERSION:
+        raise ValueError(f"Versão de backup não suportada: {header.get('version')}")
+
+    workers = max(1, min(int(workers), MAX_WORKERS))
+    batches = queue.Queue(maxsize=workers * 2)
+    errors = []
+
+    def worker():
+        conn = get_connection(path)
+        upserter = _Upserter(conn)
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    return
+                if not errors:
+                    try:
+                        upserter.upsert(*item)
+                        written.add(item[0])
+                    except Exception as e:
+                        errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    counts = {}
+    pending = {}
+    try:
+        for line in lines:
+            if errors:
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or not isinstance(record.get('row'), dict):
+                raise ValueError("Linha de backup inválida: esperado {\"table\": ..., \"row\": {...}}")
+            table = record.get('table')
+            if table not in BACKUP_TABLES:
+                raise ValueError(f"Tabela desconhecida no backup: {table}")
+            pending.setdefault(table, []).append(record['row'])
+            counts[table] = counts.get(table, 0) + 1
+            if len(pending[table]) >= batch_size:
+                batches.put((table, pending.pop(table)))
+        for table, rows in pending.items():
+            batches.put((table, rows))
+    finally:
+        for _ in threads:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return counts
+
+
+def restore_backup_file(fileobj, path=None, batch_size=BATCH_SIZE, workers=1):
+    """Restaura a partir de um arquivo .ndjson.gz (ou NDJSON sem compressão)."""
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    stream = gzip.GzipFile(fileobj=fileobj, mode='rb') if head == b'\x1f\x8b' else fileobj
+    return restore_backup(stream, path, batch_size, workers)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    workers = 1
+    if '--workers' in sys.argv:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1])
+        args.remove(str(workers))
+    if len(args) < 2 or args[0] not in ('backup', 'restore'):
+        print("Usage: python -m api.backup backup|restore <file.ndjson.gz> [database_path] [--workers N]")
+        sys.exit(1)
+
+    database_path = args[2] if len(args) > 2 else None
+    start = time.perf_counter()
+    if args[0] == 'backup':
+        write_backup(get_connection(database_path), args[1])
+        print(f"Backup gravado em {args[1]} ({time.perf_counter() - start:.2f} s)")
+    else:
+        with open(args[1], 'rb') as f:
+            counts = restore_backup_file(f, database_path, workers=workers)
+        print(f"Restauração concluída em {time.perf_counter() - start:.2f} s: {counts}")
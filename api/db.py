@@ -0,0 +1,234 @@
+"""
+Banco local da API (SQLite).
+
+Espelha as tabelas do Supabase (full_db_restore.sql) para que os serviços do
+backend — sincronização, relatórios, backup — rodem sem depender do Postgres
+remoto; em testes e desenvolvimento basta apontar DATABASE_PATH para um
+arquivo temporário. Colunas JSONB viram TEXT com JSON serializado.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+DATABASE_PATH = os.environ.get("DATABASE_PATH", os.path.join(tempfile.gettempdir(), "controle_estoque.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    avatar_url TEXT,
+    role TEXT DEFAULT 'user',
+    permissions TEXT,
+    is_active INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS suppliers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    cnpj TEXT,
+    contact TEXT,
+    phone TEXT,
+    email TEXT,
+    fda TEXT,
+    address TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    code TEXT,
+    name TEXT NOT NULL,
+    name_en TEXT,
+    description TEXT,
+    quantity INTEGER DEFAULT 0,
+    min_quantity INTEGER DEFAULT 0,
+    cost_price REAL DEFAULT 0,
+    sale_price REAL DEFAULT 0,
+    package_type TEXT,
+    units_per_package INTEGER DEFAULT 1,
+    unit_measure_type TEXT,
+    unit_measure_value REAL DEFAULT 0,
+    unit_weight REAL DEFAULT 0,
+    ncm TEXT,
+    supplier_id TEXT REFERENCES suppliers(id) ON DELETE SET NULL,
+    image TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS operations (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    date TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    invoice_number TEXT,
+    total REAL DEFAULT 0,
+    items TEXT,
+    exporter_info TEXT,
+    importer_info TEXT,
+    booking TEXT,
+    payment_term TEXT,
+    port_of_departure TEXT,
+    destination_port TEXT,
+    incoterm TEXT,
+    footer_info TEXT,
+    ptax_rate REAL,
+    costs TEXT,
+    manual_net_weight REAL,
+    manual_gross_weight REAL,
+    nfe_data TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS movements (
+    id TEXT PRIMARY KEY,
+    item_id TEXT REFERENCES items(id) ON DELETE CASCADE,
+    operation_id TEXT REFERENCES operations(id) ON DELETE SET NULL,
+    type TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL DEFAULT 0,
+    reason TEXT,
+    date TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS purchase_orders (
+    id TEXT PRIMARY KEY,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    status TEXT DEFAULT 'pending',
+    items TEXT,
+    supplier_id TEXT REFERENCES suppliers(id) ON DELETE SET NULL,
+    xml_attached INTEGER DEFAULT 0,
+    comments TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_items_code ON items(code);
+CREATE INDEX IF NOT EXISTS idx_movements_item_id ON movements(item_id);
+CREATE INDEX IF NOT EXISTS idx_movements_operation_id ON movements(operation_id);
+
+CREATE TABLE IF NOT EXISTS sync_deletions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    deleted_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_sync_deletions_table ON sync_deletions(table_name, seq);
+"""
+
+TABLES = ("items", "suppliers", "operations", "movements", "purchase_orders", "profiles")
+
+# Colunas criadas depois da primeira versão do schema e a expressão que as
+# preenche em bancos antigos (ALTER TABLE não aceita default com 'now')
+ADDED_COLUMNS = {
+    ("operations", "updated_at"): "created_at",
+    ("movements", "updated_at"): "date",
+}
+
+# Sem os triggers de updated_at do Postgres, o delta-sync (sync.py) não veria
+# UPDATEs: toda alteração que não grava updated_at explicitamente ganha o
+# horário atual. Os DELETEs (inclusive em cascata) ficam em sync_deletions
+# para o cliente remover as linhas que já tinha baixado.
+TRIGGERS = "\n".join(f"""
+CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at AFTER UPDATE ON {table}
+    FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN UPDATE {table} SET updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE id = NEW.id; END;
+CREATE TRIGGER IF NOT EXISTS trg_{table}_sync_delete AFTER DELETE ON {table}
+    BEGIN INSERT INTO sync_deletions (table_name, row_id) VALUES ('{table}', OLD.id); END;
+""" for table in TABLES)
+
+# Colunas JSONB do Supabase, guardadas como TEXT aqui
+JSON_COLUMNS = {
+    "profiles": ("permissions",),
+    "operations": ("items", "costs", "nfe_data"),
+    "purchase_orders": ("items",),
+}
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def ensure_schema(conn, schema, key):
+    """
+    Executa o DDL de um módulo uma única vez por banco/processo.
+
+    `schema` é um script SQL ou uma função que recebe a conexão.
+    """
+    marker = (conn_path(conn), key)
+    if marker in _initialized:
+        return
+    with _init_lock:
+        if marker not in _initialized:
+            if callable(schema):
+                schema(conn)
+            else:
+                conn.executescript(schema)
+            _initialized.add(marker)
+
+
+def _add_columns(conn):
+    """Acrescenta as colunas de ADDED_COLUMNS que faltam em bancos criados antes delas."""
+    for (table, column), initial in ADDED_COLUMNS.items():
+        if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+            with conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+                conn.execute(f"UPDATE {table} SET {column} = coalesce({initial}, "
+                             "strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))")
+
+
+def conn_path(conn):
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] or f":memory:{id(conn)}"
+
+
+def get_connection(path=None):
+    """Abre uma conexão com o banco local, criando as tabelas base se preciso."""
+    # timeout: escritas concorrentes (restore em paralelo) esperam o lock em vez de falhar
+    conn = sqlite3.connect(path or DATABASE_PATH, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    ensure_schema(conn, SCHEMA, "base")
+    ensure_schema(conn, _add_columns, "columns")
+    ensure_schema(conn, TRIGGERS, "triggers")
+    return conn
+
+
+def row_to_dict(table, row):
+    """Converte um sqlite3.Row em dict, decodificando as colunas JSON."""
+    data = dict(row)
+    for column in JSON_COLUMNS.get(table, ()):
+        if data.get(column) is not None:
+            data[column] = json.loads(data[column])
+    return data
+
+
+def encode_row(table, data):
+    """Prepara um dict para INSERT, serializando as colunas JSON."""
+    encoded = dict(data)
+    for column in JSON_COLUMNS.get(table, ()):
+        if encoded.get(column) is not None and not isinstance(encoded[column], str):
+            encoded[column] = json.dumps(encoded[column], ensure_ascii=False)
+    return encoded
+
+
+def iter_chunks(conn, query, params=(), chunk_size=50_000):
+    """
+    Percorre uma consulta em blocos por rowid (keyset), sem OFFSET.
+
+    A consulta deve selecionar `rowid` e terminar com
+    "rowid > ? ORDER BY rowid LIMIT ?".
+    """
+    last_rowid = 0
+    while True:
+        rows = conn.execute(query, (*params, last_rowid, chunk_size)).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1]['rowid']
+        yield rows
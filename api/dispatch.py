@@ -0,0 +1,202 @@
+"""
+Identificação do tipo de documento fiscal antes do parse.
+
+Os lotes de XML que chegam dos fornecedores misturam NF-e, NFC-e, CT-e do
+transporte e arquivos de evento (procEventoNFe de cancelamento, carta de
+correção). parse_nfe_xml só entende NF-e e, para o resto, montava a árvore
+inteira para no fim falhar em <infNFe>.
+
+detect_document alimenta um XMLPullParser com o começo do arquivo, bloco a
+bloco, e para no primeiro elemento que identifica o documento (<infNFe>,
+<infCte> ou <infEvento>): nenhuma árvore é montada e o custo não depende do
+tamanho do XML. O modelo (55 NF-e, 65 NFC-e, 57 CT-e) sai das posições 21-22
+da chave de acesso no atributo Id; a versão do layout, do atributo versao.
+NF-e 3.10 e 4.00 usam os mesmos campos que o parser lê, então vão para o
+mesmo parse_nfe_xml.
+
+parse_event e parse_cte são os parsers dos outros tipos; o roteamento fica no
+/api/nfe/batch do index.py.
+"""
+from collections import namedtuple
+
+from lxml import etree
+
+from .parsing import parse_number
+
+DocumentInfo = namedtuple("DocumentInfo", "kind root version model access_key")
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+CTE_NS = 'http://www.portalfiscal.inf.br/cte'
+
+# Elemento que identifica o documento -> tipo (o modelo da chave refina NF-e/NFC-e)
+INFO_ELEMENTS = {"infNFe": "nfe", "infCte": "cte", "infEvento": "evento"}
+MODELS = {"55": "nfe", "65": "nfce", "57": "cte", "67": "cte"}
+# Raízes conhecidas: qualquer outra é rejeitada já no primeiro elemento
+ROOTS = {"nfeProc", "NFe", "cteProc", "CTe", "procEventoNFe", "evento", "envEvento"}
+
+NFE_KINDS = ("nfe", "nfce")
+KIND_LABELS = {"nfe": "NF-e", "nfce": "NFC-e", "cte": "CT-e", "evento": "evento de NF-e",
+               "desconhecido": "documento não fiscal", "invalido": "XML inválido"}
+
+CHUNK_SIZE = 512
+# O elemento de identificação vem nas primeiras centenas de bytes; além disso o arquivo não é do tipo esperado
+MAX_HEAD = 16_384
+
+# Eventos que cancelam a nota e status de evento registrado na SEFAZ
+CANCEL_EVENTS = {"110111": "Cancelamento", "110112": "Cancelamento por substituição"}
+EVENT_DESCRIPTIONS = {**CANCEL_EVENTS, "110110": "Carta de correção", "210200": "Confirmação da operação",
+                      "210210": "Ciência da operação", "210220": "Desconhecimento da operação",
+                      "210240": "Operação não realizada"}
+REGISTERED_STATUS = {"135", "136", "155"}
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def detect_document(xml_content):
+    """
+    Tipo do documento sem montar a árvore: DocumentInfo(kind, root, version,
+    model, access_key). kind é 'nfe', 'nfce', 'cte', 'evento', 'desconhecido'
+    ou 'invalido' (XML malformado).
+    """
+    parser = etree.XMLPullParser(events=('start',), resolve_entities=False)
+    root = None
+    try:
+        for start in range(0, min(len(xml_content), MAX_HEAD), CHUNK_SIZE):
+            parser.feed(xml_content[start:start + CHUNK_SIZE])
+            for _, element in parser.read_events():
+                name = _local_name(element.tag)
+                if root is None:
+                    root = name
+                    if name not in ROOTS:
+                        return DocumentInfo("desconhecido", root, None, None, None)
+                kind = INFO_ELEMENTS.get(name)
+                if kind is None:
+                    continue
+                element_id = element.get('Id', '')
+                if kind == "evento":
+                    # Id do evento: "ID" + tpEvento (6) + chave da nota (44) + sequência
+                    access_key = element_id[8:52] if len(element_id) >= 52 else None
+                    return DocumentInfo(kind, root, element.get('versao'), None, access_key)
+                digits = element_id[-44:]
+                access_key = digits if len(digits) == 44 and digits.isdigit() else None
+                model = access_key[20:22] if access_key else None
+                return DocumentInfo(MODELS.get(model, kind), root, element.get('versao'), model, access_key)
+        if len(xml_content) <= MAX_HEAD:
+            parser.close()  # arquivo inteiro lido: XML truncado só aparece aqui
+    except etree.XMLSyntaxError:
+        return DocumentInfo("invalido", root, None, None, None)
+    return DocumentInfo("desconhecido", root, None, None, None)
+
+
+def looks_like_nfe(xml_content, document):
+    """
+    NF-e/NFC-e identificada, ou XML malformado que ainda traz <infNFe> no
+    começo (candidato ao parse com recuperação). O resto é recusado sem parse.
+    """
+    return document.kind in NFE_KINDS or (document.kind == "invalido" and b'infNFe' in xml_content[:MAX_HEAD])
+
+
+def _text(element, path, ns):
+    node = element.find(path, ns) if element is not None else None
+    return node.text.strip() if node is not None and node.text else ''
+
+
+def _root(xml_content):
+    try:
+        return etree.fromstring(xml_content, etree.XMLParser(resolve_entities=False))
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f"Erro de sintaxe no XML: {e}")
+
+
+def parse_event(xml_content):
+    """Evento de NF-e (procEventoNFe ou evento avulso) como dict."""
+    root = _root(xml_content)
+    ns = {'nfe': NFE_NS}
+    info = root.find('.//nfe:infEvento', ns)
+    if info is None:
+        raise ValueError("Elemento <infEvento> não encontrado.")
+    event_type = _text(info, 'nfe:tpEvento', ns)
+    # Retorno da SEFAZ (só no procEventoNFe): sem ele o evento não foi registrado
+    ret = root.find('nfe:retEvento/nfe:infEvento', ns)
+    status = _text(ret, 'nfe:cStat', ns) if ret is not None else ''
+    return {
+        "tipo": "evento",
+        "chaveAcesso": _text(info, 'nfe:chNFe', ns),
+        "tipoEvento": event_type,
+        "descricao": EVENT_DESCRIPTIONS.get(event_type, _text(info, 'nfe:detEvento/nfe:descEvento', ns)),
+        "sequencia": int(_text(info, 'nfe:nSeqEvento', ns) or 1),
+        "dataEvento": _text(info, 'nfe:dhEvento', ns),
+        "justificativa": _text(info, 'nfe:detEvento/nfe:xJust', ns) or _text(info, 'nfe:detEvento/nfe:xCorrecao', ns),
+        "protocolo": _text(ret, 'nfe:nProt', ns) or _text(info, 'nfe:detEvento/nfe:nProt', ns),
+        "cStat": status,
+        "registrado": status in REGISTERED_STATUS,
+        "cancelamento": event_type in CANCEL_EVENTS,
+    }
+
+
+def parse_cte(xml_content):
+    """Dados do CT-e usados no estoque: transportadora, valor do frete, carga e NF-e transportadas."""
+    root = _root(xml_content)
+    ns = {'cte': CTE_NS}
+    info = root.find('.//cte:infCte', ns)
+    if info is None:
+        raise ValueError("Elemento <infCte> não encontrado.")
+    ide = info.find('cte:ide', ns)
+    emit = info.find('cte:emit', ns)
+    carga = info.find('cte:infCTeNorm/cte:infCarga', ns)
+    weight = 0.0
+    if carga is not None:
+        for quantity in carga.findall('cte:infQ', ns):
+            # cUnid 01 = KG; 02 = TON
+            factor = {"01": 1.0, "02": 1000.0}.get(_text(quantity, 'cte:cUnid', ns))
+            if factor:
+                weight += parse_number(_text(quantity, 'cte:qCarga', ns)) * factor
+    return {
+        "tipo": "cte",
+        "chaveAcesso": info.get('Id', '')[-44:],
+        "numero": _text(ide, 'cte:nCT', ns),
+        "serie": _text(ide, 'cte:serie', ns),
+        "dataEmissao": _text(ide, 'cte:dhEmi', ns)[:10],
+        "transportadora": {"nome": _text(emit, 'cte:xNome', ns), "cnpj": _text(emit, 'cte:CNPJ', ns)},
+        "valorPrestacao": parse_number(_text(info, 'cte:vPrest/cte:vTPrest', ns)),
+        "valorCarga": parse_number(_text(carga, 'cte:vCarga', ns)),
+        "pesoKg": weight,
+        "nfes": [node.text.strip() for node in info.findall('cte:infCTeNorm/cte:infDoc/cte:infNFe/cte:chave', ns)
+                 if node.text],
+    }
+
+
+if __name__ == "__main__":
+    # Custo da identificação contra o parse completo: python -m api.dispatch
+    import contextlib
+    import glob
+    import io
+    import os
+    import time
+
+    from .index import parse_nfe_xml
+
+    contents = [open(path, 'rb').read() for path in
+                sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))]
+    assert all(detect_document(content).kind == "nfe" for content in contents)
+    rounds = 200
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for content in contents:
+            detect_document(content)
+    detect_time = (time.perf_counter() - start) / (rounds * len(contents))
+    with contextlib.redirect_stdout(io.StringIO()):  # os prints DEBUG do parser
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for content in contents:
+                parse_nfe_xml(content)
+        parse_time = (time.perf_counter() - start) / (rounds * len(contents))
+    # Arquivo grande que não é NF-e: recusado no primeiro elemento
+    other = b'<relatorio>' + b'<linha>x</linha>' * 100_000 + b'</relatorio>'
+    start = time.perf_counter()
+    kind = detect_document(other).kind
+    print(f"identificação {detect_time * 1000:.3f} ms/nota, parse completo {parse_time * 1000:.3f} ms/nota; "
+          f"XML de {len(other) // 1024} KB '{kind}' em {(time.perf_counter() - start) * 1000:.3f} ms")
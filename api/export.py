@@ -0,0 +1,199 @@
+"""
+Exportação analítica em Parquet (Apache Arrow).
+
+Substitui, para análise offline, o exportBackup do backup.js (um JSON gigante
+montado no navegador). Cada tabela é lida do banco local em blocos por rowid e
+gravada em arquivos Parquet particionados no formato hive:
+
+    movements/month=2024-03/supplier_id=sup_1/part-0.parquet
+    operations/month=2024-03/part-0.parquet
+    nfe_products/month=2024-03/cnpj=12345678000190/part-0.parquet
+    items/part-0.parquet
+
+Colunas de texto repetitivas (ids, tipos, unidades) usam dictionary encoding.
+A memória fica limitada ao tamanho do bloco, independentemente do histórico.
+Requer pyarrow, que não faz parte das dependências da API:
+
+    pip install pyarrow
+    python -m api.export <diretorio_saida> [database_path]
+"""
+import json
+
+from .db import get_connection, iter_chunks
+
+CHUNK_SIZE = 50_000
+MAX_OPEN_FILES = 256
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError as e:
+        raise RuntimeError("A exportação Parquet requer o pacote pyarrow (pip install pyarrow).") from e
+    return pa, ds
+
+
+def _dict_string(pa):
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def _schemas(pa):
+    dict_string = _dict_string(pa)
+    return {
+        "items": pa.schema([
+            ("id", pa.string()), ("code", pa.string()), ("name", pa.string()), ("name_en", pa.string()),
+            ("ncm", dict_string), ("supplier_id", dict_string), ("package_type", dict_string),
+            ("units_per_package", pa.int32()), ("unit_measure_type", dict_string),
+            ("unit_measure_value", pa.float64()), ("unit_weight", pa.float64()),
+            ("quantity", pa.int64()), ("cost_price", pa.float64()), ("sale_price", pa.float64()),
+            ("updated_at", pa.string()),
+        ]),
+        "movements": pa.schema([
+            ("id", pa.string()), ("item_id", dict_string), ("operation_id", dict_string),
+            ("type", dict_string), ("quantity", pa.int64()), ("price", pa.float64()),
+            ("reason", dict_string), ("date", pa.string()),
+            ("month", pa.string()), ("supplier_id", pa.string()),
+        ]),
+        "operations": pa.schema([
+            ("id", pa.string()), ("type", dict_string), ("date", pa.string()),
+            ("invoice_number", pa.string()), ("total", pa.float64()), ("ptax_rate", pa.float64()),
+            ("manual_net_weight", pa.float64()), ("manual_gross_weight", pa.float64()),
+            ("month", pa.string()),
+        ]),
+        "nfe_products": pa.schema([
+            ("operation_id", dict_string), ("numero", dict_string), ("serie", dict_string),
+            ("dataEmissao", pa.string()), ("fornecedor", dict_string), ("code", pa.string()),
+            ("name", pa.string()), ("ncm", dict_string), ("unidade", dict_string),
+            ("quantity", pa.float64()), ("costPrice", pa.float64()), ("totalPriceBRL", pa.float64()),
+            ("calculated_qty_kg", pa.float64()), ("month", pa.string()), ("cnpj", pa.string()),
+        ]),
+    }
+
+
+PARTITIONS = {
+    "items": (),
+    "movements": ("month", "supplier_id"),
+    "operations": ("month",),
+    "nfe_products": ("month", "cnpj"),
+}
+
+
+def _chunks(conn, query):
+    return iter_chunks(conn, query, chunk_size=CHUNK_SIZE)
+
+
+def _month(date):
+    return (date or '')[:7] or 'unknown'
+
+
+def _rows_items(conn):
+    columns = ", ".join(name for name in (
+        "id", "code", "name", "name_en", "ncm", "supplier_id", "package_type", "units_per_package",
+        "unit_measure_type", "unit_measure_value", "unit_weight", "quantity", "cost_price", "sale_price",
+        "updated_at"))
+    for rows in _chunks(conn, f"SELECT rowid, {columns} FROM items WHERE rowid > ? ORDER BY rowid LIMIT ?"):
+        yield [{key: row[key] for key in row.keys() if key != 'rowid'} for row in rows]
+
+
+def _rows_movements(conn):
+    # items é pequeno comparado a movements: o join item -> fornecedor fica em memória
+    supplier_of = dict(conn.execute("SELECT id, supplier_id FROM items").fetchall())
+    query = ("SELECT rowid, id, item_id, operation_id, type, quantity, price, reason, date "
+             "FROM movements WHERE rowid > ? ORDER BY rowid LIMIT ?")
+    for rows in _chunks(conn, query):
+        yield [
+            dict(row, month=_month(row['date']), supplier_id=supplier_of.get(row['item_id']) or 'unknown')
+            for row in rows
+        ]
+
+
+def _rows_operations(conn):
+    query = ("SELECT rowid, id, type, date, invoice_number, total, ptax_rate, manual_net_weight, "
+             "manual_gross_weight FROM operations WHERE rowid > ? ORDER BY rowid LIMIT ?")
+    for rows in _chunks(conn, query):
+        yield [dict(row, month=_month(row['date'])) for row in rows]
+
+
+def _rows_nfe_products(conn):
+    """Achata operations.nfe_data (uma ou várias notas por operação) em linhas de produto."""
+    query = "SELECT rowid, id, nfe_data FROM operations WHERE rowid > ? AND nfe_data IS NOT NULL ORDER BY rowid LIMIT ?"
+    for rows in _chunks(conn, query):
+        batch = []
+        for row in rows:
+            notes = json.loads(row['nfe_data'])
+            for note in notes if isinstance(notes, list) else [notes]:
+                nota_fiscal = note.get('notaFiscal') or {}
+                fornecedor = note.get('fornecedor') or {}
+                for product in note.get('produtos') or []:
+                    batch.append({
+                        "operation_id": row['id'],
+                        "numero": nota_fiscal.get('numero'),
+                        "serie": nota_fiscal.get('serie'),
+                        "dataEmissao": nota_fiscal.get('dataEmissao'),
+                        "fornecedor": fornecedor.get('nome'),
+                        "code": product.get('code'),
+                        "name": product.get('name'),
+                        "ncm": product.get('ncm'),
+                        "unidade": (product.get('dadosCompletos') or {}).get('unidade'),
+                        "quantity": product.get('quantity'),
+                        "costPrice": product.get('costPrice'),
+                        "totalPriceBRL": product.get('totalPriceBRL'),
+                        "calculated_qty_kg": product.get('calculated_qty_kg'),
+                        "month": _month(nota_fiscal.get('dataEmissao')),
+                        "cnpj": fornecedor.get('cnpj') or 'unknown',
+                    })
+        if batch:
+            yield batch
+
+
+READERS = {
+    "items": _rows_items,
+    "movements": _rows_movements,
+    "operations": _rows_operations,
+    "nfe_products": _rows_nfe_products,
+}
+
+
+def export_dataset(conn, name, output_dir):
+    """Grava um dataset Parquet particionado; devolve o número de linhas escritas."""
+    pa, ds = _arrow()
+    schema = _schemas(pa)[name]
+    written = 0
+
+    def batches():
+        nonlocal written
+        for rows in READERS[name](conn):
+            written += len(rows)
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    partition_columns = PARTITIONS[name]
+    ds.write_dataset(
+        batches(),
+        f"{output_dir}/{name}",
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([schema.field(c) for c in partition_columns]), flavor="hive")
+        if partition_columns else None,
+        max_open_files=MAX_OPEN_FILES,
+        existing_data_behavior="delete_matching",
+    )
+    return written
+
+
+def export_all(conn, output_dir):
+    return {name: export_dataset(conn, name, output_dir) for name in READERS}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m api.export <output_dir> [database_path]")
+        sys.exit(1)
+
+    conn = get_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+    start = time.perf_counter()
+    counts = export_all(conn, sys.argv[1])
+    print(f"Exportação concluída em {time.perf_counter() - start:.2f} s: {counts}")
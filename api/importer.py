@@ -0,0 +1,279 @@
+"""
+Importação de planilhas de itens (XLSX ou CSV) no servidor.
+
+O handleFileImport do import.js carrega a planilha inteira com XLSX.read e
+sheet_to_json e percorre linha a linha no navegador. Aqui as linhas são lidas
+em streaming (openpyxl em modo read_only / csv.reader), normalizadas em lotes
+com parse_numbers e comparadas pelo código com os itens já cadastrados: a
+resposta diz o que seria criado, o que mudaria e quais linhas têm erro, sem
+gravar nada. A memória depende do tamanho do lote e do diff, não da planilha.
+
+As colunas seguem o modelo do downloadImportTemplate (name, nameEn, code, ncm,
+description, quantity, minQuantity, costPrice, salePrice, unitsPerBox,
+unitWeight); cabeçalhos em snake_case (os nomes da tabela items) também valem.
+
+CSV "separado por ponto e vírgula" salvo pelo Excel em pt-BR vem em
+windows-1252, não em UTF-8: o arquivo é conferido numa passada binária (só o
+decodificador incremental, sem o csv.reader) e, se não for UTF-8 válido, é
+lido em CSV_FALLBACK_ENCODING.
+"""
+import codecs
+import csv
+import io
+import time
+import zipfile
+
+import numpy as np
+
+from .parsing import parse_numbers
+
+BATCH_SIZE = 5_000
+MAX_ERRORS = 100
+# Limite de variáveis por consulta do SQLite
+QUERY_CHUNK = 900
+READ_BLOCK = 1 << 20
+# Codificação do "CSV (separado por vírgulas)" do Excel em pt-BR
+CSV_FALLBACK_ENCODING = 'cp1252'
+
+# Cabeçalho da planilha -> coluna de items
+COLUMN_ALIASES = {
+    "name": "name", "nome": "name",
+    "nameen": "name_en", "name_en": "name_en",
+    "code": "code", "codigo": "code", "código": "code",
+    "ncm": "ncm",
+    "description": "description", "descricao": "description", "descrição": "description",
+    "quantity": "quantity", "quantidade": "quantity",
+    "minquantity": "min_quantity", "min_quantity": "min_quantity",
+    "costprice": "cost_price", "cost_price": "cost_price",
+    "saleprice": "sale_price", "sale_price": "sale_price",
+    "unitsperbox": "units_per_package", "unitsperpackage": "units_per_package",
+    "units_per_package": "units_per_package",
+    "unitweight": "unit_weight", "unit_weight": "unit_weight",
+}
+INTEGER_COLUMNS = ("quantity", "min_quantity", "units_per_package")
+FLOAT_COLUMNS = ("cost_price", "sale_price", "unit_weight")
+
+
+def _iter_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError as e:
+        raise RuntimeError("A importação de XLSX requer o pacote openpyxl (pip install openpyxl).") from e
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise ValueError("Arquivo XLSX inválido.") from e
+    try:
+        # Primeira aba, como o handleFileImport
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_encoding(fileobj):
+    """'utf-8-sig' se o arquivo inteiro for UTF-8 válido (com ou sem BOM), senão CSV_FALLBACK_ENCODING."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for block in iter(lambda: fileobj.read(READ_BLOCK), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return CSV_FALLBACK_ENCODING
+    finally:
+        fileobj.seek(0)
+
+
+def _iter_csv(fileobj):
+    # errors='replace': os poucos bytes sem caractere no cp1252 não derrubam a importação
+    text = io.TextIOWrapper(fileobj, encoding=_csv_encoding(fileobj), errors='replace', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    # Planilhas exportadas em pt-BR costumam usar ';'
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    yield from csv.reader(text, delimiter=delimiter)
+
+
+def iter_sheet_rows(fileobj, filename):
+    """Linhas da planilha (tuplas de valores), a primeira é o cabeçalho."""
+    if (filename or '').lower().endswith('.csv'):
+        return _iter_csv(fileobj)
+    return _iter_xlsx(fileobj)
+
+
+def _text(value):
+    if type(value) is str:
+        return value.strip()
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # códigos numéricos do Excel chegam como 1001.0
+    return str(value).strip()
+
+
+def _normalize_batch(columns, rows):
+    """Converte um lote de linhas brutas em dicts com as colunas de items."""
+    values = {column: [_text(row[i]) if i < len(row) else '' for row in rows] for column, i in columns.items()}
+    for column in INTEGER_COLUMNS + FLOAT_COLUMNS:
+        if column in values:
+            # Como o parseInt/parseFloat do import.js: vazio ou inválido vira 0
+            numbers = np.nan_to_num(parse_numbers(values[column]), nan=0.0)
+            if column in INTEGER_COLUMNS:
+                numbers[np.abs(numbers) >= 2.0 ** 63] = 0.0  # fora do int64 o astype daria lixo
+                values[column] = numbers.astype(np.int64).tolist()
+            else:
+                values[column] = numbers.tolist()
+    if 'ncm' in values:
+        values['ncm'] = [''.join(c for c in ncm if c.isdigit()) for ncm in values['ncm']]
+    names = list(values)
+    return [dict(zip(names, row)) for row in zip(*(values[name] for name in names))]
+
+
+def _same(old, new):
+    if isinstance(new, (int, float)) and not isinstance(new, bool):
+        return abs((old or 0) - new) < 1e-9
+    return (old or '') == new
+
+
+def _existing_items(conn, codes, columns):
+    """Itens cadastrados com esses códigos (índice idx_items_code), só com as colunas comparadas."""
+    found = {}
+    codes = list(codes)
+    selected = ', '.join(['id'] + [c for c in columns if c != 'id'])
+    for start in range(0, len(codes), QUERY_CHUNK):
+        chunk = codes[start:start + QUERY_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f"SELECT {selected} FROM items WHERE code IN ({placeholders})", chunk):
+            found.setdefault(row['code'], dict(row))
+    return found
+
+
+def diff_items(conn, rows, batch_size=BATCH_SIZE):
+    """
+    Compara as linhas da planilha (iterável de tuplas, cabeçalho primeiro) com
+    items pelo código. Devolve novos, alterados (só os campos que mudam),
+    número de iguais, erros por linha e a taxa de linhas por segundo.
+    """
+    start = time.perf_counter()
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        raise ValueError("Planilha vazia.")
+    columns = {}
+    for i, title in enumerate(header):
+        column = COLUMN_ALIASES.get(_text(title).lower().replace(' ', ''))
+        if column and column not in columns:
+            columns[column] = i
+    if 'code' not in columns or 'name' not in columns:
+        raise ValueError("A planilha precisa das colunas 'code' e 'name'.")
+
+    created, changed, errors = [], [], []
+    unchanged = total = error_count = 0
+    seen_codes = set()
+
+    def process(batch):
+        nonlocal unchanged, error_count
+        valid = []
+        for line, item in zip((n for n, _ in batch), _normalize_batch(columns, [r for _, r in batch])):
+            problem = None
+            if not item['code']:
+                problem = "Código vazio"
+            elif not item['name']:
+                problem = "Nome vazio"
+            elif item['code'] in seen_codes:
+                problem = f"Código {item['code']} repetido na planilha"
+            if problem:
+                error_count += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append({"linha": line, "erro": problem})
+                continue
+            seen_codes.add(item['code'])
+            valid.append(item)
+
+        existing = _existing_items(conn, {item['code'] for item in valid}, columns)
+        for item in valid:
+            current = existing.get(item['code'])
+            if current is None:
+                created.append(item)
+                continue
+            fields = {column: {"de": current.get(column), "para": value}
+                      for column, value in item.items() if not _same(current.get(column), value)}
+            if fields:
+                changed.append({"id": current['id'], "code": item['code'], "campos": fields})
+            else:
+                unchanged += 1
+
+    batch = []
+    for line, row in enumerate(rows, start=2):  # linha 1 é o cabeçalho
+        if not any(value not in (None, '') for value in row):
+            continue
+        total += 1
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            process(batch)
+            batch = []
+    if batch:
+        process(batch)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "resumo": {
+            "linhas": total,
+            "novos": len(created),
+            "alterados": len(changed),
+            "iguais": unchanged,
+            "erros": error_count,
+            "segundos": round(elapsed, 3),
+            "linhasPorSegundo": round(total / elapsed) if elapsed else total,
+        },
+        "novos": created,
+        "alterados": changed,
+        "erros": errors,
+    }
+
+
+def diff_item_file(conn, fileobj, filename, batch_size=BATCH_SIZE):
+    return diff_items(conn, iter_sheet_rows(fileobj, filename), batch_size)
+
+
+if __name__ == "__main__":
+    # Benchmark com planilha de 100 mil linhas: python -m api.importer
+    import os
+    import resource
+    import tempfile
+
+    from openpyxl import Workbook
+
+    from .db import get_connection
+
+    directory = tempfile.mkdtemp()
+    conn = get_connection(os.path.join(directory, "bench.db"))
+    conn.executemany("INSERT INTO items (id, code, name, cost_price, quantity) VALUES (?, ?, ?, ?, ?)",
+                     [(f"item_{i}", f"SKU-{i}", f"Produto {i}", 10.0, 5) for i in range(50_000)])
+    conn.commit()
+
+    n = 100_000
+    header = ["name", "nameEn", "code", "ncm", "description", "quantity", "minQuantity",
+              "costPrice", "salePrice", "unitsPerBox", "unitWeight"]
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for i in range(n):
+        cost = "10,00" if i % 3 else f"{10 + i % 7},50"
+        sheet.append([f"Produto {i}", f"Product {i}", f"SKU-{i}", "0401.10.10", "", 5, 1, cost, "19,90", 12, 0.5])
+    xlsx_path = os.path.join(directory, "itens.xlsx")
+    workbook.save(xlsx_path)
+
+    csv_path = os.path.join(directory, "itens.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(header)
+        for i in range(n):
+            writer.writerow([f"Produto {i}", f"Product {i}", f"SKU-{i}", "04011010", "", 5, 1, "10,00", "19,90", 12, "0,5"])
+
+    for path in (csv_path, xlsx_path):
+        with open(path, "rb") as f:
+            summary = diff_item_file(conn, f, path)["resumo"]
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{os.path.basename(path)}: {summary} (RSS máximo do processo: {peak:.0f} MiB)")
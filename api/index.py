@@ -1,13 +1,47 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
 import io
+import logging
+import uuid
 import re
 import os
 from datetime import datetime
 from lxml import etree
 
+from .backup import iter_backup_gzip, restore_backup_file
+from .db import get_connection
+from .dispatch import KIND_LABELS, detect_document, looks_like_nfe, parse_cte, parse_event
+from .documents import render_invoice_pdf, render_packing_list_pdf
+from .importer import diff_item_file
+from .invoice import InvoiceModel, InvoiceSessions
+from .ledger import catalog_stock_at, stock_at
+from .matching import ProductMatcher, catalog_fingerprint
+from .nfe_store import (access_key_of, archive_stats, document_key, get_parsed, get_xml, is_cancelled, list_events,
+                        open_xml, recompress_documents, record_event, search_documents, store_nfe, train_archive)
+from .packing import build_packing_list
+from .price_history import last_price, price_series, price_trends
+from .parsing import parse_date, parse_number
+from .reconcile import reconcile_purchase_order
+from .reports import fiscal_report
+from .rollups import daily_movements, insert_movements, product_ranking, rollup_summary
+from .signature import signature_stats, verify_in_pool, verify_nfe_signature, verify_xml_signature
+from .sync import fetch_changes
+from .taxes import extract_icms_totals, extract_item_taxes
+from .units import audited_weight, normalize_descriptions, quantity_to_kg
+from .valuation import valuation
+from .weight_anomalies import check_note, scan_weights
+from .weight_rules import WeightRules, delete_rules, list_rules, set_rule
+from .xml_encoding import (FALLBACK_ENCODING, HEAD_SIZE, can_fall_back, detect_encoding, is_encoding_error,
+                           xml_parser)
+
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 
 API_KEY = os.environ.get("API_KEY", "secret")
@@ -25,6 +59,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Respostas grandes (sync, relatórios) saem comprimidas
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+def get_db():
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
 
 # --- FUNÇÕES AUXILIARES ROBUSTAS ---
 
@@ -37,61 +81,15 @@ def get_text(element, path, ns, default=''):
 
 def get_value(element, path, ns, default=0.0):
     """Busca um valor numérico em um elemento, tratando ausência e erros."""
-    text = get_text(element, path, ns)
-    try:
-        return float(text.replace(',', '.'))
-    except (ValueError, TypeError):
-        return default
+    return parse_number(get_text(element, path, ns), default)
 
 def calculate_audited_weight(description: str, qCom: float):
     """
     Tenta calcular o peso de um item auditando sua descrição.
     Retorna uma tupla (peso_em_kg, unidade_encontrada) ou (None, None).
+    A gramática (pacote 20x500g ou item único 0.400kg) fica em api/units.py.
     """
-    if not description or qCom == 0:
-        return (None, None)
-
-    desc_lower = description.lower()
-
-    # ETAPA 1: Tenta encontrar o padrão de "pacote" (ex: 20x500g)
-    package_match = re.search(r'(\d+(?:[.,]\d+)?)\s*x\s*(\d+(?:[.,]\d+)?)\s*(g|gr|kg|l)(?![a-z])', desc_lower)
-    if package_match:
-        try:
-            qty_in_com_unit = float(package_match.group(1).replace(',', '.'))
-            value_per_sub_unit = float(package_match.group(2).replace(',', '.'))
-            unit = package_match.group(3)
-
-            weight_of_com_unit = qty_in_com_unit * value_per_sub_unit
-            total_weight = qCom * weight_of_com_unit
-
-            if unit in ['g', 'gr']:
-                return (total_weight / 1000.0, 'G')
-            elif unit == 'kg':
-                return (total_weight, 'KG')
-            elif unit == 'l':
-                return (total_weight * 1.03, 'L')
-        except (ValueError, IndexError):
-            return (None, None)
-
-    # ETAPA 2: Se não for pacote, tenta encontrar o padrão de "item único" (ex: 0.400kg)
-    single_item_match = re.search(r'(\d+(?:[.,]\d+)?)\s*(g|gr|kg|l)\b', desc_lower)
-    if single_item_match:
-        try:
-            weight_per_item = float(single_item_match.group(1).replace(',', '.'))
-            unit = single_item_match.group(2)
-
-            total_weight = qCom * weight_per_item
-
-            if unit in ['g', 'gr']:
-                return (total_weight / 1000.0, 'G')
-            elif unit == 'kg':
-                return (total_weight, 'KG')
-            elif unit == 'l':
-                return (total_weight * 1.03, 'L')
-        except (ValueError, IndexError):
-            return (None, None)
-
-    return (None, None)
+    return audited_weight(description, qCom)
 
 def get_qty_kg(prod, ns):
     """
@@ -101,30 +99,14 @@ def get_qty_kg(prod, ns):
     Plano C: Retorna 0 se nenhuma unidade de peso for encontrada.
     """
     # Plano A: Leitura Fiscal/Tributável
-    uTrib = get_text(prod, 'nfe:uTrib', ns).upper()
-    if uTrib in ["KG", "G", "GR", "T", "L"]:
-        qTrib = get_value(prod, 'nfe:qTrib', ns)
-        if uTrib == "KG":
-            return qTrib
-        if uTrib in ["G", "GR"]:
-            return qTrib / 1000.0
-        if uTrib == "T":
-            return qTrib * 1000.0
-        if uTrib == "L": # NEW: Handle Liters
-            return qTrib * 1.03 # 1L = 1.03kg for milk
+    qty_kg = quantity_to_kg(get_text(prod, 'nfe:uTrib', ns), get_value(prod, 'nfe:qTrib', ns))
+    if qty_kg is not None:
+        return qty_kg
 
     # Plano B: Fallback Comercial
-    uCom = get_text(prod, 'nfe:uCom', ns).upper()
-    if uCom in ["KG", "G", "GR", "T", "L"]:
-        qCom = get_value(prod, 'nfe:qCom', ns)
-        if uCom == "KG":
-            return qCom
-        if uCom in ["G", "GR"]:
-            return qCom / 1000.0
-        if uCom == "T":
-            return qCom * 1000.0
-        if uCom == "L": # NEW: Handle Liters
-            return qCom * 1.03 # 1L = 1.03kg for milk
+    qty_kg = quantity_to_kg(get_text(prod, 'nfe:uCom', ns), get_value(prod, 'nfe:qCom', ns))
+    if qty_kg is not None:
+        return qty_kg
 
     # Plano C: Falha Segura
     return 0.0
@@ -184,14 +166,85 @@ def get_peso_bruto(infNFe, ns, peso_liquido_final):
     # Fallback para 0
     return 0.0
 
+# Elementos sem os quais a nota recuperada fica incompleta (caminho, descrição)
+REQUIRED_NOTE_ELEMENTS = (
+    ('nfe:ide/nfe:nNF', 'número da nota (<nNF>)'),
+    ('nfe:ide/nfe:dhEmi', 'data de emissão (<dhEmi>)'),
+    ('nfe:emit/nfe:CNPJ', 'CNPJ do emitente'),
+    ('nfe:det', 'itens (<det>)'),
+    ('nfe:total/nfe:ICMSTot', 'totais (<ICMSTot>)'),
+)
+REQUIRED_ITEM_ELEMENTS = ('cProd', 'xProd', 'qCom', 'vUnCom', 'vProd')
+
+
+def validate_required_elements(infNFe, ns):
+    """Avisos para os elementos obrigatórios ausentes (XML recuperado ou truncado)."""
+    warnings = []
+    for path, label in REQUIRED_NOTE_ELEMENTS:
+        if infNFe.find(path, ns) is None:
+            warnings.append(f"Nota sem {label}.")
+    for number, det in enumerate(infNFe.findall('nfe:det', ns), start=1):
+        prod = det.find('nfe:prod', ns)
+        missing = [name for name in REQUIRED_ITEM_ELEMENTS if prod is None or prod.find(f'nfe:{name}', ns) is None]
+        if missing:
+            warnings.append(f"Item {number}: faltam {', '.join(f'<{name}>' for name in missing)}.")
+    return warnings
+
+
 # --- PARSER PRINCIPAL ROBUSTO ---
-def parse_nfe_xml(xml_content: bytes):
+def parse_nfe_xml(xml_content, include_taxes: bool = False, weight_rules=None, recover: bool = False,
+                  verify_signature: bool = False):
+    """
+    recover=True usa o modo de recuperação da lxml (caracteres inválidos, final
+    truncado): devolve o que foi possível ler, com os problemas em "avisos".
+    verify_signature=True confere a assinatura digital do <infNFe> e devolve o
+    resultado em "assinatura" (api/signature.py).
+    """
     print("DEBUG: Iniciando parse_nfe_xml.")
+    warnings = []
     try:
-        # Remove declaração de XML se presente para evitar erros de parsing
-        # Corrigido o SyntaxWarning usando raw string (r'')
-        xml_content = re.sub(rb'^[ \t\n\r]*<\?xml.*\?>', b'', xml_content, count=1)
-        root = etree.fromstring(xml_content)
+        root = None
+        if hasattr(xml_content, 'read'):
+            # Arquivo (ex.: XML descomprimido sob demanda do repositório): a lxml lê em blocos
+            xml_content = io.BufferedReader(xml_content)
+            encoding, source = detect_encoding(xml_content.peek(HEAD_SIZE)[:HEAD_SIZE])
+            if source is None:
+                # Sem declaração só dá para saber lendo: vai para o caminho de bytes, que tenta Latin-1
+                xml_content = xml_content.read()
+            else:
+                parser = xml_parser(encoding, recover)
+                root = etree.parse(xml_content, parser).getroot()
+        if root is None:
+            # Codificação pelo BOM/declaração antes de remover a declaração (api/xml_encoding.py)
+            encoding, source = detect_encoding(xml_content[:HEAD_SIZE])
+            if recover and source != 'bom':
+                # Lixo antes do primeiro elemento (BOM duplicado, bytes soltos) é descartado
+                start = xml_content.find(b'<')
+                if start > 0:
+                    warnings.append(f"{start} bytes antes do XML ignorados.")
+                    xml_content = xml_content[start:]
+            # Remove declaração de XML se presente para evitar erros de parsing
+            # Corrigido o SyntaxWarning usando raw string (r'')
+            xml_content = re.sub(rb'^[ \t\n\r]*<\?xml.*\?>', b'', xml_content, count=1)
+            parser = xml_parser(encoding, recover)
+            try:
+                root = etree.fromstring(xml_content, parser)
+                wrong_encoding = recover and any(is_encoding_error(error.type) for error in parser.error_log)
+            except etree.XMLSyntaxError as e:
+                wrong_encoding = is_encoding_error(e.code)
+                if not (wrong_encoding and can_fall_back(encoding, source)):
+                    raise
+            if wrong_encoding and can_fall_back(encoding, source):
+                # Bytes inválidos em UTF-8: exportação em Latin-1 sem declaração (ou declarada errado)
+                logger.info("XML não é UTF-8; lendo como %s.", FALLBACK_ENCODING)
+                if recover:
+                    warnings.append(f"XML não está em UTF-8; lido como {FALLBACK_ENCODING}.")
+                parser = xml_parser(FALLBACK_ENCODING, recover)
+                root = etree.fromstring(xml_content, parser)
+        if recover:
+            warnings += [f"Linha {error.line}: {error.message}" for error in parser.error_log]
+            if root is None:
+                raise ValueError("Nenhum conteúdo recuperável no XML.")
         print("DEBUG: XML parsed com sucesso pela lxml.")
         
         # Detecta o namespace automaticamente da tag raiz
@@ -206,9 +259,13 @@ def parse_nfe_xml(xml_content: bytes):
             if infNFe is None:
                 print("ERRO: Elemento <infNFe> não encontrado mesmo sem namespace.")
                 raise ValueError("Elemento <infNFe> não encontrado.")
+        if recover:
+            warnings += validate_required_elements(infNFe, ns)
 
         ide = infNFe.find('nfe:ide', ns)
         emit = infNFe.find('nfe:emit', ns)
+        # Regras de embalagem já aprendidas para este fornecedor (api/weight_rules.py)
+        supplier_rules = weight_rules.for_supplier(get_text(emit, 'nfe:CNPJ', ns)) if weight_rules is not None else None
 
         # Dados da Nota Fiscal
         nfe_number = ''
@@ -264,14 +321,22 @@ def parse_nfe_xml(xml_content: bytes):
                 },
                 "calculated_qty_kg": get_qty_kg(prod, ns)
             }
+            if include_taxes:
+                # Mesma passada do <det>: só o <imposto> deste item é lido
+                product_data["impostos"] = extract_item_taxes(det.find('nfe:imposto', ns))
 
             # Auditoria de Peso
             official_kg = product_data['calculated_qty_kg']
-            audited_kg, audited_unit = calculate_audited_weight(product_data['name'], qCom)
+            if supplier_rules is not None:
+                audited_kg, audited_unit = supplier_rules.audited_weight(product_data['code'], product_data['name'], qCom)
+            else:
+                audited_kg, audited_unit = calculate_audited_weight(product_data['name'], qCom)
             # print(f"--- Auditoria de Peso para: {product_data['name']}")
             # print(f"  -> Peso Declarado (qTrib): {official_kg:.4f} kg")
             if audited_kg is not None:
                 # print(f"  -> Peso Auditado (descrição): {audited_kg:.4f} kg")
+                # Registro da auditoria para o weight_anomalies (a substituição abaixo apaga o declarado)
+                product_data['auditoriaPeso'] = {"declarado": official_kg, "auditado": audited_kg}
                 if abs(official_kg - audited_kg) > 0.01: # Compara com uma pequena tolerância
                     # print("  ** ALERTA: Discrepância encontrada! SUBSTITUINDO o peso declarado pelo auditado. **")
                     product_data['calculated_qty_kg'] = audited_kg # Substitui o valor
@@ -318,7 +383,7 @@ def parse_nfe_xml(xml_content: bytes):
         address = ", ".join(address_parts) if address_parts else ""
 
         print("DEBUG: parse_nfe_xml concluído com sucesso.")
-        return {
+        result = {
             "fornecedor": {"nome": supplier_name, "cnpj": cnpj, "address": address},
             "produtos": all_products,
             "notaFiscal": {
@@ -329,42 +394,607 @@ def parse_nfe_xml(xml_content: bytes):
                 "pesoLiquido": peso_liquido_final
             }
         }
+        if include_taxes:
+            result["notaFiscal"]["totais"] = extract_icms_totals(infNFe, ns)
+        if recover:
+            result["avisos"] = warnings
+        if verify_signature:
+            result["assinatura"] = verify_nfe_signature(infNFe)
+        return result
     except etree.XMLSyntaxError as e:
         print(f"ERRO: Erro de sintaxe no XML: {e}")
         raise HTTPException(status_code=400, detail=f"Erro de sintaxe no XML: {e}")
+    except ValueError as e:
+        logger.warning("NF-e recusada: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        # Pacote opcional ausente (ex.: cryptography para a assinatura)
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        import traceback
-        trace = traceback.format_exc()
-        print(f"ERRO: Erro inesperado em parse_nfe_xml: {e}\nTraceback: {trace}")
-        raise HTTPException(status_code=500, detail=f"Erro inesperado ao processar o XML: {e}\nTraceback: {trace}")
+        # O traceback vai só para o log do servidor; a resposta não expõe detalhes internos
+        logger.exception("Erro inesperado em parse_nfe_xml: %r", e)
+        raise HTTPException(status_code=500, detail="Erro inesperado ao processar o XML.")
 
 
-@app.post("/api/upload/")
-async def upload_file_data(file: UploadFile = File(...)):
+def ingest_nfe(conn, xml_content, rules, include_taxes=False, recover=False):
+    """
+    Grava a NF-e no repositório e devolve (parse, duplicada, conflito). Com
+    recover, um XML que o parse estrito recusa é lido em modo de recuperação:
+    o resultado parcial vem com "avisos" e não é gravado.
+    """
+    try:
+        parsed, duplicate, conflict = store_nfe(
+            conn, xml_content, lambda content: parse_nfe_xml(content, include_taxes=True, weight_rules=rules),
+            include_taxes=include_taxes,
+        )
+    except HTTPException as e:
+        if not recover or e.status_code != 400:
+            raise
+        logger.warning("%s Lendo em modo de recuperação.", e.detail)
+        return parse_nfe_xml(xml_content, include_taxes=include_taxes, weight_rules=rules, recover=True), False, False
+    if conflict:
+        logger.warning("NF-e %s recebida com conteúdo diferente do XML já gravado; mantido o gravado.",
+                       access_key_of(xml_content))
+    return parsed, duplicate, conflict
+
+
+@app.post("/api/upload/", dependencies=[Depends(get_api_key)])
+async def upload_file_data(file: UploadFile = File(...), impostos: bool = False, recuperar: bool = False,
+                           assinatura: bool = False, conn=Depends(get_db)):
     print("DEBUG: Endpoint /api/upload/ atingido.")
     
     if not file.filename.endswith('.xml'):
         print(f"ERRO: Arquivo não XML recebido: {file.filename}")
         raise HTTPException(status_code=400, detail="Apenas ficheiros XML são permitidos.")
 
+    signature = None
     try:
         print(f"DEBUG: Recebido arquivo '{file.filename}' com content-type '{file.content_type}'.")
         xml_content = await file.read()
         print(f"DEBUG: Arquivo lido, {len(xml_content)} bytes.")
-        
-        parsed_data = parse_nfe_xml(xml_content)
-        print("DEBUG: Dados do XML parseados com sucesso.")
+
+        # O tipo sai dos primeiros KB, sem montar a árvore: o que não é NF-e não passa pelo parse
+        document = detect_document(xml_content)
+        if not looks_like_nfe(xml_content, document):
+            logger.warning("Documento do tipo %s (raiz <%s>) recebido em /api/upload/.", document.kind, document.root)
+            if document.kind in ("cte", "evento"):
+                detail = f"O arquivo é um {KIND_LABELS[document.kind]}, não uma NF-e. Use /api/nfe/batch para CT-e e eventos."
+            else:
+                detail = f"O arquivo não é uma NF-e ({KIND_LABELS[document.kind]})."
+            raise HTTPException(status_code=400, detail=detail)
+
+        # Assinatura conferida no pool de verificação enquanto o parse roda aqui
+        try:
+            signature = verify_in_pool(xml_content) if assinatura else None
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # Nota já recebida (mesma chave de acesso) é servida do repositório, sem novo parse
+        rules = WeightRules(conn)
+        parsed_data, duplicate, conflict = ingest_nfe(conn, xml_content, rules, include_taxes=impostos,
+                                                      recover=recuperar)
+        rules.save()
+        logger.debug("Dados do XML %s.", 'recuperados do repositório' if duplicate else 'parseados com sucesso')
 
         if not parsed_data or not parsed_data.get("produtos"):
             print("AVISO: Nenhum produto encontrado no XML após o parse.")
             raise HTTPException(status_code=404, detail="Nenhum produto encontrado no XML. O formato pode não ser suportado.")
 
+        if conflict and signature is not None:
+            # O parse devolvido é o do XML gravado antes: a assinatura conferida tem de ser a dele
+            signature.cancel()
+            signature = verify_in_pool(get_xml(conn, document_key(xml_content)))
+
+        # Pesos fora do histórico do fornecedor (o parser já trocou o declarado pelo auditado onde divergiam)
+        weight_flags = check_note(conn, document_key(xml_content), parsed_data)
+
+        response = {**parsed_data, "chaveAcesso": access_key_of(xml_content), "duplicada": duplicate,
+                    "conflito": conflict, "anomaliasPeso": weight_flags}
+        if signature is not None:
+            response["assinatura"] = await signature
         print("DEBUG: Retornando JSONResponse com os dados dos produtos.")
-        return JSONResponse(content=parsed_data)
+        return JSONResponse(content=response)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        trace = traceback.format_exc()
-        print(f"ERRO: Exceção não capturada no endpoint /api/upload/: {e}\nTraceback: {trace}")
+        logger.exception("Exceção não capturada no endpoint /api/upload/: %r", e)
         # Retorna um erro 500 genérico para o cliente
-        raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno no servidor: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Ocorreu um erro interno no servidor.")
+    finally:
+        # Pedido recusado antes de esperar a assinatura: a verificação ainda na fila não roda
+        if signature is not None:
+            signature.cancel()
+
+
+# --- PACKING LIST ---
+
+class PackingLine(BaseModel):
+    code: str = ''
+    name: str = ''
+    ncm: str = ''
+    quantity: float = 0.0
+    units_per_package: float = 1.0
+    unit_weight: float = 0.0
+    package_type: str = 'caixa'
+    qty_kg: Optional[float] = None
+
+
+class PackingListRequest(BaseModel):
+    items: List[PackingLine]
+    pesoLiquido: float = 0.0  # get_peso_liquido da NF-e
+    pesoBruto: float = 0.0  # get_peso_bruto da NF-e
+
+
+@app.post("/api/packing-list/", dependencies=[Depends(get_api_key)])
+async def generate_packing_list(payload: PackingListRequest):
+    lines = [item.model_dump() for item in payload.items]
+    return JSONResponse(content=build_packing_list(lines, payload.pesoLiquido, payload.pesoBruto))
+
+
+
+# --- DOCUMENTOS EM PDF ---
+
+async def _pdf_response(render, data: dict, filename: str):
+    # A renderização é CPU-bound: roda no threadpool para não travar o event loop
+    pdf_bytes = await run_in_threadpool(render, data)
+    return Response(
+        content=pdf_bytes,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'inline; filename="{filename}"'},
+    )
+
+
+@app.post("/api/documents/invoice/", dependencies=[Depends(get_api_key)])
+async def invoice_pdf(data: dict):
+    return await _pdf_response(render_invoice_pdf, data, f"invoice_{data.get('invoiceNumber', '')}.pdf")
+
+
+@app.post("/api/documents/packing-list/", dependencies=[Depends(get_api_key)])
+async def packing_list_pdf(data: dict):
+    return await _pdf_response(render_packing_list_pdf, data, f"packing_list_{data.get('invoiceNumber', '')}.pdf")
+
+
+
+# --- INVOICE INCREMENTAL ---
+
+# Invoices em edição, por id de sessão. O estado vive no processo, limitado em
+# quantidade e tempo sem uso: o cliente recria a sessão (POST) se receber 404.
+invoice_sessions = InvoiceSessions()
+
+
+class InvoiceDeltas(BaseModel):
+    deltas: List[Dict[str, Any]]
+
+
+@app.post("/api/invoices/", dependencies=[Depends(get_api_key)])
+async def create_invoice_session(data: dict):
+    model = InvoiceModel(data)
+    session_id = uuid.uuid4().hex
+    invoice_sessions.put(session_id, model)
+    return {"id": session_id, "lineIds": list(model.lines), "costIds": list(model.costs), "totals": model.totals()}
+
+
+@app.patch("/api/invoices/{session_id}", dependencies=[Depends(get_api_key)])
+async def apply_invoice_deltas(session_id: str, payload: InvoiceDeltas):
+    model = invoice_sessions.get(session_id)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Sessão de invoice não encontrada.")
+    changed = []
+    try:
+        for delta in payload.deltas:
+            affected = model.apply_delta(delta)
+            if affected in model.lines:
+                changed.append(affected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Mudança de PTAX altera preço de todas as linhas; o cliente recalcula localmente
+    return {
+        "affected": [model.line_totals(line_id) for line_id in dict.fromkeys(changed)],
+        "costIds": list(model.costs),
+        "totals": model.totals(),
+    }
+
+
+@app.get("/api/invoices/{session_id}", dependencies=[Depends(get_api_key)])
+async def get_invoice_totals(session_id: str, full: bool = False):
+    model = invoice_sessions.get(session_id)
+    if model is None:
+        raise HTTPException(status_code=404, detail="Sessão de invoice não encontrada.")
+    return {"totals": model.recompute() if full else model.totals()}
+
+
+
+# --- CONCILIAÇÃO XML x ORDEM DE COMPRA ---
+
+class ReconcileRequest(BaseModel):
+    nfe: Dict[str, Any]  # saída do /api/upload/
+    items: List[Dict[str, Any]]  # order.items da ordem de compra
+    suppliers: List[Dict[str, Any]]
+    fuzzy: bool = False
+    threshold: float = 0.75
+
+
+@app.post("/api/purchase-orders/reconcile/", dependencies=[Depends(get_api_key)])
+async def reconcile_order(payload: ReconcileRequest):
+    try:
+        result = reconcile_purchase_order(payload.nfe, payload.items, payload.suppliers,
+                                          fuzzy=payload.fuzzy, threshold=payload.threshold)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return JSONResponse(content=result)
+
+
+
+# --- CASAMENTO DE PRODUTOS POR NOME ---
+
+# Índice do catálogo mantido entre requisições; reconstruído só quando o catálogo muda
+product_matcher: Optional[ProductMatcher] = None
+
+
+class CatalogRequest(BaseModel):
+    items: List[Dict[str, Any]]  # linhas da tabela items (id, code, name, name_en, units_per_package, unit_weight)
+
+
+class MatchRequest(BaseModel):
+    produtos: List[Dict[str, Any]]  # "produtos" retornados pelo /api/upload/
+    top_k: int = 5
+    min_score: float = 0.3
+
+
+@app.post("/api/matching/catalog/", dependencies=[Depends(get_api_key)])
+async def load_matching_catalog(payload: CatalogRequest):
+    global product_matcher
+    if product_matcher is None or product_matcher.fingerprint != catalog_fingerprint(payload.items):
+        product_matcher = await run_in_threadpool(ProductMatcher, payload.items)
+    return {"fingerprint": product_matcher.fingerprint, "items": len(product_matcher.items)}
+
+
+@app.post("/api/matching/", dependencies=[Depends(get_api_key)])
+async def match_products(payload: MatchRequest):
+    if product_matcher is None:
+        raise HTTPException(status_code=409, detail="Catálogo não carregado. Envie os itens para /api/matching/catalog/.")
+    products = []
+    for product in payload.produtos:
+        # Peso de um volume segundo a descrição (ex: 12x400g -> 4.8 kg) como dica para o ranking
+        weight_hint, _ = calculate_audited_weight(product.get('name', ''), 1.0)
+        products.append({"code": product.get('code', ''), "name": product.get('name', ''), "weight_hint": weight_hint})
+    results = await run_in_threadpool(product_matcher.match_products, products, payload.top_k, payload.min_score)
+    return {"fingerprint": product_matcher.fingerprint, "resultados": results}
+
+
+
+# --- SINCRONIZAÇÃO INCREMENTAL ---
+
+@app.get("/api/sync/{table}", dependencies=[Depends(get_api_key)])
+def sync_table(table: str, since: Optional[str] = None, cursor: Optional[str] = None,
+               limit: int = 1000, deleted_since: Optional[str] = None, conn=Depends(get_db)):
+    try:
+        return fetch_changes(conn, table, since=since, cursor=cursor, limit=limit, deleted_since=deleted_since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+
+# --- RELATÓRIOS ---
+
+@app.get("/api/reports/daily-movements", dependencies=[Depends(get_api_key)])
+def report_daily_movements(start: str, end: str, conn=Depends(get_db)):
+    try:
+        return {"dias": daily_movements(conn, start, end)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/reports/fiscal", dependencies=[Depends(get_api_key)])
+def report_fiscal(year: int, supplier: Optional[str] = None, conn=Depends(get_db)):
+    return fiscal_report(conn, year, supplier)
+
+
+@app.get("/api/reports/products", dependencies=[Depends(get_api_key)])
+def report_products(period: Optional[int] = None, top: int = 5, conn=Depends(get_db)):
+    return product_ranking(conn, period, top)
+
+
+
+# --- MOVIMENTAÇÕES E ROLLUPS ---
+
+class MovementsRequest(BaseModel):
+    movements: List[Dict[str, Any]]
+
+
+@app.post("/api/movements/", dependencies=[Depends(get_api_key)])
+def create_movements(payload: MovementsRequest, conn=Depends(get_db)):
+    try:
+        ids = insert_movements(conn, payload.movements)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ids": ids}
+
+
+@app.get("/api/reports/rollups", dependencies=[Depends(get_api_key)])
+def report_rollups(granularity: str = 'month', group: str = 'item', start: Optional[str] = None,
+                   end: Optional[str] = None, supplier_id: Optional[str] = None, conn=Depends(get_db)):
+    try:
+        return {"linhas": rollup_summary(conn, granularity, group, start, end, supplier_id)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+
+# --- BACKUP E RESTAURAÇÃO ---
+
+def _backup_stream():
+    # Conexão própria: o gerador roda depois que o endpoint já retornou
+    conn = get_connection()
+    try:
+        yield from iter_backup_gzip(conn)
+    finally:
+        conn.close()
+
+
+@app.get("/api/backup/", dependencies=[Depends(get_api_key)])
+def download_backup():
+    filename = f"backup_estoque_{datetime.now().strftime('%Y-%m-%d')}.ndjson.gz"
+    return StreamingResponse(
+        _backup_stream(),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.post("/api/restore/", dependencies=[Depends(get_api_key)])
+async def upload_restore(file: UploadFile = File(...), workers: int = 1, batch_size: int = 1000):
+    try:
+        counts = await run_in_threadpool(restore_backup_file, file.file, None, batch_size, workers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"restaurados": counts}
+
+
+
+# --- SALDO DE ESTOQUE EM DATA PASSADA ---
+
+@app.get("/api/stock/at", dependencies=[Depends(get_api_key)])
+def stock_on_date(date: str, item_id: Optional[str] = None, conn=Depends(get_db)):
+    try:
+        if item_id:
+            return {"date": date, "item_id": item_id, "saldo": stock_at(conn, date, item_id)}
+        return {"date": date, "saldos": catalog_stock_at(conn, date)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/reports/valuation", dependencies=[Depends(get_api_key)])
+def report_valuation(method: str = 'average', date: Optional[str] = None, item_id: Optional[str] = None,
+                     conn=Depends(get_db)):
+    try:
+        return valuation(conn, method, date, item_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/reports/weight-anomalies", dependencies=[Depends(get_api_key)])
+def report_weight_anomalies(start: Optional[str] = None, end: Optional[str] = None, limit: int = 1000,
+                            conn=Depends(get_db)):
+    return scan_weights(conn, _iso_date(start), _iso_date(end), min(limit, 10_000))
+
+
+
+# --- NORMALIZAÇÃO DE UNIDADES ---
+
+class UnitsRequest(BaseModel):
+    descriptions: List[str]
+
+
+@app.post("/api/units/normalize", dependencies=[Depends(get_api_key)])
+def normalize_units(payload: UnitsRequest):
+    return {"resultados": normalize_descriptions(payload.descriptions)}
+
+
+class WeightRuleRequest(BaseModel):
+    unitsPerPackage: Optional[float] = None
+    unitMeasureValue: Optional[float] = None
+    unitMeasureType: Optional[str] = None  # None: produto sem peso na descrição
+
+
+@app.get("/api/weight-rules/{cnpj}", dependencies=[Depends(get_api_key)])
+def get_weight_rules(cnpj: str, conn=Depends(get_db)):
+    return {"regras": list_rules(conn, cnpj)}
+
+
+@app.put("/api/weight-rules/{cnpj}/{code}", dependencies=[Depends(get_api_key)])
+def put_weight_rule(cnpj: str, code: str, payload: WeightRuleRequest, conn=Depends(get_db)):
+    """Regra manual de embalagem: prevalece sobre a descrição nas próximas notas do fornecedor."""
+    try:
+        return set_rule(conn, cnpj, code, payload.unitsPerPackage, payload.unitMeasureValue, payload.unitMeasureType)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/api/weight-rules/{cnpj}", dependencies=[Depends(get_api_key)])
+def delete_weight_rules(cnpj: str, code: Optional[str] = None, source: Optional[str] = None, conn=Depends(get_db)):
+    try:
+        return {"removidas": delete_rules(conn, cnpj, code, source)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+
+# --- IMPORTAÇÃO DE PLANILHA DE ITENS ---
+
+@app.post("/api/import/items", dependencies=[Depends(get_api_key)])
+def import_items(file: UploadFile = File(...), conn=Depends(get_db)):
+    """Compara a planilha (XLSX ou CSV) com os itens cadastrados pelo código, sem gravar."""
+    try:
+        return diff_item_file(conn, file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+# --- REPOSITÓRIO DE NF-e ---
+
+@app.get("/api/nfe/", dependencies=[Depends(get_api_key)])
+def list_nfe(cnpj: Optional[str] = None, numero: Optional[str] = None, serie: Optional[str] = None,
+             start: Optional[str] = None, end: Optional[str] = None, limit: int = 100, conn=Depends(get_db)):
+    return {"notas": search_documents(conn, cnpj, numero, serie, start, end, min(limit, 1000))}
+
+
+@app.get("/api/nfe/{access_key}", dependencies=[Depends(get_api_key)])
+def get_nfe(access_key: str, impostos: bool = False, reprocessar: bool = False, assinatura: bool = False,
+            conn=Depends(get_db)):
+    if reprocessar:
+        # Parse de novo a partir do XML arquivado, com o parser atual
+        stream = open_xml(conn, access_key)
+        if stream is None:
+            raise HTTPException(status_code=404, detail="NF-e não encontrada.")
+        try:
+            with stream:
+                return parse_nfe_xml(stream, include_taxes=impostos, verify_signature=assinatura)
+        except HTTPException as e:
+            if e.status_code != 400:
+                raise
+            # Declaração que não bate com os bytes (UTF-8 declarado, Latin-1 gravado): o caminho de bytes refaz o parse
+            return parse_nfe_xml(get_xml(conn, access_key), include_taxes=impostos, verify_signature=assinatura)
+    parsed = get_parsed(conn, access_key, include_taxes=impostos)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="NF-e não encontrada.")
+    result = {**parsed, "cancelada": is_cancelled(conn, access_key)}
+    if assinatura:
+        # O parse gravado não guarda a assinatura: confere sobre o XML arquivado
+        try:
+            result["assinatura"] = verify_xml_signature(get_xml(conn, access_key))
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    return result
+
+
+@app.get("/api/nfe/{access_key}/events", dependencies=[Depends(get_api_key)])
+def get_nfe_events(access_key: str, conn=Depends(get_db)):
+    return {"eventos": list_events(conn, access_key), "cancelada": is_cancelled(conn, access_key)}
+
+
+@app.post("/api/nfe/batch", dependencies=[Depends(get_api_key)])
+async def upload_batch(files: List[UploadFile] = File(...), recuperar: bool = False, assinatura: bool = False,
+                       conn=Depends(get_db)):
+    """
+    Lote misto de XMLs: cada arquivo é identificado pelo primeiro elemento e
+    vai para o parser do seu tipo. NF-e/NFC-e são gravadas no repositório,
+    eventos marcam as notas (cancelamento) e CT-e são só lidos; o resto é
+    recusado sem parse. Com assinatura=true, as assinaturas das NF-e são
+    conferidas no pool de verificação em paralelo com o lote.
+    """
+    rules = WeightRules(conn)
+    results = []
+    signatures = []
+    for file in files:
+        xml_content = await file.read()
+        document = detect_document(xml_content)
+        result = {"arquivo": file.filename, "tipo": document.kind, "versao": document.version,
+                  "chaveAcesso": document.access_key}
+        signature = None
+        try:
+            if looks_like_nfe(xml_content, document):
+                signature = verify_in_pool(xml_content) if assinatura else None
+                parsed, duplicate, conflict = ingest_nfe(conn, xml_content, rules, recover=recuperar)
+                if conflict and signature is not None:
+                    signature.cancel()
+                    signature = verify_in_pool(get_xml(conn, document_key(xml_content)))
+                if signature is not None:
+                    signatures.append((result, signature))
+                    signature = None
+                result.update(duplicada=duplicate, conflito=conflict, produtos=len(parsed.get("produtos", [])),
+                              cancelada=is_cancelled(conn, document_key(xml_content)))
+                if "avisos" in parsed:
+                    result["avisos"] = parsed["avisos"]
+            elif document.kind == "evento":
+                event = parse_event(xml_content)
+                result.update(evento=event, notaEncontrada=record_event(conn, event, xml_content))
+            elif document.kind == "cte":
+                result["cte"] = parse_cte(xml_content)
+            else:
+                result["erro"] = f"Tipo de documento não suportado: {KIND_LABELS[document.kind]}"
+        except HTTPException as e:
+            result["erro"] = e.detail
+        except ValueError as e:
+            result["erro"] = str(e)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            # Arquivo recusado: a assinatura dele não é esperada
+            if signature is not None:
+                signature.cancel()
+        results.append(result)
+    rules.save()
+    for result, signature in signatures:
+        result["assinatura"] = await signature
+    summary = {}
+    for result in results:
+        key = "erros" if "erro" in result else result["tipo"]
+        summary[key] = summary.get(key, 0) + 1
+    return {"resumo": summary, "arquivos": results}
+
+
+@app.get("/api/nfe/{access_key}/xml", dependencies=[Depends(get_api_key)])
+def get_nfe_xml(access_key: str, conn=Depends(get_db)):
+    xml_content = get_xml(conn, access_key)
+    if xml_content is None:
+        raise HTTPException(status_code=404, detail="NF-e não encontrada.")
+    return Response(content=xml_content, media_type="application/xml")
+
+
+@app.get("/api/nfe/{access_key}/prices", dependencies=[Depends(get_api_key)])
+def get_nfe_price_trends(access_key: str, limite: float = 0.15, conn=Depends(get_db)):
+    """Preços da nota contra o histórico do fornecedor, com alerta nos que variam mais que `limite`."""
+    parsed = get_parsed(conn, access_key)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="NF-e não encontrada.")
+    trends = price_trends(conn, access_key, parsed, threshold=limite)
+    return {"produtos": trends, "alertas": sum(trend["alerta"] for trend in trends)}
+
+
+@app.post("/api/nfe-archive/train", dependencies=[Depends(get_api_key)])
+def train_nfe_archive(conn=Depends(get_db)):
+    """Treina o dicionário zstd com as notas gravadas e recomprime o acervo com ele."""
+    try:
+        dictionary = train_archive(conn)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"dicionario": dictionary, "recomprimidas": recompress_documents(conn), "acervo": archive_stats(conn)}
+
+
+@app.get("/api/nfe-archive/stats", dependencies=[Depends(get_api_key)])
+def nfe_archive_stats(conn=Depends(get_db)):
+    return {"acervo": archive_stats(conn)}
+
+
+@app.get("/api/nfe-signature/stats", dependencies=[Depends(get_api_key)])
+def nfe_signature_stats():
+    """Contagem de verificações de assinatura, latência (p50/p95) e uso do cache de certificados."""
+    return {"assinaturas": signature_stats()}
+
+
+# --- HISTÓRICO DE PREÇOS ---
+
+def _iso_date(value):
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Data inválida: {value} (use AAAA-MM-DD)")
+    return parsed.isoformat()
+
+
+@app.get("/api/prices/{cnpj}/{code}", dependencies=[Depends(get_api_key)])
+def get_price_history(cnpj: str, code: str, start: Optional[str] = None, end: Optional[str] = None,
+                      conn=Depends(get_db)):
+    return {
+        "ultimo": last_price(conn, cnpj, code),
+        "serie": price_series(conn, cnpj, code, _iso_date(start), _iso_date(end)),
+    }
@@ -0,0 +1,331 @@
+"""
+Modelo de invoice com recálculo incremental.
+
+O editor do invoice.js reconstrói todos os totais a cada edição. Aqui cada linha
+contribui para somas correntes (volumes, peso líquido e subtotal em BRL); uma
+alteração remove a contribuição antiga e soma a nova, sem varrer as demais
+linhas. Como o total em USD é Σ(qty_kg * price) / ptax, trocar a PTAX também é
+O(1): só a divisão final muda.
+
+A distribuição de custo do invoice.js (invoiceData.distribution) reajusta o
+preço de cada linha com qty > 0 na proporção de price * qty, o que equivale a
+multiplicar todos esses preços pelo mesmo fator: as somas correntes guardam
+Σ price * qty e Σ qty_kg * price das linhas com qty > 0, e o fator sai delas.
+O invoice.js ainda arredonda o preço reajustado a 4 casas; aqui não, para que o
+incremental e o recálculo completo deem o mesmo resultado (diferença abaixo de
+0,0001 por kg em relação à tela).
+
+Este módulo é a única implementação dos totais: documents.py usa as mesmas
+funções para o PDF.
+"""
+import itertools
+import time
+from collections import OrderedDict
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _line_values(item):
+    """
+    Contribuição de uma linha: (volumes, kg, total em BRL, total em BRL se
+    qty > 0, price * qty). Os dois últimos alimentam a distribuição de custo.
+    """
+    qty = _to_float(item.get('qty'))
+    qty_kg = _to_float(item.get('qty_kg'))
+    price = _to_float(item.get('price'))
+    total_brl = qty_kg * price
+    return qty, qty_kg, total_brl, total_brl if qty > 0 else 0.0, price * qty
+
+
+def distribution_factor(distribution, weighted_brl):
+    """
+    Fator aplicado pela distribuição de custo aos preços das linhas com qty > 0
+    (updatePreview() do invoice.js); None se ela estiver desligada ou não houver
+    base (Σ price * qty <= 0), caso em que os preços ficam como estão.
+    """
+    if not distribution or not distribution.get('active') or weighted_brl <= 0:
+        return None
+    value = _to_float(distribution.get('value'))
+    amount = weighted_brl * value / 100 if distribution.get('type') == 'percentage' else value
+    return 1 + amount / weighted_brl
+
+
+def line_price(item, factor):
+    """Preço em BRL da linha depois da distribuição (factor de distribution_factor)."""
+    if factor is None:
+        return _to_float(item.get('price'))
+    return _to_float(item.get('price')) * factor if _to_float(item.get('qty')) > 0 else 0.0
+
+
+def price_factor(lines, distribution):
+    """distribution_factor sobre um conjunto de linhas."""
+    return distribution_factor(distribution, sum(_line_values(item)[4] for item in lines))
+
+
+def full_totals(lines, costs, ptax_rate, manual_net=0.0, manual_gross=0.0, nota_fiscal=None, distribution=None):
+    """Recalcula os totais do zero (mesma regra do updatePreview() do invoice.js)."""
+    packages = net = subtotal_brl = positive_brl = weighted_brl = 0.0
+    for item in lines:
+        qty, qty_kg, total_brl, positive, weighted = _line_values(item)
+        packages += qty
+        net += qty_kg
+        subtotal_brl += total_brl
+        positive_brl += positive
+        weighted_brl += weighted
+    factor = distribution_factor(distribution, weighted_brl)
+    if factor is not None:
+        subtotal_brl = positive_brl * factor
+    costs_brl = sum(_to_float(cost.get('value')) for cost in costs)
+    return _summarize(packages, net, subtotal_brl, costs_brl, ptax_rate, manual_net, manual_gross, nota_fiscal)
+
+
+def _summarize(packages, net, subtotal_brl, costs_brl, ptax_rate, manual_net, manual_gross, nota_fiscal):
+    ptax_rate = _to_float(ptax_rate)
+    divisor = ptax_rate if ptax_rate > 0 else 1.0
+    nota_fiscal = nota_fiscal or {}
+
+    final_net = _to_float(nota_fiscal.get('pesoLiquido')) or net
+    final_gross = _to_float(nota_fiscal.get('pesoBruto')) or final_net * 1.035
+    if _to_float(manual_net) > 0:
+        final_net = _to_float(manual_net)
+    if _to_float(manual_gross) > 0:
+        final_gross = _to_float(manual_gross)
+
+    product_subtotal = subtotal_brl / divisor
+    costs_subtotal = costs_brl / divisor
+    return {
+        "totalPackages": packages,
+        "netWeight": final_net,
+        "grossWeight": final_gross,
+        "productSubtotal": product_subtotal,
+        "costsSubtotal": costs_subtotal,
+        "grandTotal": product_subtotal + costs_subtotal,
+    }
+
+
+class InvoiceModel:
+    """
+    Estado de uma invoice em edição.
+
+    As linhas recebem ids estáveis ("grupo.item", igual ao data-target-id do
+    invoice.js) para que remoções não desloquem os índices das demais.
+    """
+
+    def __init__(self, data):
+        self.ptax_rate = _to_float(data.get('ptaxRate'))
+        self.manual_net = _to_float(data.get('manualNetWeight'))
+        self.manual_gross = _to_float(data.get('manualGrossWeight'))
+        self.nota_fiscal = data.get('notaFiscal') or {}
+        self.distribution = dict(data.get('distribution') or {})
+        self.lines = {}
+        self.costs = {}
+        self._packages = 0.0
+        self._net = 0.0
+        self._subtotal_brl = 0.0
+        self._positive_brl = 0.0
+        self._weighted_brl = 0.0
+        self._costs_brl = 0.0
+        self._cost_ids = itertools.count()
+        # Ids de linhas novas nunca se repetem, mesmo depois de remoções
+        self._line_ids = itertools.count()
+
+        for group_index, supplier in enumerate(data.get('suppliers') or []):
+            for item_index, item in enumerate(supplier.get('items') or []):
+                self._add_line(f"{group_index}.{item_index}", dict(item, group=group_index))
+        for cost in data.get('costs') or []:
+            self._add_cost(dict(cost))
+
+    # --- Somas correntes ---
+
+    def _apply(self, item, sign):
+        qty, qty_kg, total_brl, positive, weighted = _line_values(item)
+        self._packages += sign * qty
+        self._net += sign * qty_kg
+        self._subtotal_brl += sign * total_brl
+        self._positive_brl += sign * positive
+        self._weighted_brl += sign * weighted
+
+    def _factor(self):
+        return distribution_factor(self.distribution, self._weighted_brl)
+
+    def _add_line(self, line_id, item):
+        if line_id in self.lines:
+            raise ValueError(f"Linha '{line_id}' já existe.")
+        self.lines[line_id] = item
+        self._apply(item, 1)
+
+    def _add_cost(self, cost):
+        cost_id = str(next(self._cost_ids))
+        self.costs[cost_id] = cost
+        self._costs_brl += _to_float(cost.get('value'))
+        return cost_id
+
+    def _get(self, collection, key, label):
+        if key not in collection:
+            raise ValueError(f"{label} '{key}' não encontrado.")
+        return collection[key]
+
+    # --- Deltas ---
+
+    def apply_delta(self, delta):
+        """
+        Aplica uma alteração e devolve o id afetado (quando houver).
+
+        Operações: set_line, add_line, remove_line, add_cost, set_cost,
+        remove_cost, set_ptax, set_weights, set_distribution.
+        """
+        op = delta.get('op')
+        if op == 'set_line':
+            item = self._get(self.lines, delta.get('id'), 'Linha')
+            self._apply(item, -1)
+            item.update(delta.get('fields') or {})
+            self._apply(item, 1)
+            return delta['id']
+        if op == 'add_line':
+            group = int(delta.get('group', 0))
+            line_id = delta.get('id')
+            while not line_id or line_id in self.lines and not delta.get('id'):
+                # Contador da sessão; pula ids que o cliente já tenha usado
+                line_id = f"{group}.n{next(self._line_ids)}"
+            self._add_line(line_id, dict(delta.get('fields') or {}, group=group))
+            return line_id
+        if op == 'remove_line':
+            item = self._get(self.lines, delta.get('id'), 'Linha')
+            del self.lines[delta['id']]
+            self._apply(item, -1)
+            return delta['id']
+        if op == 'add_cost':
+            return self._add_cost({'desc': delta.get('desc', ''), 'value': delta.get('value', 0)})
+        if op == 'set_cost':
+            cost = self._get(self.costs, str(delta.get('id')), 'Custo')
+            self._costs_brl -= _to_float(cost.get('value'))
+            cost.update(delta.get('fields') or {})
+            self._costs_brl += _to_float(cost.get('value'))
+            return str(delta['id'])
+        if op == 'remove_cost':
+            cost = self._get(self.costs, str(delta.get('id')), 'Custo')
+            del self.costs[str(delta['id'])]
+            self._costs_brl -= _to_float(cost.get('value'))
+            return str(delta['id'])
+        if op == 'set_ptax':
+            self.ptax_rate = _to_float(delta.get('value'))
+            return None
+        if op == 'set_weights':
+            if 'manualNetWeight' in delta:
+                self.manual_net = _to_float(delta['manualNetWeight'])
+            if 'manualGrossWeight' in delta:
+                self.manual_gross = _to_float(delta['manualGrossWeight'])
+            return None
+        if op == 'set_distribution':
+            # Muda o preço de todas as linhas: como no set_ptax, o cliente redesenha a tabela
+            self.distribution.update(delta.get('fields') or {})
+            return None
+        raise ValueError(f"Operação desconhecida: {op}")
+
+    def line_totals(self, line_id):
+        """Preço e total em USD de uma linha (o que o editor precisa redesenhar)."""
+        item = self._get(self.lines, line_id, 'Linha')
+        divisor = self.ptax_rate if self.ptax_rate > 0 else 1.0
+        price = line_price(item, self._factor())
+        qty_kg = _line_values(item)[1]
+        return {
+            "id": line_id,
+            "qty_kg": qty_kg,
+            "priceUSD": price / divisor,
+            "totalUSD": qty_kg * price / divisor,
+        }
+
+    def totals(self):
+        """Totais a partir das somas correntes (O(1))."""
+        factor = self._factor()
+        subtotal_brl = self._subtotal_brl if factor is None else self._positive_brl * factor
+        return _summarize(self._packages, self._net, subtotal_brl, self._costs_brl,
+                          self.ptax_rate, self.manual_net, self.manual_gross, self.nota_fiscal)
+
+    def recompute(self):
+        """Totais varrendo todas as linhas; também zera o erro de arredondamento acumulado."""
+        result = full_totals(self.lines.values(), self.costs.values(), self.ptax_rate,
+                             self.manual_net, self.manual_gross, self.nota_fiscal, self.distribution)
+        values = [_line_values(item) for item in self.lines.values()]
+        self._packages, self._net, self._subtotal_brl, self._positive_brl, self._weighted_brl = (
+            [sum(column) for column in zip(*values)] if values else [0.0] * 5)
+        self._costs_brl = sum(_to_float(cost.get('value')) for cost in self.costs.values())
+        return result
+
+
+class InvoiceSessions:
+    """
+    Invoices em edição por id de sessão, no processo. Limitado em quantidade
+    (as menos usadas saem primeiro) e em tempo sem uso; no serverless cada
+    instância tem o seu, e o cliente recria a sessão (POST) ao receber 404.
+    """
+
+    def __init__(self, max_sessions=256, ttl=2 * 3600, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+        self.sessions = OrderedDict()
+
+    def _expire(self, now):
+        while self.sessions:
+            session_id, (_, last_used) = next(iter(self.sessions.items()))
+            if now - last_used <= self.ttl and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+
+    def put(self, session_id, model):
+        now = self.clock()
+        self.sessions[session_id] = (model, now)
+        self.sessions.move_to_end(session_id)
+        self._expire(now)
+
+    def get(self, session_id):
+        now = self.clock()
+        self._expire(now)
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        self.sessions[session_id] = (entry[0], now)
+        self.sessions.move_to_end(session_id)
+        return entry[0]
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+if __name__ == "__main__":
+    # Benchmark de deltas (a conferência incremental x completo está em tests/test_invoice.py): python -m api.invoice
+    import random
+
+    random.seed(7)
+    data = {
+        "ptaxRate": 5.2,
+        "costs": [{"desc": "FREIGHT", "value": 1200}],
+        "suppliers": [{"items": [
+            {"qty": random.randint(1, 50), "qty_kg": random.uniform(1, 400), "price": random.uniform(5, 60)}
+            for _ in range(5_000)
+        ]} for _ in range(4)],
+    }
+    model = InvoiceModel(data)
+    line_ids = list(model.lines)
+
+    start = time.perf_counter()
+    for step in range(10_000):
+        choice = step % 4
+        if choice == 0:
+            model.apply_delta({"op": "set_line", "id": random.choice(line_ids),
+                               "fields": {"qty_kg": random.uniform(1, 400), "price": random.uniform(5, 60)}})
+        elif choice == 1:
+            model.apply_delta({"op": "add_cost", "desc": "EXTRA", "value": random.uniform(10, 100)})
+        elif choice == 2:
+            model.apply_delta({"op": "set_ptax", "value": random.uniform(4.8, 5.6)})
+        else:
+            model.apply_delta({"op": "set_line", "id": random.choice(line_ids), "fields": {"qty": random.randint(1, 50)}})
+        model.totals()
+    elapsed = time.perf_counter() - start
+    print(f"10000 deltas em 20000 linhas: {elapsed * 1000:.1f} ms ({elapsed / 10_000 * 1e6:.1f} us/delta)")
@@ -0,0 +1,160 @@
+"""
+Razão de estoque com consulta de saldo em qualquer data.
+
+items.quantity guarda só o saldo atual e movements é um log append-only, então
+saber "qual era o estoque do item X no dia D" exigiria reprocessar todo o
+histórico. Este módulo mantém snapshots mensais do saldo acumulado por item
+(stock_snapshots), gravados apenas nos meses em que o item teve movimentação.
+
+Saldo em D = último snapshot anterior ao mês de D (busca no índice
+(item_id, period), logarítmica) + movimentações do próprio mês até D. Como um
+item sem snapshot num mês não se moveu nele, a janela de deltas é a mesma
+para todos os itens, o que permite valorizar o catálogo inteiro numa consulta.
+
+insert_movements (rollups.py) chama apply_deltas; UPDATE e DELETE em
+movements são compensados por triggers com a mesma regra (o snapshot do mês
+e dos meses seguintes do item).
+
+    python -m api.ledger rebuild [database_path]
+"""
+from datetime import date, timedelta
+
+from .db import ensure_schema, get_connection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    item_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    balance REAL NOT NULL,
+    PRIMARY KEY (item_id, period)
+);
+CREATE INDEX IF NOT EXISTS idx_movements_date ON movements(date);
+CREATE INDEX IF NOT EXISTS idx_movements_item_date ON movements(item_id, date);
+CREATE TRIGGER IF NOT EXISTS trg_stock_snapshots_movement_delete AFTER DELETE ON movements
+BEGIN
+    UPDATE stock_snapshots SET balance = balance - (CASE WHEN OLD.type = 'in' THEN OLD.quantity ELSE -OLD.quantity END)
+    WHERE item_id = OLD.item_id AND period >= substr(OLD.date, 1, 7);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stock_snapshots_movement_update AFTER UPDATE OF item_id, type, quantity, date ON movements
+BEGIN
+    UPDATE stock_snapshots SET balance = balance - (CASE WHEN OLD.type = 'in' THEN OLD.quantity ELSE -OLD.quantity END)
+    WHERE item_id = OLD.item_id AND period >= substr(OLD.date, 1, 7);
+    INSERT INTO stock_snapshots (item_id, period, balance)
+    SELECT NEW.item_id, substr(NEW.date, 1, 7), COALESCE((
+        SELECT balance FROM stock_snapshots
+        WHERE item_id = NEW.item_id AND period < substr(NEW.date, 1, 7) ORDER BY period DESC LIMIT 1), 0)
+    WHERE NEW.item_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM stock_snapshots WHERE item_id = NEW.item_id AND period = substr(NEW.date, 1, 7));
+    UPDATE stock_snapshots SET balance = balance + (CASE WHEN NEW.type = 'in' THEN NEW.quantity ELSE -NEW.quantity END)
+    WHERE item_id = NEW.item_id AND period >= substr(NEW.date, 1, 7);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_stock_snapshots_item_delete AFTER DELETE ON items
+BEGIN
+    DELETE FROM stock_snapshots WHERE item_id = OLD.id;
+END;
+"""
+
+SIGNED_QUANTITY = "CASE WHEN type = 'in' THEN quantity ELSE -quantity END"
+
+
+def _window(on_date):
+    """Início do mês de `on_date` e o dia seguinte (limite exclusivo), em ISO."""
+    try:
+        day = date.fromisoformat(on_date[:10])
+    except ValueError:
+        raise ValueError(f"Data inválida: {on_date} (use AAAA-MM-DD)")
+    return day.replace(day=1).isoformat(), (day + timedelta(days=1)).isoformat()
+
+
+def apply_deltas(conn, deltas):
+    """
+    Atualiza os snapshots com variações {(item_id, 'AAAA-MM'): quantidade}.
+
+    Chamado na mesma transação do INSERT das movimentações. Uma movimentação
+    retroativa também corrige os snapshots dos meses seguintes do item.
+    """
+    ensure_schema(conn, SCHEMA, "ledger")
+    for (item_id, period), delta in deltas.items():
+        if not delta:
+            continue
+        previous = conn.execute(
+            "SELECT balance FROM stock_snapshots WHERE item_id = ? AND period < ? ORDER BY period DESC LIMIT 1",
+            (item_id, period),
+        ).fetchone()
+        conn.execute(
+            "INSERT INTO stock_snapshots (item_id, period, balance) VALUES (?, ?, ?) "
+            "ON CONFLICT (item_id, period) DO NOTHING",
+            (item_id, period, previous[0] if previous else 0.0),
+        )
+        conn.execute(
+            "UPDATE stock_snapshots SET balance = balance + ? WHERE item_id = ? AND period >= ?",
+            (delta, item_id, period),
+        )
+
+
+def rebuild_snapshots(conn):
+    """Recalcula todos os snapshots a partir da tabela movements (backfill)."""
+    ensure_schema(conn, SCHEMA, "ledger")
+    with conn:
+        conn.execute("DELETE FROM stock_snapshots")
+        conn.execute(f"""
+            INSERT INTO stock_snapshots (item_id, period, balance)
+            SELECT item_id, period, SUM(delta) OVER (PARTITION BY item_id ORDER BY period)
+            FROM (
+                SELECT item_id, substr(date, 1, 7) AS period, SUM({SIGNED_QUANTITY}) AS delta
+                FROM movements
+                WHERE item_id IS NOT NULL
+                GROUP BY item_id, period
+            )
+        """)
+    return conn.execute("SELECT COUNT(*) FROM stock_snapshots").fetchone()[0]
+
+
+def stock_at(conn, on_date, item_id):
+    """Saldo de um item ao fim do dia `on_date` (AAAA-MM-DD)."""
+    ensure_schema(conn, SCHEMA, "ledger")
+    month_start, next_day = _window(on_date)
+    snapshot = conn.execute(
+        "SELECT balance FROM stock_snapshots WHERE item_id = ? AND period < ? ORDER BY period DESC LIMIT 1",
+        (item_id, month_start[:7]),
+    ).fetchone()
+    delta = conn.execute(
+        f"SELECT COALESCE(SUM({SIGNED_QUANTITY}), 0) FROM movements WHERE item_id = ? AND date >= ? AND date < ?",
+        (item_id, month_start, next_day),
+    ).fetchone()[0]
+    return (snapshot[0] if snapshot else 0.0) + delta
+
+
+def catalog_stock_at(conn, on_date):
+    """Saldo de todos os itens ao fim do dia `on_date`: {item_id: saldo}."""
+    ensure_schema(conn, SCHEMA, "ledger")
+    month_start, next_day = _window(on_date)
+    balances = {
+        row[0]: row[1] or 0.0
+        for row in conn.execute(
+            "SELECT i.id, (SELECT balance FROM stock_snapshots s WHERE s.item_id = i.id AND s.period < ? "
+            "ORDER BY s.period DESC LIMIT 1) FROM items i",
+            (month_start[:7],),
+        )
+    }
+    for item_id, delta in conn.execute(
+        f"SELECT item_id, SUM({SIGNED_QUANTITY}) FROM movements WHERE date >= ? AND date < ? "
+        "AND item_id IS NOT NULL GROUP BY item_id",
+        (month_start, next_day),
+    ):
+        balances[item_id] = balances.get(item_id, 0.0) + delta
+    return balances
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python -m api.ledger rebuild [database_path]")
+        sys.exit(1)
+
+    conn = get_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+    start = time.perf_counter()
+    count = rebuild_snapshots(conn)
+    print(f"{count} snapshots reconstruídos em {time.perf_counter() - start:.2f} s")
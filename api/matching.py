@@ -0,0 +1,153 @@
+"""
+Motor de casamento por nome entre produtos da NF-e e o catálogo de itens.
+
+Os códigos do <cProd> do fornecedor raramente batem com items.code, então o
+casamento é feito pelo nome. O catálogo (items.name e items.name_en) é
+normalizado (sem acentos, minúsculas) e quebrado em trigramas; cada trigrama
+aponta para um array NumPy com os documentos que o contêm. Uma consulta soma as
+ocorrências com np.bincount e pontua pelo coeficiente de Dice, o que mantém uma
+nota de 200 itens contra 50 mil produtos abaixo de 1 segundo.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+import numpy as np
+
+from .reconcile import normalize_name
+
+# Bônus máximo somado ao score quando o peso por volume bate com o cadastro
+WEIGHT_HINT_BONUS = 0.15
+WEIGHT_HINT_TOLERANCE = 0.10
+
+
+def trigrams(text):
+    """Conjunto de trigramas do texto normalizado (com espaço nas bordas)."""
+    padded = f" {normalize_name(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def package_weight(item):
+    """Peso em kg de um volume do item (units_per_package * unit_weight), ou 0."""
+    try:
+        units = float(item.get('units_per_package') or 1)
+        weight = float(item.get('unit_weight') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+    return units * weight
+
+
+def catalog_fingerprint(items):
+    """Identifica a versão do catálogo para reaproveitar o índice entre requisições."""
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update(json.dumps(
+            [item.get('id'), item.get('name'), item.get('name_en'), item.get('units_per_package'), item.get('unit_weight')],
+            default=str,
+        ).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ProductMatcher:
+    """Índice de trigramas sobre items.name e items.name_en."""
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.fingerprint = catalog_fingerprint(self.items)
+
+        # Cada item ocupa dois documentos fixos: 2*i (name) e 2*i + 1 (name_en)
+        postings = defaultdict(list)
+        doc_sizes = np.full(2 * len(self.items), np.inf)
+        for item_position, item in enumerate(self.items):
+            for offset, field in enumerate(('name', 'name_en')):
+                grams = trigrams(item.get(field)) if item.get(field) else None
+                if not grams:
+                    continue
+                doc = 2 * item_position + offset
+                doc_sizes[doc] = len(grams)
+                for gram in grams:
+                    postings[gram].append(doc)
+
+        self.postings = {gram: np.asarray(docs, dtype=np.int32) for gram, docs in postings.items()}
+        self.doc_sizes = doc_sizes
+        self.package_weights = np.fromiter(
+            (package_weight(item) for item in self.items), dtype=np.float64, count=len(self.items)
+        )
+
+    def search(self, name, weight_hint=None, top_k=5, min_score=0.3):
+        """
+        Ranqueia os itens do catálogo para um nome.
+
+        `weight_hint` é o peso em kg de um volume segundo a descrição da NF-e
+        (calculate_audited_weight com qCom = 1); itens cujo peso cadastrado
+        fica dentro de WEIGHT_HINT_TOLERANCE ganham até WEIGHT_HINT_BONUS.
+        """
+        query = trigrams(name)
+        hits = [self.postings[gram] for gram in query if gram in self.postings]
+        if not hits:
+            return []
+
+        counts = np.bincount(np.concatenate(hits), minlength=len(self.doc_sizes))
+        # Dice por documento; name e name_en do mesmo item: fica o melhor score
+        scores = (2.0 * counts / (len(query) + self.doc_sizes)).reshape(-1, 2).max(axis=1)
+        item_positions = np.nonzero(scores >= min_score)[0]
+        scores = scores[item_positions]
+
+        if weight_hint and weight_hint > 0:
+            weights = self.package_weights[item_positions]
+            deviation = np.abs(weights - weight_hint) / weight_hint
+            closeness = np.clip(1.0 - deviation / WEIGHT_HINT_TOLERANCE, 0.0, 1.0)
+            scores = scores + WEIGHT_HINT_BONUS * np.where(weights > 0, closeness, 0.0)
+
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            item_positions = item_positions[best]
+            scores = scores[best]
+        ranking = np.argsort(-scores, kind='stable')
+
+        return [
+            {
+                "id": self.items[position].get('id'),
+                "code": self.items[position].get('code'),
+                "name": self.items[position].get('name'),
+                "name_en": self.items[position].get('name_en'),
+                "score": round(float(score), 4),
+            }
+            for position, score in zip(item_positions[ranking].tolist(), scores[ranking].tolist())
+        ]
+
+    def match_products(self, products, top_k=5, min_score=0.3):
+        """Candidatos para cada produto da NF-e (lista de dicts com name e weight_hint opcional)."""
+        # Notas costumam repetir o mesmo produto em várias linhas: consulta uma vez só
+        cache = {}
+        results = []
+        for product in products:
+            key = (product.get('name', ''), product.get('weight_hint'))
+            if key not in cache:
+                cache[key] = self.search(key[0], key[1], top_k, min_score)
+            results.append({"code": product.get('code', ''), "name": key[0], "candidates": cache[key]})
+        return results
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m api.matching
+    import random
+    import time
+
+    random.seed(3)
+    words = ['pao', 'queijo', 'biscoito', 'polvilho', 'doce', 'leite', 'goiabada', 'farofa', 'requeijao',
+             'cremoso', 'tradicional', 'integral', 'mandioca', 'milho', 'coco', 'chocolate', 'morango']
+    catalog = [
+        {"id": f"item_{i}", "code": str(i),
+         "name": ' '.join(random.sample(words, 3)) + f" {random.choice([200, 400, 500, 1000])}g",
+         "units_per_package": random.choice([6, 10, 12, 20]), "unit_weight": random.choice([0.2, 0.4, 0.5])}
+        for i in range(50_000)
+    ]
+    start = time.perf_counter()
+    matcher = ProductMatcher(catalog)
+    print(f"Índice de {len(catalog)} itens: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    note = [{"name": ' '.join(random.sample(words, 3)).upper() + " 400G", "weight_hint": 4.0} for _ in range(200)]
+    start = time.perf_counter()
+    matcher.match_products(note)
+    print(f"Nota de {len(note)} itens: {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,266 @@
+"""
+Repositório de NF-e: XML bruto comprimido + estrutura já parseada.
+
+Hoje o resultado do parse vai inteiro para operations.nfe_data de cada
+operação: a mesma nota importada duas vezes duplica o payload e achar uma nota
+pela chave de acesso exige varrer JSON. Aqui cada nota é gravada uma única vez
+em nfe_documents, com a chave de acesso de 44 dígitos (atributo Id do
+<infNFe>, sem o prefixo "NFe") como chave primária e índices por CNPJ do
+emitente, número/série e data de emissão.
+
+A chave é lida do XML com uma regex antes de qualquer parse, então um upload
+repetido é reconhecido com uma busca na chave primária e devolve o parse
+guardado. XMLs sem Id são deduplicados pelo SHA-256 do conteúdo.
+
+Eventos (cancelamento, carta de correção) ficam em nfe_events pela chave da
+nota, chegando antes ou depois dela. Uma nota com cancelamento registrado
+na SEFAZ sai do histórico de preços e da referência de pesos.
+
+O XML bruto é comprimido pelo xml_archive (zlib, ou zstd com dicionário
+treinado no acervo depois de train_archive).
+"""
+import hashlib
+import json
+import re
+
+from .db import ensure_schema
+from .dispatch import CANCEL_EVENTS
+from .price_history import delete_prices, record_prices
+from .weight_anomalies import delete_weights, record_weights
+from .xml_archive import CODEC_PREFIX, compress_xml, current_dictionary_id, decompress_xml, open_stream, train_dictionary
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nfe_documents (
+    access_key TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    cnpj TEXT,
+    numero TEXT,
+    serie TEXT,
+    data_emissao TEXT,
+    codec TEXT NOT NULL,
+    xml BLOB NOT NULL,
+    xml_size INTEGER NOT NULL,
+    parsed TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS idx_nfe_documents_cnpj ON nfe_documents(cnpj, data_emissao);
+CREATE INDEX IF NOT EXISTS idx_nfe_documents_numero ON nfe_documents(numero, serie);
+CREATE INDEX IF NOT EXISTS idx_nfe_documents_data ON nfe_documents(data_emissao);
+CREATE TABLE IF NOT EXISTS nfe_events (
+    access_key TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    event_date TEXT,
+    protocol TEXT,
+    registered INTEGER NOT NULL DEFAULT 0,
+    justification TEXT,
+    codec TEXT NOT NULL,
+    xml BLOB NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    PRIMARY KEY (access_key, event_type, sequence)
+);
+"""
+
+ACCESS_KEY_PATTERN = re.compile(rb'<(?:\w+:)?infNFe\b[^>]*?\bId\s*=\s*["\'](?:NFe)?(\d{44})["\']')
+
+# Chaves do parse que só existem com include_taxes
+TAX_KEYS = ("impostos",)
+
+_CANCEL_TYPES = ', '.join(f"'{event_type}'" for event_type in CANCEL_EVENTS)
+
+# Notas mais recentes usadas como amostra no treino do dicionário
+TRAIN_SAMPLES = 2_000
+
+
+def access_key_of(xml_content):
+    """Chave de acesso (44 dígitos) do XML, sem parsear; None se não houver."""
+    match = ACCESS_KEY_PATTERN.search(xml_content)
+    return match.group(1).decode('ascii') if match else None
+
+
+def document_key(xml_content):
+    """Chave do documento em nfe_documents: a chave de acesso, ou sha256:<hash> sem Id."""
+    return access_key_of(xml_content) or f"sha256:{hashlib.sha256(xml_content).hexdigest()}"
+
+
+def _without_taxes(parsed):
+    """Remove os tributos de uma cópia do parse (pedido sem impostos=true)."""
+    result = dict(parsed)
+    result["produtos"] = [{k: v for k, v in p.items() if k not in TAX_KEYS} for p in parsed.get("produtos", [])]
+    result["notaFiscal"] = {k: v for k, v in parsed.get("notaFiscal", {}).items() if k != "totais"}
+    return result
+
+
+def find_document(conn, access_key=None, content_hash=None):
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    if access_key:
+        return conn.execute("SELECT * FROM nfe_documents WHERE access_key = ?", (access_key,)).fetchone()
+    return conn.execute("SELECT * FROM nfe_documents WHERE content_hash = ?", (content_hash,)).fetchone()
+
+
+def store_nfe(conn, xml_content, parse, include_taxes=False):
+    """
+    Grava a nota (se ainda não existir) e devolve (parse, duplicada, conflito).
+
+    `parse(xml_content)` é chamado só para notas novas e deve devolver a
+    estrutura completa, com tributos; a versão sem tributos é derivada dela.
+    Vale a primeira gravação: conflito indica que já havia outro XML (outro
+    content_hash) com a mesma chave de acesso, e o parse devolvido é o dele.
+    """
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    access_key = access_key_of(xml_content)
+    content_hash = hashlib.sha256(xml_content).hexdigest()
+    row = find_document(conn, access_key, content_hash)
+    duplicate = row is not None
+    conflict = duplicate and row['content_hash'] != content_hash
+    if duplicate:
+        parsed = json.loads(row['parsed'])
+    else:
+        parsed = parse(xml_content)
+        nota = parsed.get("notaFiscal", {})
+        codec, data = compress_xml(conn, xml_content)
+        key = access_key or f"sha256:{content_hash}"
+        with conn:
+            conn.execute(
+                "INSERT INTO nfe_documents (access_key, content_hash, cnpj, numero, serie, data_emissao, codec, xml, "
+                "xml_size, parsed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+                (key, content_hash, parsed.get("fornecedor", {}).get("cnpj"),
+                 nota.get("numero"), nota.get("serie"), nota.get("dataEmissao"), codec, data, len(xml_content),
+                 json.dumps(parsed, ensure_ascii=False)),
+            )
+            if not is_cancelled(conn, key):
+                record_prices(conn, key, parsed)
+                record_weights(conn, key, parsed)
+    return (parsed if include_taxes else _without_taxes(parsed)), duplicate, conflict
+
+
+def get_parsed(conn, access_key, include_taxes=False):
+    row = find_document(conn, access_key)
+    if row is None:
+        return None
+    parsed = json.loads(row['parsed'])
+    return parsed if include_taxes else _without_taxes(parsed)
+
+
+def get_xml(conn, access_key):
+    row = find_document(conn, access_key)
+    return decompress_xml(conn, row['codec'], row['xml']) if row is not None else None
+
+
+def open_xml(conn, access_key):
+    """XML da nota como arquivo descomprimido sob demanda (para reparse); None se não existir."""
+    row = find_document(conn, access_key)
+    return open_stream(conn, row['codec'], row['xml']) if row is not None else None
+
+
+def is_cancelled(conn, access_key):
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    return conn.execute(
+        f"SELECT 1 FROM nfe_events WHERE access_key = ? AND registered = 1 AND event_type IN ({_CANCEL_TYPES})",
+        (access_key,),
+    ).fetchone() is not None
+
+
+def record_event(conn, event, xml_content):
+    """
+    Grava um evento de parse_event. Devolve True se a nota do evento já
+    estiver no repositório.
+    """
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    if len(event["chaveAcesso"]) != 44:
+        raise ValueError("Evento sem chave de acesso da NF-e.")
+    codec, data = compress_xml(conn, xml_content)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO nfe_events (access_key, event_type, sequence, event_date, protocol, registered, "
+            "justification, codec, xml) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (event["chaveAcesso"], event["tipoEvento"], event["sequencia"], event["dataEvento"], event["protocolo"],
+             int(event["registrado"]), event["justificativa"], codec, data),
+        )
+        if event["cancelamento"] and event["registrado"]:
+            delete_prices(conn, event["chaveAcesso"])
+            delete_weights(conn, event["chaveAcesso"])
+    return find_document(conn, event["chaveAcesso"]) is not None
+
+
+def list_events(conn, access_key):
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    rows = conn.execute(
+        "SELECT event_type, sequence, event_date, protocol, registered, justification FROM nfe_events "
+        "WHERE access_key = ? ORDER BY event_date, sequence",
+        (access_key,),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def search_documents(conn, cnpj=None, numero=None, serie=None, start=None, end=None, limit=100):
+    """Resumo das notas filtradas pelos campos indexados, mais recentes primeiro."""
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    conditions = []
+    params = []
+    for column, value in (("cnpj", cnpj), ("numero", numero), ("serie", serie)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if start:
+        conditions.append("data_emissao >= ?")
+        params.append(start)
+    if end:
+        conditions.append("data_emissao <= ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = conn.execute(
+        f"SELECT access_key, cnpj, numero, serie, data_emissao, length(xml) AS tamanho, created_at, "
+        f"EXISTS (SELECT 1 FROM nfe_events e WHERE e.access_key = d.access_key AND e.registered = 1 "
+        f"AND e.event_type IN ({_CANCEL_TYPES})) AS cancelada "
+        f"FROM nfe_documents d {where} ORDER BY data_emissao DESC LIMIT ?",
+        (*params, int(limit)),
+    ).fetchall()
+    return [{**dict(row), "cancelada": bool(row['cancelada'])} for row in rows]
+
+
+def train_archive(conn, max_samples=TRAIN_SAMPLES):
+    """Treina um dicionário zstd com as notas mais recentes; as próximas gravações já o usam."""
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    rows = conn.execute(
+        "SELECT codec, xml FROM nfe_documents ORDER BY created_at DESC LIMIT ?", (int(max_samples),)
+    ).fetchall()
+    return train_dictionary(conn, [decompress_xml(conn, row['codec'], row['xml']) for row in rows])
+
+
+def recompress_documents(conn, batch_size=500):
+    """Regrava com o dicionário atual os documentos gravados em outro codec. Devolve quantos mudaram."""
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    dict_id = current_dictionary_id(conn)
+    if dict_id is None:
+        return 0
+    target = f"{CODEC_PREFIX}{dict_id}"
+    changed = 0
+    last_key = ''
+    while True:
+        rows = conn.execute(
+            "SELECT access_key, codec, xml FROM nfe_documents WHERE access_key > ? AND codec != ? "
+            "ORDER BY access_key LIMIT ?",
+            (last_key, target, int(batch_size)),
+        ).fetchall()
+        if not rows:
+            return changed
+        last_key = rows[-1]['access_key']
+        updates = []
+        for row in rows:
+            codec, data = compress_xml(conn, decompress_xml(conn, row['codec'], row['xml']))
+            if codec != row['codec']:
+                updates.append((codec, data, row['access_key']))
+        with conn:
+            conn.executemany("UPDATE nfe_documents SET codec = ?, xml = ? WHERE access_key = ?", updates)
+        changed += len(updates)
+
+
+def archive_stats(conn):
+    """Notas, bytes originais e bytes gravados por codec."""
+    ensure_schema(conn, SCHEMA, "nfe_store")
+    rows = conn.execute(
+        "SELECT codec, count(*) AS notas, sum(xml_size) AS original, sum(length(xml)) AS gravado "
+        "FROM nfe_documents GROUP BY codec ORDER BY codec"
+    ).fetchall()
+    return [{**dict(row), "razao": round(row['original'] / row['gravado'], 2)} for row in rows]
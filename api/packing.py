@@ -0,0 +1,132 @@
+"""
+Motor de Packing List.
+
+Calcula, a partir dos itens do estoque (units_per_package, unit_weight,
+package_type) e dos pesos da NF-e (get_peso_liquido / get_peso_bruto), o peso
+líquido e bruto de cada volume e os totais do container. Toda a aritmética é
+feita em arrays NumPy, então milhares de linhas custam poucos milissegundos.
+"""
+import numpy as np
+
+# Mesmo fator usado em get_peso_bruto e no packing_list.js (bruto = líquido * 1.035)
+FATOR_PESO_BRUTO = 1.035
+
+
+def _column(lines, key, default=0.0):
+    """Extrai um campo numérico de todas as linhas como array float64."""
+    values = np.fromiter(
+        ((line.get(key) if line.get(key) is not None else default) for line in lines),
+        dtype=np.float64,
+        count=len(lines),
+    )
+    return np.nan_to_num(values, nan=default)
+
+
+def _allocate(total, weights, fallback):
+    """Distribui `total` proporcionalmente a `weights` (ou a `fallback` se weights somar 0)."""
+    base = weights if weights.sum() > 0 else fallback
+    soma = base.sum()
+    if soma <= 0:
+        return np.zeros_like(base)
+    return base * (total / soma)
+
+
+def build_packing_list(lines, peso_liquido=0.0, peso_bruto=0.0):
+    """
+    Gera o packing list com pesos por volume.
+
+    Cada linha deve trazer `quantity` (número de volumes), `units_per_package`,
+    `unit_weight` (kg por unidade) e `package_type`. Se `qty_kg` vier preenchido
+    ele é usado no lugar de quantity * units_per_package * unit_weight.
+
+    Quando os pesos da NF-e são informados, o peso líquido/bruto das linhas é
+    rateado para que os totais batam com a nota. Sem peso bruto, aplica-se
+    FATOR_PESO_BRUTO sobre o líquido.
+    """
+    if not lines:
+        return {
+            "linhas": [],
+            "totais": {"volumes": 0.0, "pesoLiquido": 0.0, "pesoBruto": 0.0},
+        }
+
+    qty = _column(lines, 'quantity')
+    units = _column(lines, 'units_per_package', 1.0)
+    unit_weight = _column(lines, 'unit_weight')
+    declared_kg = np.fromiter(
+        ((line.get('qty_kg') if line.get('qty_kg') is not None else np.nan) for line in lines),
+        dtype=np.float64,
+        count=len(lines),
+    )
+
+    # Peso líquido por linha: usa qty_kg informado, senão deriva do cadastro do item
+    net = np.where(np.isnan(declared_kg), qty * units * unit_weight, declared_kg)
+    net = np.clip(net, 0.0, None)
+
+    if peso_liquido and peso_liquido > 0:
+        net = _allocate(peso_liquido, net, qty)
+
+    if peso_bruto and peso_bruto > 0:
+        gross = _allocate(peso_bruto, net, qty)
+    else:
+        gross = net * FATOR_PESO_BRUTO
+
+    # Peso por volume (caixa/fardo); linhas sem volumes ficam com 0
+    safe_qty = np.where(qty > 0, qty, 1.0)
+    net_per_package = np.where(qty > 0, net / safe_qty, 0.0)
+    gross_per_package = np.where(qty > 0, gross / safe_qty, 0.0)
+
+    result_lines = [
+        {
+            "code": line.get('code', ''),
+            "name": line.get('name', ''),
+            "ncm": line.get('ncm', ''),
+            "packageType": line.get('package_type') or 'caixa',
+            "quantity": q,
+            "pesoLiquidoVolume": npp,
+            "pesoBrutoVolume": gpp,
+            "pesoLiquido": n,
+            "pesoBruto": g,
+        }
+        for line, q, npp, gpp, n, g in zip(
+            lines,
+            qty.tolist(),
+            net_per_package.round(4).tolist(),
+            gross_per_package.round(4).tolist(),
+            net.round(4).tolist(),
+            gross.round(4).tolist(),
+        )
+    ]
+
+    return {
+        "linhas": result_lines,
+        "totais": {
+            "volumes": float(qty.sum()),
+            "pesoLiquido": round(float(net.sum()), 4),
+            "pesoBruto": round(float(gross.sum()), 4),
+        },
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m api.packing
+    import time
+
+    rng = np.random.default_rng(42)
+    for n_lines in (1_000, 5_000, 20_000):
+        sample = [
+            {
+                "quantity": int(q),
+                "units_per_package": int(u),
+                "unit_weight": float(w),
+                "package_type": "caixa",
+            }
+            for q, u, w in zip(
+                rng.integers(1, 500, n_lines),
+                rng.integers(1, 24, n_lines),
+                rng.uniform(0.1, 2.0, n_lines),
+            )
+        ]
+        start = time.perf_counter()
+        build_packing_list(sample, peso_liquido=25_000.0, peso_bruto=26_000.0)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{n_lines} linhas: {elapsed:.2f} ms")
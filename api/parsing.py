@@ -0,0 +1,212 @@
+"""
+Leitura de números e datas em formato brasileiro ou americano.
+
+get_value fazia só text.replace(',', '.'), o que lê "1.234,50" como erro (e
+devolve 0). As regras aqui são as do parseBrazilianNumber do invoice.js:
+
+* só ponto ("22.50", "1000"): decimal com ponto; vários pontos
+  ("1.234.567") são separadores de milhar;
+* só vírgula ("22,50"): decimal com vírgula; várias vírgulas
+  ("1,234,567") são separadores de milhar;
+* os dois: o separador que aparece por último é o decimal
+  ("1.234,50" -> 1234.5, "1,234.50" -> 1234.5).
+
+Prefixos de moeda (R$, US$, $) e espaços são ignorados. Notação científica,
+"inf", "nan" e números grandes demais para um float finito são inválidos nos
+dois caminhos (o float() do Python aceitaria os três). Datas aceitam
+AAAA-MM-DD (com ou sem hora, como o dhEmi da NF-e) e DD/MM/AAAA.
+
+parse_numbers / parse_dates trabalham sobre arrays inteiros (colunas de CSV ou
+XLSX) com operações vetorizadas do NumPy; só os valores fora do padrão caem na
+versão escalar.
+"""
+import math
+import re
+from datetime import date, datetime
+
+import numpy as np
+
+CURRENCY_PATTERN = re.compile(r'^(?:R\$|US\$|\$)\s*|\s+')
+NUMBER_PATTERN = re.compile(r'^[+-]?(?:\d[\d.,]*|[.,]\d+)$')
+BR_DATE_PATTERN = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})$')
+ISO_DATE_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ].*)?$')
+# Tabela ASCII dos code points que o caminho vetorizado aceita (0 é o preenchimento do dtype U<n>)
+PLAIN_NUMBER_CODES = np.zeros(128, dtype=bool)
+PLAIN_NUMBER_CODES[[0] + [ord(c) for c in '0123456789.,+-']] = True
+
+CHUNK_SIZE = 65_536
+
+
+def _normalize(text):
+    """Converte a string para o formato aceito por float(), ou None se não for número."""
+    text = CURRENCY_PATTERN.sub('', text)
+    if not NUMBER_PATTERN.match(text):
+        return None
+    dots = text.count('.')
+    commas = text.count(',')
+    if text.rfind(',') > text.rfind('.') and (dots or commas == 1):
+        return text.replace('.', '').replace(',', '.')
+    if dots > 1 and not commas:
+        return text.replace('.', '')
+    return text.replace(',', '')
+
+
+def parse_number(value, default=0.0):
+    """Lê um número BR ou US (str, int ou float); devolve `default` se não for número."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return default
+    text = value.strip()
+    if NUMBER_PATTERN.match(text) and ',' not in text and text.count('.') <= 1:
+        result = float(text)  # caminho rápido: o formato das tags da NF-e
+        return result if math.isfinite(result) else default
+    normalized = _normalize(text)
+    if normalized is None:
+        return default
+    try:
+        result = float(normalized)
+    except ValueError:
+        return default
+    return result if math.isfinite(result) else default
+
+
+def _parse_chunk(text):
+    """Parte vetorizada: escolhe o separador decimal por elemento e converte de uma vez."""
+    dots = np.char.count(text, '.')
+    commas = np.char.count(text, ',')
+    comma_decimal = (np.char.rfind(text, ',') > np.char.rfind(text, '.')) & ((dots > 0) | (commas == 1))
+    dot_thousands = (dots > 1) & (commas == 0)
+    normalized = np.where(
+        comma_decimal, np.char.replace(np.char.replace(text, '.', ''), ',', '.'),
+        np.where(dot_thousands, np.char.replace(text, '.', ''), np.char.replace(text, ',', '')),
+    )
+    return normalized.astype(np.float64)
+
+
+def _parse_plain(text, default):
+    """_parse_chunk para strings só com dígitos, separadores e sinal."""
+    try:
+        return _parse_chunk(text)
+    except ValueError:
+        # "1-2", "1.2.3,4,5", "-": float() recusa, então o bloco todo vai para o caminho escalar
+        return np.array([parse_number(v, default) for v in text.tolist()], dtype=np.float64)
+
+
+def parse_numbers(values, default=np.nan):
+    """
+    Versão vetorizada de parse_number para uma sequência de strings.
+    Devolve um array float64; valores inválidos ou vazios viram `default`.
+    """
+    values = np.char.strip(np.asarray(values, dtype=str))
+    result = np.empty(len(values), dtype=np.float64)
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk = np.ascontiguousarray(values[start:start + CHUNK_SIZE])
+        # Só dígitos, separadores e sinal vão para o astype: float() aceitaria também "1e5", "inf" e "nan"
+        codes = chunk.view(np.uint32).reshape(len(chunk), -1)
+        plain = (PLAIN_NUMBER_CODES[np.minimum(codes, 127)] & (codes < 128)).all(axis=1) & (chunk != '')
+        if plain.all():  # caso comum: o bloco inteiro de uma vez, sem máscara
+            parsed = _parse_plain(chunk, default)
+        else:
+            parsed = np.full(len(chunk), default, dtype=np.float64)
+            parsed[plain] = _parse_plain(chunk[plain], default)
+            # Moeda, espaços internos e texto: caminho escalar, elemento a elemento
+            other = ~plain & (chunk != '')
+            parsed[other] = [parse_number(v, default) for v in chunk[other].tolist()]
+        parsed[np.isinf(parsed)] = default
+        result[start:start + CHUNK_SIZE] = parsed
+    return result
+
+
+def parse_date(value):
+    """Lê uma data (AAAA-MM-DD[Thh:mm...], DD/MM/AAAA, date/datetime) e devolve date ou None."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = (value or '').strip()
+    try:
+        match = ISO_DATE_PATTERN.match(text)
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        match = BR_DATE_PATTERN.match(text)
+        if match:
+            year = int(match.group(3))
+            return date(year + 2000 if year < 100 else year, int(match.group(2)), int(match.group(1)))
+    except ValueError:
+        return None
+    return None
+
+
+def _digits(codes, positions):
+    """Número formado pelos dígitos das colunas `positions` da matriz de code points."""
+    number = np.zeros(len(codes), dtype=np.int64)
+    for position in positions:
+        number = number * 10 + (codes[:, position] - 48)
+    return number
+
+
+def parse_dates(values):
+    """
+    Versão vetorizada de parse_date: array datetime64[D] com NaT nos inválidos.
+
+    As strings são vistas como uma matriz de code points (11 colunas); as
+    posições dos separadores identificam ISO ou BR e os dígitos são extraídos
+    por aritmética, sem regex por elemento.
+    """
+    values = np.asarray(values, dtype=str)
+    text = np.char.strip(values)
+    length = np.char.str_len(text)
+    codes = text.astype('U11').view(np.uint32).reshape(len(text), 11).astype(np.int64)
+    is_digit = (codes >= 48) & (codes <= 57)
+    iso = (codes[:, 4] == ord('-')) & (codes[:, 7] == ord('-')) & is_digit[:, [0, 1, 2, 3, 5, 6, 8, 9]].all(axis=1)
+    iso &= (length == 10) | (codes[:, 10] == ord('T')) | (codes[:, 10] == ord(' '))
+    br = (codes[:, 2] == ord('/')) & (codes[:, 5] == ord('/')) & is_digit[:, [0, 1, 3, 4, 6, 7, 8, 9]].all(axis=1)
+    br &= length == 10
+
+    year = np.where(iso, _digits(codes, (0, 1, 2, 3)), _digits(codes, (6, 7, 8, 9)))
+    month = np.where(iso, _digits(codes, (5, 6)), _digits(codes, (3, 4)))
+    day = np.where(iso, _digits(codes, (8, 9)), _digits(codes, (0, 1)))
+    valid = (iso | br) & (month >= 1) & (month <= 12) & (day >= 1)
+
+    result = np.full(len(text), np.datetime64('NaT'), dtype='datetime64[D]')
+    month_start = (year[valid] - 1970) * 12 + month[valid] - 1
+    first = month_start.astype('datetime64[M]').astype('datetime64[D]')
+    days_in_month = ((month_start + 1).astype('datetime64[M]').astype('datetime64[D]') - first).astype(np.int64)
+    in_month = day[valid] <= days_in_month
+    parsed = first + (day[valid] - 1).astype('timedelta64[D]')
+    result[np.nonzero(valid)[0][in_month]] = parsed[in_month]
+
+    # Formatos curtos (1/2/2024, 01/02/24) vão pelo caminho escalar
+    for i in np.nonzero(~(iso | br) & (length > 0))[0].tolist():
+        parsed_date = parse_date(text[i])
+        if parsed_date is not None:
+            result[i] = np.datetime64(parsed_date, 'D')
+    return result
+
+
+if __name__ == "__main__":
+    # Benchmark com 1 milhão de strings (casos de referência em tests/test_parsing.py): python -m api.parsing
+    import random
+    import time
+
+    rng = random.Random(1)
+    n = 1_000_000
+    # Metade no formato BR com milhar ("12.345,67"), metade US simples ("12345.67")
+    numbers = [f"{v:,.2f}".translate(str.maketrans(',.', '.,')) if i % 2 else f"{v:.2f}"
+               for i, v in enumerate(rng.uniform(0, 100_000) for _ in range(n))]
+    start = time.perf_counter()
+    parse_numbers(numbers)
+    vector_time = time.perf_counter() - start
+    start = time.perf_counter()
+    [parse_number(v) for v in numbers]
+    print(f"1 milhão de números: vetorizado {vector_time:.2f} s, escalar {time.perf_counter() - start:.2f} s")
+
+    dates = [f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2000, 2030)}" if i % 2
+             else f"{rng.randint(2000, 2030)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for i in range(n)]
+    start = time.perf_counter()
+    parse_dates(dates)
+    vector_time = time.perf_counter() - start
+    start = time.perf_counter()
+    [parse_date(v) for v in dates]
+    print(f"1 milhão de datas: vetorizado {vector_time:.2f} s, escalar {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,201 @@
+"""
+Histórico de preços de compra por fornecedor e produto.
+
+O uploadAndProcessPoXml usa o vUnCom de cada produto só para atualizar o custo
+do pedido e descarta o resto. Aqui cada nota gravada no nfe_store deixa uma
+linha por produto em price_history, com chave (CNPJ do emitente, cProd, data
+de emissão, nota). A tabela é WITHOUT ROWID: as linhas ficam ordenadas pela
+própria chave, então a série de um produto é um trecho contíguo da árvore e
+tanto o último preço quanto uma faixa de datas são uma busca no índice mais
+uma leitura sequencial, independente do tamanho total do histórico.
+
+price_trends compara os preços de uma nota com o histórico anterior a ela e
+marca como alerta os itens cujo preço foge da média recente.
+
+    python -m api.price_history rebuild [database_path]
+"""
+import json
+import math
+
+from .db import ensure_schema, get_connection
+from .dispatch import CANCEL_EVENTS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_history (
+    cnpj TEXT NOT NULL,
+    code TEXT NOT NULL,
+    data_emissao TEXT NOT NULL,
+    access_key TEXT NOT NULL,
+    price REAL NOT NULL,
+    quantity REAL,
+    PRIMARY KEY (cnpj, code, data_emissao, access_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_price_history_key ON price_history(access_key);
+"""
+
+# Compras anteriores consideradas na média de price_trends
+TREND_WINDOW = 12
+# Variação sobre a média recente que gera alerta (fração)
+DEVIATION_THRESHOLD = 0.15
+# Com histórico suficiente, também alerta acima deste desvio-padrão
+Z_THRESHOLD = 3.0
+MIN_SAMPLES_FOR_Z = 5
+
+_CANCEL_TYPES = ', '.join(f"'{event_type}'" for event_type in CANCEL_EVENTS)
+
+
+def _note_rows(access_key, parsed):
+    cnpj = (parsed.get("fornecedor") or {}).get("cnpj")
+    data_emissao = (parsed.get("notaFiscal") or {}).get("dataEmissao")
+    if not cnpj or not data_emissao:
+        return []
+    rows = {}
+    for product in parsed.get("produtos", []):
+        price = product.get("costPrice") or 0
+        if product.get("code") and price > 0:
+            # Mesmo cProd repetido na nota: fica a última linha, como na chave
+            rows[product["code"]] = (cnpj, product["code"], data_emissao, access_key, price, product.get("quantity"))
+    return list(rows.values())
+
+
+def record_prices(conn, access_key, parsed):
+    """Registra os preços de uma nota parseada; chamado pelo nfe_store na mesma transação da gravação."""
+    ensure_schema(conn, SCHEMA, "price_history")
+    conn.executemany(
+        "INSERT OR REPLACE INTO price_history (cnpj, code, data_emissao, access_key, price, quantity) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        _note_rows(access_key, parsed),
+    )
+
+
+def delete_prices(conn, access_key):
+    """Tira do histórico os preços de uma nota (cancelada)."""
+    ensure_schema(conn, SCHEMA, "price_history")
+    conn.execute("DELETE FROM price_history WHERE access_key = ?", (access_key,))
+
+
+def price_series(conn, cnpj, code, start=None, end=None):
+    """Compras de um produto do fornecedor entre start e end (inclusive), em ordem de data."""
+    ensure_schema(conn, SCHEMA, "price_history")
+    rows = conn.execute(
+        "SELECT data_emissao, price, quantity, access_key FROM price_history "
+        "WHERE cnpj = ? AND code = ? AND data_emissao >= ? AND data_emissao <= ? ORDER BY data_emissao",
+        (cnpj, code, start or '', end or '9999-12-31'),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def last_price(conn, cnpj, code, before=None):
+    """Última compra do produto (antes de `before`, se informado) ou None."""
+    ensure_schema(conn, SCHEMA, "price_history")
+    row = conn.execute(
+        "SELECT data_emissao, price, quantity, access_key FROM price_history "
+        "WHERE cnpj = ? AND code = ? AND data_emissao < ? ORDER BY data_emissao DESC LIMIT 1",
+        (cnpj, code, before or '9999-99-99'),
+    ).fetchone()
+    return dict(row) if row is not None else None
+
+
+def _recent_prices(conn, cnpj, code, data_emissao, access_key, window):
+    # Compras anteriores à nota: datas menores, ou a mesma data em outra nota
+    return [row[0] for row in conn.execute(
+        "SELECT price FROM price_history WHERE cnpj = ? AND code = ? AND data_emissao <= ? "
+        "AND NOT (data_emissao = ? AND access_key = ?) ORDER BY data_emissao DESC LIMIT ?",
+        (cnpj, code, data_emissao, data_emissao, access_key, window),
+    )]
+
+
+def price_trends(conn, access_key, parsed, window=TREND_WINDOW, threshold=DEVIATION_THRESHOLD):
+    """
+    Para cada produto da nota: último preço, média e desvio das `window`
+    compras anteriores, variação percentual e se é um alerta.
+    """
+    ensure_schema(conn, SCHEMA, "price_history")
+    result = []
+    for cnpj, code, data_emissao, _, price, _ in _note_rows(access_key, parsed):
+        history = _recent_prices(conn, cnpj, code, data_emissao, access_key, window)
+        trend = {"code": code, "preco": price, "compras": len(history), "ultimoPreco": None,
+                 "media": None, "desvioPadrao": None, "variacaoUltimo": None, "variacaoMedia": None, "alerta": False}
+        if history:
+            mean = sum(history) / len(history)
+            std = math.sqrt(sum((p - mean) ** 2 for p in history) / len(history))
+            change = price / mean - 1
+            trend.update({
+                "ultimoPreco": history[0],
+                "media": round(mean, 4),
+                "desvioPadrao": round(std, 4),
+                "variacaoUltimo": round(price / history[0] - 1, 4),
+                "variacaoMedia": round(change, 4),
+            })
+            outlier = len(history) >= MIN_SAMPLES_FOR_Z and std > 0 and abs(price - mean) / std > Z_THRESHOLD
+            trend["alerta"] = abs(change) > threshold or outlier
+        result.append(trend)
+    return result
+
+
+def rebuild_price_history(conn):
+    """
+    Reconstrói o histórico a partir das notas já gravadas em nfe_documents,
+    sem as que têm cancelamento registrado em nfe_events.
+    """
+    ensure_schema(conn, SCHEMA, "price_history")
+    with conn:
+        conn.execute("DELETE FROM price_history")
+        rows = conn.execute(
+            "SELECT d.access_key, d.parsed FROM nfe_documents d WHERE NOT EXISTS ("
+            "SELECT 1 FROM nfe_events e WHERE e.access_key = d.access_key AND e.registered = 1 "
+            f"AND e.event_type IN ({_CANCEL_TYPES}))"
+        )
+        for row in rows:
+            record_prices(conn, row['access_key'], json.loads(row['parsed']))
+    return conn.execute("SELECT count(*) FROM price_history").fetchone()[0]
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:2] == ["rebuild"]:
+        connection = get_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"{rebuild_price_history(connection)} preços no histórico")
+        sys.exit(0)
+
+    # Benchmark com 2 milhões de linhas: python -m api.price_history
+    import os
+    import random
+    import tempfile
+    import time
+    from datetime import date, timedelta
+
+    conn = get_connection(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    ensure_schema(conn, SCHEMA, "price_history")
+    rng = random.Random(1)
+    suppliers = [f"{rng.randrange(10 ** 14):014d}" for _ in range(200)]
+    products = [(cnpj, f"P{i}") for cnpj in suppliers for i in range(100)]  # 20 mil séries
+    first_day = date(2020, 1, 1)
+    with conn:
+        for n, (cnpj, code) in enumerate(products):
+            base = rng.uniform(5, 200)
+            conn.executemany(
+                "INSERT INTO price_history VALUES (?, ?, ?, ?, ?, ?)",
+                [(cnpj, code, (first_day + timedelta(days=15 * k)).isoformat(), f"{n:022d}{k:022d}",
+                  round(base * rng.uniform(0.9, 1.1), 2), 10.0) for k in range(100)],
+            )
+    total = conn.execute("SELECT count(*) FROM price_history").fetchone()[0]
+
+    sample = rng.sample(products, 2_000)
+    start = time.perf_counter()
+    for cnpj, code in sample:
+        last_price(conn, cnpj, code)
+    last_time = (time.perf_counter() - start) / len(sample)
+    start = time.perf_counter()
+    for cnpj, code in sample:
+        price_series(conn, cnpj, code, "2022-01-01", "2022-12-31")
+    range_time = (time.perf_counter() - start) / len(sample)
+    cnpj = sample[0][0]
+    note = {"fornecedor": {"cnpj": cnpj}, "notaFiscal": {"dataEmissao": "2024-06-01"},
+            "produtos": [{"code": f"P{i}", "costPrice": 100.0, "quantity": 1} for i in range(100)]}
+    start = time.perf_counter()
+    alerts = sum(t["alerta"] for t in price_trends(conn, "nova", note))
+    trend_time = (time.perf_counter() - start) / 100
+    print(f"{total} linhas: último preço {last_time * 1000:.3f} ms, faixa de 1 ano {range_time * 1000:.3f} ms, "
+          f"tendência {trend_time * 1000:.3f} ms por produto ({alerts}/100 alertas)")
@@ -0,0 +1,123 @@
+"""
+Conciliação de NF-e (saída do parse_nfe_xml) com Ordens de Compra.
+
+O uploadAndProcessPoXml do import.js procura cada produto do XML com
+order.items.find e o fornecedor com suppliers.find (O(n·m)). Aqui os dois lados
+viram índices hash — CNPJ -> fornecedor e (supplier_id, código) -> item da OC —
+e cada produto é resolvido com uma consulta. O casamento por nome é opcional e
+só roda sobre as sobras, usando um índice de palavras para limitar candidatos.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+_NON_DIGITS = re.compile(r'\D')
+_WORDS = re.compile(r'[a-z0-9]+')
+
+
+def normalize_cnpj(cnpj):
+    """Mesmo comportamento do normalizeCnpj do ui.js: só os dígitos."""
+    return _NON_DIGITS.sub('', str(cnpj)) if cnpj else ''
+
+
+def normalize_name(name):
+    """Minúsculas, sem acentos e com espaços simples (para comparação de nomes)."""
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(_WORDS.findall(text.lower()))
+
+
+def build_supplier_index(suppliers):
+    return {normalize_cnpj(s.get('cnpj')): s for s in suppliers if s.get('cnpj')}
+
+
+def build_order_index(order_items):
+    """(supplier_id, código) -> índice do primeiro item com esse código em order.items (como o find)."""
+    index = {}
+    for position, item in enumerate(order_items):
+        index.setdefault((item.get('supplier_id'), str(item.get('code', '')).strip()), position)
+    return index
+
+
+def _fuzzy_match(pending_products, order_items, available, supplier_id, threshold):
+    """Casa por nome os produtos restantes contra os itens da OC ainda livres."""
+    word_index = defaultdict(set)
+    names = {}
+    for position in available:
+        item = order_items[position]
+        if item.get('supplier_id') != supplier_id:
+            continue
+        names[position] = normalize_name(item.get('name'))
+        for word in names[position].split():
+            word_index[word].add(position)
+
+    matches = []
+    for product_position, product in pending_products:
+        target = normalize_name(product.get('name'))
+        candidates = set()
+        for word in target.split():
+            candidates |= word_index.get(word, set())
+        candidates &= available
+
+        best, best_score = None, threshold
+        for position in candidates:
+            score = SequenceMatcher(None, target, names[position]).ratio()
+            if score >= best_score:
+                best, best_score = position, score
+        if best is not None:
+            available.discard(best)
+            matches.append((product_position, best, best_score))
+    return matches
+
+
+def reconcile_purchase_order(nfe, order_items, suppliers, fuzzy=False, threshold=0.75):
+    """
+    Casa os produtos da NF-e com os itens da OC.
+
+    Devolve o fornecedor encontrado, as linhas casadas (com o custo vindo do
+    XML), os produtos do XML sem correspondência e os itens da OC que sobraram.
+    Lança LookupError se o CNPJ do emitente não estiver cadastrado.
+
+    Como o order.items.find do import.js, o casamento por código não consome o
+    item: um cProd repetido em várias linhas da NF-e casa sempre com o primeiro
+    item da OC com esse código, e o custo que fica é o da última linha.
+    """
+    cnpj = normalize_cnpj((nfe.get('fornecedor') or {}).get('cnpj'))
+    supplier = build_supplier_index(suppliers).get(cnpj)
+    if supplier is None:
+        raise LookupError(f"Fornecedor com CNPJ {cnpj} não encontrado no sistema.")
+
+    order_index = build_order_index(order_items)
+    supplier_id = supplier.get('id')
+    available = set(range(len(order_items)))
+    matched = []
+    pending = []
+
+    for product_position, product in enumerate(nfe.get('produtos') or []):
+        position = order_index.get((supplier_id, str(product.get('code', '')).strip()))
+        if position is not None:
+            available.discard(position)
+            matched.append({"product": product_position, "orderItem": position, "matchType": "code", "score": 1.0})
+        else:
+            pending.append((product_position, product))
+
+    if fuzzy and pending:
+        for product_position, position, score in _fuzzy_match(pending, order_items, available, supplier_id, threshold):
+            matched.append({"product": product_position, "orderItem": position, "matchType": "name", "score": round(score, 4)})
+        matched_products = {m['product'] for m in matched}
+        pending = [(p, prod) for p, prod in pending if p not in matched_products]
+
+    produtos = nfe.get('produtos') or []
+    updated_items = [dict(item) for item in order_items]
+    for match in matched:
+        cost = produtos[match['product']].get('costPrice')
+        updated_items[match['orderItem']]['costPrice'] = cost
+        updated_items[match['orderItem']]['operationPrice'] = cost
+
+    return {
+        "fornecedor": supplier,
+        "matched": sorted(matched, key=lambda m: m['product']),
+        "unmatched": [{"product": p, "code": prod.get('code', ''), "name": prod.get('name', '')} for p, prod in pending],
+        "unmatchedOrderItems": sorted(available),
+        "items": updated_items,
+    }
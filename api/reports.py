@@ -0,0 +1,258 @@
+"""
+Motor de relatórios de movimentações.
+
+O reports.js filtra e ordena o array inteiro de movimentações no navegador,
+converte cada data de novo, roda uma regex em cada motivo para achar o número
+da NF e faz items.find / suppliers.find por linha. Aqui as movimentações ficam
+em colunas NumPy carregadas uma vez por processo (e completadas só com as
+linhas novas a cada consulta): datas já vêm convertidas em dias, o número da
+NF é extraído no carregamento e o fornecedor de cada item é resolvido por um
+join hash (dict id -> posição). Os relatórios devolvem apenas linhas agregadas.
+
+O resumo diário e o ranking de produtos leem os rollups (rollups.py); aqui
+ficam o relatório fiscal, que agrupa pelo número da NF, e as colunas usadas
+pela valorização em datas passadas (valuation.py).
+
+Linhas novas entram pelo rowid; UPDATE e DELETE em movements (restauração de
+backup, correções manuais) incrementam movements_version por trigger, e um
+banco recriado no mesmo caminho traz outro token: nesses casos o store é
+relido do zero na consulta seguinte.
+"""
+import re
+import threading
+
+import numpy as np
+
+from .db import conn_path, ensure_schema
+from .parsing import parse_date
+
+# Mesma regex do renderFiscalReport no reports.js
+NF_PATTERN = re.compile(r'(?:NF-e|Nota Fiscal|NF):?\s*(\d+)', re.IGNORECASE)
+
+UNKNOWN_SUPPLIER = 'Fornecedor Desconhecido'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movements_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    token TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO movements_version (id, token) VALUES (1, lower(hex(randomblob(8))));
+CREATE TRIGGER IF NOT EXISTS trg_movements_version_update AFTER UPDATE ON movements
+BEGIN UPDATE movements_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_movements_version_delete AFTER DELETE ON movements
+BEGIN UPDATE movements_version SET version = version + 1 WHERE id = 1; END;
+"""
+
+
+def days(dates):
+    """Converte datas ISO (só a parte AAAA-MM-DD) em dias desde 1970, vetorizado."""
+    if not dates:
+        return np.empty(0, dtype=np.int64)
+    values = np.array([(d or '1970-01-01')[:10] for d in dates], dtype='datetime64[D]')
+    return values.astype(np.int64)
+
+
+def parse_day(value):
+    """Uma data informada pelo usuário (AAAA-MM-DD ou DD/MM/AAAA) em dias desde 1970."""
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Data inválida: {value} (use AAAA-MM-DD)")
+    return int(np.datetime64(parsed, 'D').astype(np.int64))
+
+
+def _day_to_iso(day):
+    return str(np.datetime64(int(day), 'D'))
+
+
+def _nf_number(reason):
+    match = NF_PATTERN.search(reason) if reason else None
+    return int(match.group(1)) if match else -1
+
+
+class MovementStore:
+    """Colunas das movimentações de um banco, completadas de forma incremental por rowid."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.version = None  # (token, version) de movements_version na última leitura
+        self.last_rowid = 0
+        self.item_keys = {}  # item_id -> código inteiro
+        self.item_ids = []
+        self.item_code = np.empty(0, dtype=np.int32)
+        self.is_out = np.empty(0, dtype=bool)
+        self.quantity = np.empty(0, dtype=np.float64)
+        self.price = np.empty(0, dtype=np.float64)
+        self.day = np.empty(0, dtype=np.int64)
+        self.nf = np.empty(0, dtype=np.int64)
+
+    def _item_key(self, item_id):
+        key = self.item_keys.get(item_id)
+        if key is None:
+            key = self.item_keys[item_id] = len(self.item_ids)
+            self.item_ids.append(item_id)
+        return key
+
+    def refresh(self, conn):
+        """
+        Carrega apenas as movimentações inseridas depois da última leitura; se
+        alguma foi alterada ou apagada, ou o banco é outro, relê todas.
+        """
+        ensure_schema(conn, SCHEMA, "reports")
+        with self.lock:
+            version = tuple(conn.execute("SELECT token, version FROM movements_version WHERE id = 1").fetchone())
+            max_rowid = conn.execute("SELECT max(rowid) FROM movements").fetchone()[0] or 0
+            if version != self.version or max_rowid < self.last_rowid:
+                self._clear()
+                self.version = version
+            rows = conn.execute(
+                "SELECT rowid, item_id, type, quantity, price, reason, date FROM movements WHERE rowid > ? ORDER BY rowid",
+                (self.last_rowid,),
+            ).fetchall()
+            if not rows:
+                return
+            rowids, item_ids, types, quantities, prices, reasons, dates = zip(*rows)
+            self.last_rowid = rowids[-1]
+            self.item_code = np.concatenate((self.item_code, np.fromiter(
+                (self._item_key(item_id) for item_id in item_ids), dtype=np.int32, count=len(rows))))
+            self.is_out = np.concatenate((self.is_out, np.array(types) == 'out'))
+            self.quantity = np.concatenate((self.quantity, np.array(quantities, dtype=np.float64)))
+            self.price = np.concatenate((self.price, np.nan_to_num(np.array(prices, dtype=np.float64))))
+            self.day = np.concatenate((self.day, days(dates)))
+            self.nf = np.concatenate((self.nf, np.fromiter(
+                (_nf_number(reason) for reason in reasons), dtype=np.int64, count=len(rows))))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_movement_store(conn, reload=False):
+    """Store do banco da conexão, já atualizado com as movimentações novas."""
+    path = conn_path(conn)
+    with _stores_lock:
+        if reload or path not in _stores:
+            _stores[path] = MovementStore()
+        store = _stores[path]
+    store.refresh(conn)
+    return store
+
+
+def invalidate_movement_store(conn):
+    """Descarta o store do banco da conexão; a próxima consulta relê todas as movimentações."""
+    with _stores_lock:
+        _stores.pop(conn_path(conn), None)
+
+
+def _catalog(conn, store):
+    """
+    Join hash item -> fornecedor: para cada código de item do store devolve a
+    posição do fornecedor (-1 se desconhecido), além dos dados usados na saída.
+    """
+    items = {row['id']: row for row in conn.execute(
+        "SELECT id, name, supplier_id, units_per_package, package_type FROM items")}
+    suppliers = {row['id']: row['name'] for row in conn.execute("SELECT id, name FROM suppliers")}
+    supplier_ids = list(suppliers)
+    supplier_pos = {supplier_id: pos for pos, supplier_id in enumerate(supplier_ids)}
+
+    item_supplier = np.fromiter(
+        (supplier_pos.get(items[item_id]['supplier_id'], -1) if item_id in items else -1
+         for item_id in store.item_ids),
+        dtype=np.int64, count=len(store.item_ids),
+    )
+    return items, suppliers, supplier_ids, item_supplier
+
+
+def fiscal_report(conn, year, supplier_name=None):
+    """
+    Notas fiscais de entrada do ano agrupadas por (NF, fornecedor), gasto por
+    fornecedor e lista de fornecedores disponíveis (para o filtro da tela).
+    """
+    store = get_movement_store(conn)
+    _, suppliers, supplier_ids, item_supplier = _catalog(conn, store)
+
+    start_day = days([f"{year}-01-01"])[0]
+    end_day = days([f"{year}-12-31"])[0]
+    mask = (~store.is_out) & (store.nf >= 0) & (store.day >= start_day) & (store.day <= end_day)
+
+    mask_idx = np.nonzero(mask)[0]
+    supplier_slot = item_supplier[store.item_code[mask_idx]]
+    supplier_slot = np.where(supplier_slot >= 0, supplier_slot, len(supplier_ids))
+    names = [suppliers[s] for s in supplier_ids] + [UNKNOWN_SUPPLIER]
+    available = sorted({names[s] for s in np.unique(supplier_slot).tolist() if s < len(supplier_ids)})
+
+    if supplier_name:
+        selected = np.isin(supplier_slot, [slot for slot, name in enumerate(names) if name == supplier_name])
+        mask_idx = mask_idx[selected]
+        supplier_slot = supplier_slot[selected]
+
+    if not len(mask_idx):
+        return {"notas": [], "gastoPorFornecedor": {}, "fornecedores": available}
+
+    nf = store.nf[mask_idx]
+    day = store.day[mask_idx]
+    total = store.quantity[mask_idx] * store.price[mask_idx]
+
+    # Chave (NF, fornecedor) combinada em um único inteiro para agrupar com np.unique 1D
+    keys = nf * len(names) + supplier_slot
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    totals = np.bincount(inverse, weights=total, minlength=len(unique_keys))
+    first_day = np.full(len(unique_keys), np.iinfo(np.int64).max)
+    np.minimum.at(first_day, inverse, day)
+
+    spending = np.bincount(supplier_slot, weights=total, minlength=len(names))
+
+    notas = [
+        {"number": str(n), "supplier": names[s], "date": _day_to_iso(d), "total": round(float(t), 2)}
+        for n, s, d, t in zip((unique_keys // len(names)).tolist(), (unique_keys % len(names)).tolist(),
+                              first_day.tolist(), totals.tolist())
+    ]
+    notas.sort(key=lambda nota: nota['date'], reverse=True)
+    return {
+        "notas": notas,
+        "gastoPorFornecedor": {names[s]: round(float(v), 2) for s, v in enumerate(spending.tolist()) if v},
+        "fornecedores": available,
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark com 1M de movimentações em banco temporário: python -m api.reports
+    import os
+    import tempfile
+    import time
+
+    from .db import get_connection
+    from .rollups import daily_movements, product_ranking, rebuild_rollups
+
+    rng = np.random.default_rng(1)
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = get_connection(path)
+    conn.executemany("INSERT INTO suppliers (id, name) VALUES (?, ?)", [(f"sup_{i}", f"Fornecedor {i}") for i in range(50)])
+    conn.executemany("INSERT INTO items (id, name, supplier_id, units_per_package) VALUES (?, ?, ?, ?)",
+                     [(f"item_{i}", f"Item {i}", f"sup_{i % 50}", 12) for i in range(5000)])
+    n = 1_000_000
+    dates = np.datetime64('2023-01-01') + rng.integers(0, 730, n).astype('timedelta64[D]')
+    conn.executemany(
+        "INSERT INTO movements (id, item_id, type, quantity, price, reason, date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((f"mov_{i}", f"item_{it}", 'out' if o else 'in', int(q), float(p), f"Entrada NF-e: {nf}", f"{d}T10:00:00Z")
+         for i, (it, o, q, p, nf, d) in enumerate(zip(
+             rng.integers(0, 5000, n), rng.random(n) < 0.5, rng.integers(1, 100, n),
+             rng.uniform(1, 50, n).round(2), rng.integers(1, 20000, n), dates.astype(str)))),
+    )
+    conn.commit()
+    rebuild_rollups(conn)
+
+    start = time.perf_counter()
+    get_movement_store(conn)
+    print(f"Carga inicial de {n} movimentações: {time.perf_counter() - start:.2f} s")
+    for label, run in (
+        ("daily_movements (1 mês)", lambda: daily_movements(conn, "2024-03-01", "2024-03-31")),
+        ("fiscal_report (1 ano)", lambda: fiscal_report(conn, 2024)),
+        ("product_ranking (90 dias)", lambda: product_ranking(conn, 90, today="2024-12-31")),
+    ):
+        start = time.perf_counter()
+        run()
+        print(f"{label}: {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,295 @@
+"""
+Agregados pré-calculados das movimentações (rollups diários e mensais).
+
+Cada movimentação inserida pela API soma sua quantidade e valor nas linhas
+(período, item, tipo) das tabelas de rollup, na mesma transação do INSERT.
+UPDATE e DELETE em movements (inclusive o ON DELETE CASCADE de um item
+apagado) são compensados por triggers: a linha antiga sai do rollup e a nova
+entra. Os relatórios passam a ler algumas centenas de linhas agregadas em vez de varrer
+a tabela movements: daily_movements e product_ranking saem daqui; o
+relatório fiscal continua no MovementStore (reports.py) porque agrupa pelo
+número da NF, que só existe no motivo de cada movimentação. Para popular os
+rollups a partir do histórico existente (ou depois de uma restauração):
+
+    python -m api.rollups rebuild
+"""
+import sqlite3
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from .db import ensure_schema, get_connection
+from .ledger import apply_deltas
+from .parsing import ISO_DATE_PATTERN, parse_date
+from .valuation import apply_movements
+
+GRANULARITIES = {"day": ("movement_rollups_daily", 10), "month": ("movement_rollups_monthly", 7)}
+
+# Corpo dos triggers: tira a movimentação antiga (OLD) do rollup e apaga a linha que ficou vazia.
+# Os triggers não usam ON CONFLICT: o tratamento de conflito do comando externo (o upsert da
+# restauração) prevaleceria sobre o deles
+_REMOVE_OLD = """UPDATE {table} SET movements = movements - 1, quantity = quantity - OLD.quantity,
+                       value = value - OLD.quantity * COALESCE(OLD.price, 0)
+    WHERE period = substr(OLD.date, 1, {length}) AND item_id = OLD.item_id AND type = OLD.type;
+    DELETE FROM {table}
+    WHERE period = substr(OLD.date, 1, {length}) AND item_id = OLD.item_id AND type = OLD.type AND movements <= 0;"""
+
+SCHEMA = "\n".join(f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    period TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    supplier_id TEXT,
+    type TEXT NOT NULL,
+    movements INTEGER NOT NULL DEFAULT 0,
+    quantity REAL NOT NULL DEFAULT 0,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, item_id, type)
+);
+CREATE INDEX IF NOT EXISTS idx_{table}_supplier ON {table}(supplier_id, period);
+CREATE TRIGGER IF NOT EXISTS trg_{table}_movement_delete AFTER DELETE ON movements
+BEGIN
+    {_REMOVE_OLD.format(table=table, length=length)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{table}_movement_update AFTER UPDATE OF item_id, type, quantity, price, date ON movements
+BEGIN
+    {_REMOVE_OLD.format(table=table, length=length)}
+    UPDATE {table} SET movements = movements + 1, quantity = quantity + NEW.quantity,
+                       value = value + NEW.quantity * COALESCE(NEW.price, 0)
+    WHERE period = substr(NEW.date, 1, {length}) AND item_id = NEW.item_id AND type = NEW.type;
+    INSERT INTO {table} (period, item_id, supplier_id, type, movements, quantity, value)
+    SELECT substr(NEW.date, 1, {length}), NEW.item_id, (SELECT supplier_id FROM items WHERE id = NEW.item_id),
+           NEW.type, 1, NEW.quantity, NEW.quantity * COALESCE(NEW.price, 0)
+    WHERE NEW.item_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM {table} WHERE period = substr(NEW.date, 1, {length}) AND item_id = NEW.item_id AND type = NEW.type);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{table}_item_supplier AFTER UPDATE OF supplier_id ON items
+BEGIN
+    UPDATE {table} SET supplier_id = NEW.supplier_id WHERE item_id = NEW.id;
+END;
+""" for table, length in GRANULARITIES.values())
+
+GROUP_COLUMNS = {"item": "item_id", "supplier": "supplier_id", "period": None}
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _iso_day(value):
+    """Data informada pelo usuário (AAAA-MM-DD ou DD/MM/AAAA) como AAAA-MM-DD."""
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Data inválida: {value} (use AAAA-MM-DD)")
+    return parsed.isoformat()
+
+
+def _upsert(conn, table, rows):
+    conn.executemany(f"""
+        INSERT INTO {table} (period, item_id, supplier_id, type, movements, quantity, value)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (period, item_id, type) DO UPDATE SET
+            movements = movements + excluded.movements,
+            quantity = quantity + excluded.quantity,
+            value = value + excluded.value,
+            supplier_id = excluded.supplier_id
+    """, rows)
+
+
+def insert_movements(conn, movements):
+    """
+    Insere movimentações e atualiza os rollups, os snapshots do razão de
+    estoque (ledger) e a valorização a custo na mesma transação.
+
+    Cada movimentação segue as colunas da tabela movements (item_id, type,
+    quantity, price, reason, date, operation_id); id e date são gerados se
+    ausentes. item_id tem de existir em items e date, se informada, tem de ser
+    ISO (AAAA-MM-DD[Thh:mm...]), porque o período do rollup é o prefixo dela.
+    Devolve os ids inseridos.
+    """
+    ensure_schema(conn, SCHEMA, "rollups")
+    item_ids = {m.get('item_id') for m in movements}
+    if None in item_ids:
+        raise ValueError("Movimentação sem item_id.")
+    placeholders = ','.join('?' * len(item_ids))
+    suppliers = dict(conn.execute(
+        f"SELECT id, supplier_id FROM items WHERE id IN ({placeholders})", tuple(item_ids)
+    ).fetchall()) if item_ids else {}
+    unknown = item_ids - suppliers.keys()
+    if unknown:
+        raise ValueError(f"Item não encontrado: {', '.join(sorted(map(str, unknown)))}")
+
+    rows = []
+    aggregates = {granularity: {} for granularity in GRANULARITIES}
+    stock_deltas = {}
+    for movement in movements:
+        if movement.get('type') not in ('in', 'out'):
+            raise ValueError(f"Tipo de movimentação inválido: {movement.get('type')}")
+        moved_at = movement.get('date')
+        if moved_at and not (ISO_DATE_PATTERN.match(moved_at) and parse_date(moved_at)):
+            raise ValueError(f"Data inválida: {moved_at} (use AAAA-MM-DD)")
+        row = (
+            movement.get('id') or f"mov_{uuid.uuid4().hex}",
+            movement.get('item_id'),
+            movement.get('operation_id'),
+            movement['type'],
+            int(movement.get('quantity') or 0),
+            float(movement.get('price') or 0),
+            movement.get('reason'),
+            moved_at or _now(),
+        )
+        rows.append(row)
+        # Agrega em memória primeiro: um lote com o mesmo item/dia vira um único upsert
+        for granularity, (_, length) in GRANULARITIES.items():
+            key = (row[7][:length], row[1], row[3])
+            count, quantity, value = aggregates[granularity].get(key, (0, 0.0, 0.0))
+            aggregates[granularity][key] = (count + 1, quantity + row[4], value + row[4] * row[5])
+        month = (row[1], row[7][:7])
+        stock_deltas[month] = stock_deltas.get(month, 0) + (row[4] if row[3] == 'in' else -row[4])
+
+    with conn:
+        try:
+            conn.executemany(
+                "INSERT INTO movements (id, item_id, operation_id, type, quantity, price, reason, date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Movimentação rejeitada pelo banco: {e}")
+        for granularity, (table, _) in GRANULARITIES.items():
+            _upsert(conn, table, [
+                (period, item_id, suppliers.get(item_id), type_, count, quantity, value)
+                for (period, item_id, type_), (count, quantity, value) in aggregates[granularity].items()
+            ])
+        apply_deltas(conn, stock_deltas)
+        apply_movements(conn, rows)
+    return [row[0] for row in rows]
+
+
+def rebuild_rollups(conn):
+    """Recalcula todos os rollups a partir da tabela movements (backfill)."""
+    ensure_schema(conn, SCHEMA, "rollups")
+    with conn:
+        for table, length in GRANULARITIES.values():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"""
+                INSERT INTO {table} (period, item_id, supplier_id, type, movements, quantity, value)
+                SELECT substr(m.date, 1, {length}), m.item_id, i.supplier_id, m.type,
+                       COUNT(*), SUM(m.quantity), SUM(m.quantity * COALESCE(m.price, 0))
+                FROM movements m LEFT JOIN items i ON i.id = m.item_id
+                WHERE m.item_id IS NOT NULL
+                GROUP BY 1, 2, 3, 4
+            """)
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table, _ in GRANULARITIES.values()}
+
+
+def rollup_summary(conn, granularity='month', group='item', start=None, end=None, supplier_id=None):
+    """
+    Totais de entrada/saída por período agrupados por item, fornecedor ou só período.
+    `start`/`end` seguem o formato do período (AAAA-MM-DD ou AAAA-MM).
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularidade inválida: {granularity}")
+    if group not in GROUP_COLUMNS:
+        raise ValueError(f"Agrupamento inválido: {group}")
+    ensure_schema(conn, SCHEMA, "rollups")
+    table, length = GRANULARITIES[granularity]
+    group_column = GROUP_COLUMNS[group]
+
+    conditions = []
+    params = []
+    if start:
+        conditions.append("period >= ?")
+        params.append(start[:length])
+    if end:
+        conditions.append("period <= ?")
+        params.append(end[:length])
+    if supplier_id:
+        conditions.append("supplier_id = ?")
+        params.append(supplier_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    select_group = f"{group_column} AS grupo, " if group_column else ""
+    group_by = f"period, {group_column}" if group_column else "period"
+
+    rows = conn.execute(f"""
+        SELECT period, {select_group}
+               SUM(CASE WHEN type = 'in' THEN quantity ELSE 0 END) AS quantidadeEntrada,
+               SUM(CASE WHEN type = 'out' THEN quantity ELSE 0 END) AS quantidadeSaida,
+               SUM(CASE WHEN type = 'in' THEN value ELSE 0 END) AS valorEntrada,
+               SUM(CASE WHEN type = 'out' THEN value ELSE 0 END) AS valorSaida,
+               SUM(movements) AS movimentos
+        FROM {table} {where}
+        GROUP BY {group_by}
+        ORDER BY period DESC
+    """, params).fetchall()
+    return [dict(row) for row in rows]
+
+
+def daily_movements(conn, start, end):
+    """Resumo por dia e tipo (in/out): nº de movimentações, quantidade e valor."""
+    start, end = _iso_day(start), _iso_day(end)
+    if end < start:
+        raise ValueError("A data final é anterior à inicial.")
+    ensure_schema(conn, SCHEMA, "rollups")
+    table, _ = GRANULARITIES["day"]
+    rows = conn.execute(f"""
+        SELECT period, type, SUM(movements), SUM(quantity), SUM(value)
+        FROM {table}
+        WHERE period BETWEEN ? AND ?
+        GROUP BY period, type
+        ORDER BY period DESC, type DESC
+    """, (start, end)).fetchall()
+    # Mais recentes primeiro e, no mesmo dia, saídas antes de entradas, como no reports.js
+    return [
+        {"date": period, "type": type_, "movimentos": count, "quantidade": float(quantity), "valor": round(value, 2)}
+        for period, type_, count, quantity, value in rows
+    ]
+
+
+def product_ranking(conn, period_days=None, top=5, today=None):
+    """Itens mais e menos vendidos (saídas) no período, em unidades e embalagens."""
+    ensure_schema(conn, SCHEMA, "rollups")
+    # Sem período o rollup mensal basta e tem bem menos linhas
+    table, _ = GRANULARITIES["day" if period_days else "month"]
+    where = "r.type = 'out'"
+    params = ()
+    if period_days:
+        today_day = date.fromisoformat(_iso_day(today)) if today else date.today()
+        where += " AND r.period >= ?"
+        params = ((today_day - timedelta(days=int(period_days))).isoformat(),)
+    rows = conn.execute(f"""
+        SELECT i.id, i.name, i.units_per_package, i.package_type, SUM(r.quantity) AS sold
+        FROM {table} r JOIN items i ON i.id = r.item_id
+        WHERE {where}
+        GROUP BY i.id
+        HAVING sold != 0
+        ORDER BY sold DESC, i.id
+    """, params).fetchall()
+
+    def describe(row):
+        units = row['units_per_package'] or 0
+        value = float(row['sold'])
+        return {
+            "id": row['id'],
+            "name": row['name'],
+            "quantidade": value,
+            "embalagens": int(value // units) if units else None,
+            "packageType": row['package_type'],
+        }
+
+    return {
+        "maisVendidos": [describe(row) for row in rows[:top]],
+        "menosVendidos": [describe(row) for row in rows[::-1][:top]],
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python -m api.rollups rebuild [database_path]")
+        sys.exit(1)
+
+    conn = get_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+    start = time.perf_counter()
+    counts = rebuild_rollups(conn)
+    print(f"Rollups reconstruídos em {time.perf_counter() - start:.2f} s: {counts}")
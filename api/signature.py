@@ -0,0 +1,348 @@
+"""
+Verificação da assinatura digital (XMLDSig) das NF-e.
+
+O upload aceita qualquer XML que passe no parse; para auditoria, a <Signature>
+do emitente diz se o <infNFe> é o mesmo que ele assinou. A verificação segue o
+que a SEFAZ exige da assinatura da NF-e: uma única <Reference> apontando para
+o Id do <infNFe>, transformações enveloped-signature + C14N, digest SHA-1 (ou
+SHA-256) do <infNFe> canonicalizado e RSA PKCS#1 v1.5 sobre o <SignedInfo>
+canonicalizado, com a chave do certificado X509 embutido em <KeyInfo>.
+
+A cadeia do certificado (ICP-Brasil) não é validada: o resultado diz que a
+nota não foi alterada desde a assinatura e quem é o titular do certificado,
+conferindo a raiz do CNPJ com a do emitente e a vigência na data de emissão.
+
+Certificados decodificados ficam em cache pela impressão digital (SHA-256 do
+DER): notas seguidas do mesmo fornecedor trazem o mesmo certificado e só a
+primeira paga a decodificação. verify_in_pool roda a verificação num pool de
+threads, fora do event loop; latência e fila ficam em signature_stats().
+"""
+import asyncio
+import base64
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from lxml import etree
+
+from .xml_encoding import FALLBACK_ENCODING, is_encoding_error, xml_parser
+
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+ns = {'ds': DS_NS}
+
+# Algoritmo de canonicalização -> argumentos do etree.tostring(method='c14n')
+C14N_METHODS = {
+    'http://www.w3.org/TR/2001/REC-xml-c14n-20010315': {"exclusive": False, "with_comments": False},
+    'http://www.w3.org/TR/2001/REC-xml-c14n-20010315#WithComments': {"exclusive": False, "with_comments": True},
+    'http://www.w3.org/2001/10/xml-exc-c14n#': {"exclusive": True, "with_comments": False},
+    'http://www.w3.org/2001/10/xml-exc-c14n#WithComments': {"exclusive": True, "with_comments": True},
+}
+DEFAULT_C14N = 'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+ENVELOPED = DS_NS + 'enveloped-signature'
+DIGEST_METHODS = {DS_NS + 'sha1': 'sha1', 'http://www.w3.org/2001/04/xmlenc#sha256': 'sha256'}
+SIGNATURE_METHODS = {DS_NS + 'rsa-sha1': ('rsa-sha1', 'SHA1'),
+                     'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256': ('rsa-sha256', 'SHA256')}
+
+CERT_CACHE_SIZE = 1024
+WORKERS = 4
+# Latências guardadas para os percentis de signature_stats
+METRICS_WINDOW = 2000
+
+_certificates = OrderedDict()
+_certificates_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _crypto():
+    try:
+        from cryptography import x509
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    except ImportError as e:
+        raise RuntimeError("A verificação de assinatura requer o pacote cryptography (pip install cryptography).") from e
+    return x509, InvalidSignature, hashes, padding, rsa
+
+
+class VerificationMetrics:
+    """Contadores e latências recentes das verificações (thread-safe)."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+        self.counts = {"verificacoes": 0, "validas": 0, "invalidas": 0, "semAssinatura": 0}
+        self.certificates = {"acertos": 0, "carregados": 0}
+
+    def record(self, seconds, result):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.counts["verificacoes"] += 1
+            if not result["assinada"]:
+                self.counts["semAssinatura"] += 1
+            else:
+                self.counts["validas" if result["valida"] else "invalidas"] += 1
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits.append(seconds)
+
+    def record_certificate(self, hit):
+        with self.lock:
+            self.certificates["acertos" if hit else "carregados"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            latencies, waits = sorted(self.latencies), sorted(self.waits)
+            counts, certificates = dict(self.counts), dict(self.certificates)
+        return {**counts, "latenciaMs": _summary(latencies), "filaMs": _summary(waits),
+                "certificados": {**certificates, "emCache": len(_certificates)}}
+
+
+def _summary(values):
+    if not values:
+        return None
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"amostras": len(values), "media": round(sum(values) / len(values) * 1000, 3),
+            "p50": round(pick(0.5), 3), "p95": round(pick(0.95), 3), "max": round(values[-1] * 1000, 3)}
+
+
+metrics = VerificationMetrics()
+
+
+def _certificate(encoded):
+    """(chave pública, dados do certificado) do X509Certificate em base64, com cache por impressão digital."""
+    der = base64.b64decode(''.join(encoded.split()))
+    fingerprint = hashlib.sha256(der).hexdigest()
+    with _certificates_lock:
+        entry = _certificates.get(fingerprint)
+        if entry is not None:
+            _certificates.move_to_end(fingerprint)
+    metrics.record_certificate(entry is not None)
+    if entry is not None:
+        return entry
+    x509, _, _, _, _ = _crypto()
+    try:
+        certificate = x509.load_der_x509_certificate(der)
+    except ValueError as e:
+        raise ValueError(f"Certificado X509 inválido: {e}")
+    common_names = certificate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    # ICP-Brasil: CN = "RAZÃO SOCIAL:CNPJ"
+    holder, _, cnpj = (common_names[0].value if common_names else '').rpartition(':')
+    info = {
+        "titular": holder or certificate.subject.rfc4514_string(),
+        "cnpj": cnpj if cnpj.isdigit() else None,
+        "emissor": certificate.issuer.rfc4514_string(),
+        "serie": format(certificate.serial_number, 'x'),
+        "validoDe": certificate.not_valid_before_utc.isoformat(),
+        "validoAte": certificate.not_valid_after_utc.isoformat(),
+        "impressaoDigital": fingerprint,
+    }
+    entry = (certificate.public_key(), info)
+    with _certificates_lock:
+        _certificates[fingerprint] = entry
+        if len(_certificates) > CERT_CACHE_SIZE:
+            _certificates.popitem(last=False)
+    return entry
+
+
+def _path_to(element, descendant):
+    """Índices de filho de `element` até `descendant`, ou None se não estiver dentro dele."""
+    path = []
+    while descendant is not element:
+        parent = descendant.getparent()
+        if parent is None:
+            return None
+        path.append(parent.index(descendant))
+        descendant = parent
+    return path[::-1]
+
+
+def _canonical(element, algorithm, enveloped=None):
+    """
+    C14N de `element`; `enveloped` é a <Signature> da transformação
+    enveloped-signature, retirada só se estiver dentro do elemento.
+    """
+    options = C14N_METHODS.get(algorithm)
+    if options is None:
+        raise ValueError(f"Canonicalização não suportada: {algorithm}")
+    path = _path_to(element, enveloped) if enveloped is not None else None
+    # Cópia: a libxml2 escreve xmlns="" nos filhos ao canonicalizar uma subárvore cujo
+    # ancestral redeclara o namespace padrão (nfeProc e NFe declaram o mesmo)
+    element = copy.deepcopy(element)
+    if path:
+        # Só a assinatura que contém a referência: outra <Signature> no meio do conteúdo faz parte do digest
+        node = element
+        for position in path:
+            node = node[position]
+        node.getparent().remove(node)
+    return etree.tostring(element, method='c14n', **options)
+
+
+def _check_digest(info, reference, signature):
+    transforms = [node.get('Algorithm') for node in reference.findall('ds:Transforms/ds:Transform', ns)]
+    c14n = DEFAULT_C14N
+    for transform in transforms:
+        if transform != ENVELOPED:
+            c14n = transform
+    digest_method = reference.find('ds:DigestMethod', ns)
+    algorithm = DIGEST_METHODS.get(digest_method.get('Algorithm') if digest_method is not None else None)
+    if algorithm is None:
+        raise ValueError("Algoritmo de digest não suportado.")
+    digest = hashlib.new(algorithm, _canonical(info, c14n, signature if ENVELOPED in transforms else None)).digest()
+    expected = reference.findtext('ds:DigestValue', '', ns)
+    return base64.b64encode(digest).decode('ascii') == ''.join(expected.split())
+
+
+def _emitted_in_validity(info, emitted_at):
+    try:
+        emitted = datetime.fromisoformat(emitted_at)
+    except (TypeError, ValueError):
+        return None
+    if emitted.tzinfo is None:
+        return info["validoDe"][:10] <= emitted.date().isoformat() <= info["validoAte"][:10]
+    return datetime.fromisoformat(info["validoDe"]) <= emitted <= datetime.fromisoformat(info["validoAte"])
+
+
+def _verify(info):
+    signature = info.getparent().find('ds:Signature', ns) if info.getparent() is not None else None
+    if signature is None:
+        return {"assinada": False, "valida": False, "motivo": "Nota sem assinatura digital."}
+    signed_info = signature.find('ds:SignedInfo', ns)
+    if signed_info is None:
+        raise ValueError("Assinatura sem <SignedInfo>.")
+    references = signed_info.findall('ds:Reference', ns)
+    # A referência tem de ser o próprio <infNFe> lido pelo parser, não outro elemento do arquivo
+    if len(references) != 1 or references[0].get('URI') != f"#{info.get('Id')}":
+        raise ValueError("A assinatura não se refere ao <infNFe> desta nota.")
+    method = signed_info.find('ds:SignatureMethod', ns)
+    algorithm = SIGNATURE_METHODS.get(method.get('Algorithm') if method is not None else None)
+    if algorithm is None:
+        raise ValueError("Algoritmo de assinatura não suportado.")
+    encoded = signature.findtext('ds:KeyInfo/ds:X509Data/ds:X509Certificate', '', ns)
+    if not encoded.strip():
+        raise ValueError("Assinatura sem certificado X509.")
+    public_key, certificate = _certificate(encoded)
+    _, InvalidSignature, hashes, padding, rsa = _crypto()
+    if not isinstance(public_key, rsa.RSAPublicKey):
+        raise ValueError("O certificado não tem chave RSA.")
+
+    digest_ok = _check_digest(info, references[0], signature)
+    c14n = signed_info.find('ds:CanonicalizationMethod', ns)
+    try:
+        public_key.verify(base64.b64decode(''.join(signature.findtext('ds:SignatureValue', '', ns).split())),
+                          _canonical(signed_info, c14n.get('Algorithm') if c14n is not None else DEFAULT_C14N),
+                          padding.PKCS1v15(), getattr(hashes, algorithm[1])())
+        signature_ok = True
+    except InvalidSignature:
+        signature_ok = False
+
+    emitter = info.findtext('{*}emit/{*}CNPJ') or ''
+    certificate = {**certificate,
+                   "cnpjConfere": bool(certificate["cnpj"]) and certificate["cnpj"][:8] == emitter[:8],
+                   "vigenteNaEmissao": _emitted_in_validity(certificate, info.findtext('{*}ide/{*}dhEmi'))}
+    reason = None
+    if not digest_ok:
+        reason = "O conteúdo do <infNFe> foi alterado depois da assinatura (digest não confere)."
+    elif not signature_ok:
+        reason = "A assinatura RSA não confere com o certificado."
+    return {"assinada": True, "valida": digest_ok and signature_ok, "digestValido": digest_ok,
+            "assinaturaValida": signature_ok, "algoritmo": algorithm[0], "motivo": reason,
+            "certificado": certificate}
+
+
+def verify_nfe_signature(info):
+    """
+    Verifica a assinatura do <infNFe> (elemento já parseado). Devolve
+    {"assinada", "valida", "motivo", ...}; problemas de estrutura da assinatura
+    saem como valida=False com o motivo, não como exceção.
+    """
+    start = time.perf_counter()
+    try:
+        result = _verify(info)
+    except ValueError as e:
+        result = {"assinada": True, "valida": False, "motivo": str(e)}
+    metrics.record(time.perf_counter() - start, result)
+    return result
+
+
+def verify_xml_signature(xml_content):
+    """verify_nfe_signature a partir do XML em bytes."""
+    try:
+        try:
+            root = etree.fromstring(xml_content, etree.XMLParser(resolve_entities=False))
+        except etree.XMLSyntaxError as e:
+            if not is_encoding_error(e.code):
+                raise
+            root = etree.fromstring(xml_content, xml_parser(FALLBACK_ENCODING))
+    except etree.XMLSyntaxError as e:
+        return {"assinada": False, "valida": False, "motivo": f"Erro de sintaxe no XML: {e}"}
+    info = root if etree.QName(root).localname == 'infNFe' else root.find('.//{*}infNFe')
+    if info is None:
+        return {"assinada": False, "valida": False, "motivo": "Elemento <infNFe> não encontrado."}
+    return verify_nfe_signature(info)
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='nfe-signature')
+    return _pool
+
+
+def _timed(submitted, xml_content):
+    metrics.record_wait(time.perf_counter() - submitted)
+    return verify_xml_signature(xml_content)
+
+
+def verify_in_pool(xml_content):
+    """
+    Agenda verify_xml_signature no pool de verificação e devolve o future do
+    asyncio: o endpoint segue com o parse e só espera a assinatura no fim.
+    """
+    _crypto()  # pacote ausente falha aqui, não dentro do pool
+    return asyncio.get_running_loop().run_in_executor(_executor(), _timed, time.perf_counter(), xml_content)
+
+
+def signature_stats():
+    return {**metrics.snapshot(), "workers": WORKERS}
+
+
+if __name__ == "__main__":
+    # Custo com/sem cache de certificados e no pool (casos de referência em tests/test_signature.py):
+    # python -m api.signature
+    import glob
+    import os
+
+    contents = [open(path, 'rb').read() for path in
+                sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))]
+    roots = [etree.fromstring(content) for content in contents]
+    infos = [root.find('.//{*}infNFe') for root in roots]
+    rounds = 300
+    timings = {}
+    for label, clear in (("sem cache", True), ("com cache", False)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for info in infos:
+                if clear:
+                    _certificates.clear()
+                verify_nfe_signature(info)
+        timings[label] = (time.perf_counter() - start) / (rounds * len(infos))
+
+    async def batch():
+        start = time.perf_counter()
+        await asyncio.gather(*(verify_in_pool(content) for _ in range(rounds // 10) for content in contents))
+        return (time.perf_counter() - start) / (rounds // 10 * len(contents))
+
+    pooled = asyncio.run(batch())
+    stats = signature_stats()
+    print(", ".join(f"{label} {elapsed * 1000:.3f} ms/nota" for label, elapsed in timings.items())
+          + f"; pool ({WORKERS} threads, com parse) {pooled * 1000:.3f} ms/nota; "
+          f"latência p50 {stats['latenciaMs']['p50']} ms, p95 {stats['latenciaMs']['p95']} ms")
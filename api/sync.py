@@ -0,0 +1,115 @@
+"""
+Sincronização incremental (delta-sync) das tabelas do app.
+
+O loadDataAndRenderApp do database.js faz select('*') em todas as tabelas a
+cada abertura. Com este módulo o cliente guarda um watermark por tabela e pede
+só as linhas alteradas depois dele, em páginas ordenadas por (watermark, id):
+a paginação por chave (keyset) não usa OFFSET, então cada página custa o mesmo
+independentemente do tamanho do histórico.
+
+O watermark devolvido é o próprio cursor (valor, id) da última linha: o since
+seguinte continua exatamente depois dela, sem perder linhas que empatam no
+valor. Um since antigo, só com o valor, é tratado como (valor, '') e inclui os
+empates (o cliente faz upsert, então repetir uma linha não tem efeito).
+
+Linhas apagadas não aparecem mais na tabela: os triggers do db.py registram
+cada DELETE em sync_deletions, com uma sequência própria. O cliente guarda o
+deletedWatermark devolvido e o envia como deleted_since; `deleted` traz os ids
+removidos depois dele. Depois de um restore (backup.py) o cliente deve
+sincronizar do zero.
+"""
+from .db import TABLES, ensure_schema, row_to_dict
+
+# Coluna usada como watermark em cada tabela, mantida pelos triggers do db.py.
+# Em movements, date é a data do movimento (lançamentos retroativos cairiam
+# antes do watermark do cliente), então vale o updated_at da linha.
+SYNC_COLUMNS = {table: "updated_at" for table in TABLES}
+
+MAX_PAGE_SIZE = 5000
+
+SYNC_INDEXES = "\n".join(
+    f"CREATE INDEX IF NOT EXISTS idx_{table}_sync ON {table}({column}, id);"
+    for table, column in SYNC_COLUMNS.items()
+)
+
+
+def encode_cursor(watermark, row_id):
+    return f"{watermark}|{row_id}"
+
+
+def decode_cursor(cursor):
+    watermark, _, row_id = cursor.partition('|')
+    if not row_id:
+        raise ValueError("Cursor inválido.")
+    return watermark, row_id
+
+
+def _after(column, value, row_id):
+    """Condição "depois de (value, row_id)" na ordem (coluna, id)."""
+    return f"({column}, id) > (?, ?)", [value, row_id]
+
+
+def fetch_deletions(conn, table, since=None):
+    """Ids apagados de `table` depois da sequência `since` e a última sequência vista."""
+    try:
+        since = int(since or 0)
+    except ValueError:
+        raise ValueError("deleted_since inválido.")
+    rows = conn.execute(
+        "SELECT seq, row_id FROM sync_deletions WHERE table_name = ? AND seq > ? ORDER BY seq",
+        (table, since),
+    ).fetchall()
+    return [row["row_id"] for row in rows], (rows[-1]["seq"] if rows else since)
+
+
+def fetch_changes(conn, table, since=None, cursor=None, limit=1000, deleted_since=None):
+    """
+    Devolve uma página de linhas alteradas após `since`.
+
+    `cursor` (retornado como nextCursor) continua a página anterior; quando
+    nextCursor vier None o cliente pode gravar `watermark` como o novo since.
+    since e watermark têm o formato do cursor ("valor|id"). As remoções
+    posteriores a `deleted_since` vêm só na primeira página (sem cursor).
+    """
+    if table not in TABLES:
+        raise ValueError(f"Tabela desconhecida: {table}")
+    ensure_schema(conn, SYNC_INDEXES, "sync")
+    column = SYNC_COLUMNS[table]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    # Sem cursor é a primeira página: as remoções vêm junto, antes das linhas
+    deleted, deleted_watermark = fetch_deletions(conn, table, deleted_since) if not cursor else ([], deleted_since)
+
+    conditions = []
+    params = []
+    for position in (since, cursor):
+        if position:
+            # since só com o valor (formato antigo): inclui as linhas com o mesmo valor
+            value, row_id = decode_cursor(position) if '|' in position else (position, '')
+            condition, values = _after(column, value, row_id)
+            conditions.append(condition)
+            params.extend(values)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    # Busca uma linha a mais para saber se existe próxima página
+    rows = conn.execute(
+        f"SELECT {column} AS sync_watermark, * FROM {table} {where} ORDER BY {column}, id LIMIT ?",
+        params + [limit + 1],
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    last = rows[-1] if rows else None
+    position = encode_cursor(last["sync_watermark"], last["id"]) if last is not None else None
+    result_rows = []
+    for row in rows:
+        data = row_to_dict(table, row)
+        del data["sync_watermark"]
+        result_rows.append(data)
+    return {
+        "table": table,
+        "rows": result_rows,
+        "nextCursor": position if has_more else None,
+        "watermark": position or since,
+        "deleted": deleted,
+        "deletedWatermark": deleted_watermark,
+    }
@@ -0,0 +1,101 @@
+"""
+Extração dos tributos da NF-e (<imposto> de cada item e <total>/<ICMSTot>).
+
+parse_nfe_xml chama extract_item_taxes com o <imposto> do <det> que já está
+percorrendo, então os tributos saem na mesma passada dos produtos, sem novas
+buscas na árvore. A extração é opcional (parse_nfe_xml(..., include_taxes=True)
+ou /api/upload/?impostos=true): quem não precisa não paga nada.
+
+Cada tributo (ICMS, IPI, PIS, COFINS, II, ...) vira um dict com o grupo usado
+na nota (ICMS00, ICMSSN102, PISAliq, IPINT...) e os campos folha. Campos de
+valor, alíquota e quantidade (vBC, pICMS, qBCProd...) viram float; códigos
+(orig, CST, CSOSN, modBC, cEnq) ficam como texto.
+"""
+from .parsing import parse_number
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def _is_number_field(name):
+    # vBC, pICMS, qBCProd, vAliqProd: prefixo minúsculo v/p/q seguido de maiúscula
+    return len(name) > 1 and name[0] in 'vpq' and name[1].isupper()
+
+
+def _leaf_value(name, element):
+    text = (element.text or '').strip()
+    return parse_number(text) if _is_number_field(name) else text
+
+
+def extract_item_taxes(imposto):
+    """Tributos de um item a partir do elemento <imposto> (ou None)."""
+    if imposto is None:
+        return {}
+    taxes = {}
+    for tax in imposto:
+        if not isinstance(tax.tag, str):
+            continue  # comentários
+        name = _local_name(tax.tag)
+        if len(tax) == 0:
+            taxes[name] = _leaf_value(name, tax)  # vTotTrib
+            continue
+        data = {}
+        for child in tax:
+            if not isinstance(child.tag, str):
+                continue
+            child_name = _local_name(child.tag)
+            if len(child):
+                # Grupo da situação tributária (ICMS00, PISAliq, IPITrib...)
+                data["grupo"] = child_name
+                for leaf in child:
+                    if isinstance(leaf.tag, str):
+                        leaf_name = _local_name(leaf.tag)
+                        data[leaf_name] = _leaf_value(leaf_name, leaf)
+            else:
+                data[child_name] = _leaf_value(child_name, child)  # cEnq do IPI
+        taxes[name] = data
+    return taxes
+
+
+def extract_icms_totals(infNFe, ns):
+    """Totais da nota (<total>/<ICMSTot>) como {campo: valor}."""
+    icms_tot = infNFe.find('nfe:total/nfe:ICMSTot', ns) if ns else infNFe.find('total/ICMSTot')
+    if icms_tot is None:
+        return {}
+    return {
+        _local_name(leaf.tag): _leaf_value(_local_name(leaf.tag), leaf)
+        for leaf in icms_tot if isinstance(leaf.tag, str)
+    }
+
+
+if __name__ == "__main__":
+    # Custo da extração de tributos sobre os XMLs de exemplo: python -m api.taxes
+    import contextlib
+    import glob
+    import io
+    import os
+    import time
+
+    from .index import parse_nfe_xml
+
+    files = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))
+    contents = [open(path, 'rb').read() for path in files]
+    rounds = 50
+
+    def run(include_taxes):
+        with contextlib.redirect_stdout(io.StringIO()):  # os prints DEBUG do parser
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for content in contents:
+                    parse_nfe_xml(content, include_taxes=include_taxes)
+            return (time.perf_counter() - start) / (rounds * len(contents))
+
+    run(False)
+    without_taxes = run(False)
+    with_taxes = run(True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        items = sum(len(parse_nfe_xml(c)["produtos"]) for c in contents)
+    print(f"{len(contents)} XMLs ({items} itens): sem tributos {without_taxes * 1000:.2f} ms/nota, "
+          f"com tributos {with_taxes * 1000:.2f} ms/nota "
+          f"(+{(with_taxes / without_taxes - 1) * 100:.0f}%)")
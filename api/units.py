@@ -0,0 +1,145 @@
+"""
+Normalização de unidades e pesos a partir das descrições dos produtos.
+
+Antes havia quatro leituras diferentes de "12x400g": get_qty_kg e
+calculate_audited_weight no index.py, calculateSimulationItemQtyUnit no
+simulation.js e parseQtyUnit no invoice.js (ML só era tratado no cliente).
+Este módulo é a regra única: a gramática fica compilada no carregamento, o
+resultado por descrição é memorizado (catálogos e notas repetem muito as mesmas
+descrições) e o endpoint /api/units/normalize devolve um lote inteiro de uma vez.
+
+Conversões para kg: g/gr = 1/1000, kg = 1, t = 1000, l = 1,03 (densidade do
+leite, como já era no parser) e ml = 1,03/1000.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+KG_FACTORS = {"kg": 1.0, "g": 0.001, "gr": 0.001, "t": 1000.0, "l": 1.03, "ml": 0.00103}
+
+# Rótulo de unidade devolvido em dadosCompletos.unidade (gr vira G)
+UNIT_LABELS = {"g": "G", "gr": "G", "kg": "KG", "l": "L", "ml": "ML"}
+
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+_UNIT = r'(kg|gr|g|ml|l)'
+# Pacote (20x500g) tem prioridade sobre item único (0.400kg), como no parser original
+PACKAGE_PATTERN = re.compile(_NUMBER + r'\s*x\s*' + _NUMBER + r'\s*' + _UNIT + r'(?![a-z])')
+SINGLE_PATTERN = re.compile(_NUMBER + r'\s*' + _UNIT + r'\b')
+
+UnitSpec = namedtuple("UnitSpec", "units_per_package unit_value unit_type kg")
+
+
+def _number(text):
+    return float(text.replace(',', '.'))
+
+
+def _to_kg(quantity, unit_type):
+    # g e ml dividem por 1000 como o parser sempre fez (mesmo arredondamento de float)
+    if unit_type in ('g', 'gr'):
+        return quantity / 1000.0
+    if unit_type == 'ml':
+        return quantity / 1000.0 * KG_FACTORS['l']
+    return quantity * KG_FACTORS[unit_type]
+
+
+@lru_cache(maxsize=65536)
+def parse_description(description):
+    """
+    Lê a embalagem de uma descrição ("CX 12X400G", "LEITE 1L").
+
+    Devolve UnitSpec(unidades por embalagem, valor da unidade, tipo, kg por
+    unidade comercial) ou None se a descrição não tiver peso/volume.
+    """
+    if not description:
+        return None
+    text = description.lower()
+    match = PACKAGE_PATTERN.search(text)
+    if match:
+        units, value, unit_type = _number(match.group(1)), _number(match.group(2)), match.group(3)
+    else:
+        match = SINGLE_PATTERN.search(text)
+        if not match:
+            return None
+        units, value, unit_type = 1.0, _number(match.group(1)), match.group(2)
+    if unit_type == 'gr':
+        unit_type = 'g'
+    return unit_spec(units, value, unit_type)
+
+
+def unit_spec(units_per_package, unit_value, unit_type):
+    return UnitSpec(units_per_package, unit_value, unit_type, _to_kg(units_per_package * unit_value, unit_type))
+
+
+def audited_weight(description, quantity):
+    """Peso total em kg de `quantity` unidades comerciais pela descrição: (kg, rótulo) ou (None, None)."""
+    if not description or quantity == 0:
+        return (None, None)
+    return spec_weight(parse_description(description), quantity)
+
+
+def spec_weight(spec, quantity):
+    """Peso total em kg de `quantity` unidades comerciais de uma embalagem já resolvida."""
+    if spec is None or quantity == 0:
+        return (None, None)
+    return (_to_kg(quantity * (spec.units_per_package * spec.unit_value), spec.unit_type), UNIT_LABELS[spec.unit_type])
+
+
+def quantity_to_kg(unit, quantity):
+    """Converte uma quantidade em unidade fiscal (uTrib/uCom) para kg; None se não for unidade de peso."""
+    unit = (unit or '').strip().lower()
+    return _to_kg(quantity, unit) if unit in KG_FACTORS else None
+
+
+def qty_unit_label(spec):
+    """Texto de exibição no formato do simulation.js ("12X400G", "1L")."""
+    if spec is None or not spec.unit_value:
+        return ''
+    value = f"{spec.unit_value:g}{spec.unit_type.upper()}"
+    return f"{spec.units_per_package:g}X{value}" if spec.units_per_package != 1 else value
+
+
+def normalize_descriptions(descriptions):
+    """Normaliza um lote de descrições; a ordem da saída é a da entrada."""
+    result = []
+    for description in descriptions:
+        spec = parse_description(description)
+        if spec is None:
+            result.append(None)
+            continue
+        result.append({
+            "unitsPerPackage": spec.units_per_package,
+            "unitMeasureValue": spec.unit_value,
+            "unitMeasureType": spec.unit_type,
+            "kgPerUnit": round(spec.kg, 6),
+            "qtyUnit": qty_unit_label(spec),
+        })
+    return result
+
+
+if __name__ == "__main__":
+    # Conferência com a regra antiga e benchmark: python -m api.units
+    import random
+    import time
+
+    cases = {
+        "LEITE EM PO 20X500G": (10.0, "G"),
+        "QUEIJO 0,400KG": (0.4, "KG"),
+        "CX 12 x 1 kg": (12.0, "KG"),
+        "LEITE UHT 1L": (1.03, "L"),
+        "SUCO 24X200ML": (4.944, "ML"),
+        "BISCOITO 400GR": (0.4, "G"),
+        "CAIXA SORTIDA": (None, None),
+    }
+    for description, expected in cases.items():
+        kg, label = audited_weight(description, 1.0)
+        assert (round(kg, 6) if kg is not None else None, label) == expected, (description, kg, label)
+    assert quantity_to_kg("GR", 500) == 0.5 and quantity_to_kg("UN", 3) is None
+    print("Casos de referência OK")
+
+    rng = random.Random(1)
+    descriptions = [f"PRODUTO {rng.randint(1, 5000)} {rng.choice([6, 12, 24])}X{rng.choice([200, 400, 500, 1000])}"
+                    f"{rng.choice(['G', 'GR', 'ML', 'KG'])}" for _ in range(100_000)]
+    start = time.perf_counter()
+    normalize_descriptions(descriptions)
+    print(f"100 mil descrições: {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"(cache: {parse_description.cache_info().hits} acertos)")
@@ -0,0 +1,370 @@
+"""
+Valorização do estoque a custo: custo médio ponderado e PEPS (FIFO).
+
+O custo de cada entrada é movements.price — nas entradas via NF-e é o vUnCom
+extraído por parse_nfe_xml (operations.js grava prod.costPrice no movimento);
+nas entradas manuais, o cost_price do item.
+
+Dois caminhos com as mesmas regras:
+
+* incremental: insert_movements chama apply_movements na mesma transação e o
+  estado de cada item (saldo, valor médio, camadas PEPS) fica em
+  inventory_valuation. Movimentação retroativa recalcula só aquele item, e
+  UPDATE/DELETE em movements marcam o item em valuation_dirty (trigger) para
+  ser recalculado antes da próxima leitura ou atualização.
+* em massa: valuation_arrays processa as colunas NumPy do MovementStore
+  (reports.py) sem laço por movimentação — serve para consultas em datas
+  passadas e para reconstruir a tabela:
+
+    python -m api.valuation rebuild [database_path]
+
+Regras: movimentações de um item seguem a ordem (dia, rowid). No custo médio,
+uma saída que zera ou negativa o saldo zera o valor. No PEPS as saídas
+consomem as entradas mais antigas; saídas acima do saldo ficam como
+pendência e consomem as próximas entradas.
+"""
+import json
+
+import numpy as np
+
+from .db import ensure_schema, get_connection
+from .reports import get_movement_store, parse_day
+
+METHODS = ("average", "fifo")
+
+# Sem OR IGNORE/ON CONFLICT: dentro de trigger o tratamento de conflito do comando externo
+# (o upsert da restauração) prevaleceria
+_MARK = ("INSERT INTO valuation_dirty (item_id) SELECT {item} WHERE {item} IS NOT NULL "
+         "AND NOT EXISTS (SELECT 1 FROM valuation_dirty WHERE item_id = {item});")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS inventory_valuation (
+    item_id TEXT PRIMARY KEY,
+    quantity REAL NOT NULL DEFAULT 0,
+    average_value REAL NOT NULL DEFAULT 0,
+    fifo_layers TEXT NOT NULL DEFAULT '[]',
+    fifo_backlog REAL NOT NULL DEFAULT 0,
+    last_day TEXT
+);
+CREATE TABLE IF NOT EXISTS valuation_dirty (item_id TEXT PRIMARY KEY);
+CREATE TRIGGER IF NOT EXISTS trg_valuation_movement_delete AFTER DELETE ON movements
+BEGIN
+    {_MARK.format(item='OLD.item_id')}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_valuation_movement_update AFTER UPDATE OF item_id, type, quantity, price, date ON movements
+BEGIN
+    {_MARK.format(item='OLD.item_id')}
+    {_MARK.format(item='NEW.item_id')}
+END;
+"""
+
+
+class ItemCost:
+    """Estado de custo de um item, atualizado movimentação a movimentação."""
+
+    def __init__(self, quantity=0.0, average_value=0.0, layers=None, backlog=0.0, last_day=None):
+        self.quantity = quantity
+        self.average_value = average_value
+        self.layers = layers or []  # [[quantidade, custo unitário], ...] da mais antiga para a mais nova
+        self.backlog = backlog
+        self.last_day = last_day
+
+    def apply(self, type_, quantity, price, day):
+        if type_ == 'in':
+            self.average_value += quantity * price
+            consumed = min(self.backlog, quantity)
+            self.backlog -= consumed
+            if quantity > consumed:
+                if self.layers and self.layers[-1][1] == price:
+                    self.layers[-1][0] += quantity - consumed
+                else:
+                    self.layers.append([quantity - consumed, price])
+            self.quantity += quantity
+        else:
+            if self.quantity > quantity:
+                self.average_value *= 1 - quantity / self.quantity
+            else:
+                self.average_value = 0.0
+            remaining = quantity
+            while remaining and self.layers:
+                take = min(remaining, self.layers[0][0])
+                remaining -= take
+                self.layers[0][0] -= take
+                if not self.layers[0][0]:
+                    self.layers.pop(0)
+            self.backlog += remaining
+            self.quantity -= quantity
+        self.last_day = day
+
+    def value(self, method):
+        if method == 'fifo':
+            return sum(q * p for q, p in self.layers)
+        return self.average_value if self.quantity > 0 else 0.0
+
+
+def _load_state(conn, item_ids):
+    placeholders = ','.join('?' * len(item_ids))
+    return {
+        row['item_id']: ItemCost(row['quantity'], row['average_value'], json.loads(row['fifo_layers']),
+                                 row['fifo_backlog'], row['last_day'])
+        for row in conn.execute(f"SELECT * FROM inventory_valuation WHERE item_id IN ({placeholders})",
+                                tuple(item_ids))
+    }
+
+
+def _replay(conn, item_id):
+    """Recalcula um item a partir de todas as suas movimentações."""
+    state = ItemCost()
+    for row in conn.execute(
+        "SELECT type, quantity, price, substr(date, 1, 10) FROM movements WHERE item_id = ? "
+        "ORDER BY substr(date, 1, 10), rowid",
+        (item_id,),
+    ):
+        state.apply(row[0], row[1], row[2] or 0.0, row[3])
+    return state
+
+
+def _save_state(conn, states):
+    conn.executemany("""
+        INSERT INTO inventory_valuation (item_id, quantity, average_value, fifo_layers, fifo_backlog, last_day)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (item_id) DO UPDATE SET
+            quantity = excluded.quantity, average_value = excluded.average_value,
+            fifo_layers = excluded.fifo_layers, fifo_backlog = excluded.fifo_backlog,
+            last_day = excluded.last_day
+    """, [
+        (item_id, s.quantity, s.average_value, json.dumps(s.layers), s.backlog, s.last_day)
+        for item_id, s in states.items()
+    ])
+
+
+def _replay_dirty(conn):
+    """Recalcula os itens marcados por UPDATE/DELETE em movements; item sem movimentação sai da tabela."""
+    dirty = [row[0] for row in conn.execute("SELECT item_id FROM valuation_dirty")]
+    if not dirty:
+        return
+    states = {item_id: _replay(conn, item_id) for item_id in dirty}
+    conn.executemany("DELETE FROM inventory_valuation WHERE item_id = ?",
+                     [(item_id,) for item_id, state in states.items() if state.last_day is None])
+    _save_state(conn, {item_id: state for item_id, state in states.items() if state.last_day is not None})
+    conn.execute("DELETE FROM valuation_dirty")
+
+
+def apply_movements(conn, rows):
+    """
+    Atualiza inventory_valuation com linhas já inseridas em movements
+    (id, item_id, operation_id, type, quantity, price, reason, date).
+    Chamado dentro da transação de insert_movements.
+    """
+    ensure_schema(conn, SCHEMA, "valuation")
+    _replay_dirty(conn)
+    rows = sorted((r for r in rows if r[1] is not None), key=lambda r: r[7][:10])
+    if not rows:
+        return
+    states = _load_state(conn, {r[1] for r in rows})
+    replay = set()
+    for row in rows:
+        state = states.setdefault(row[1], ItemCost())
+        day = row[7][:10]
+        if row[1] in replay:
+            continue
+        if state.last_day and day < state.last_day:
+            # Retroativa: a ordem (dia, rowid) mudou, o item é recalculado do zero
+            replay.add(row[1])
+            continue
+        state.apply(row[3], row[4], row[5], day)
+    for item_id in replay:
+        states[item_id] = _replay(conn, item_id)
+    _save_state(conn, states)
+
+
+def valuation_arrays(store, until_day=None):
+    """
+    Valorização vetorizada sobre as colunas do MovementStore.
+
+    Devolve (item_code, quantidade, valor médio, valor PEPS, camadas) onde
+    camadas = (item_code, quantidade restante, custo) das entradas ainda em
+    estoque, na ordem de consumo.
+    """
+    mask = np.ones(len(store.day), dtype=bool) if until_day is None else store.day <= until_day
+    idx = np.nonzero(mask)[0]
+    order = idx[np.lexsort((idx, store.day[idx], store.item_code[idx]))]
+    item = store.item_code[order].astype(np.int64)
+    is_in = ~store.is_out[order]
+    q = store.quantity[order]
+    price = store.price[order]
+    if not len(order):
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, empty, (np.empty(0, dtype=np.int64), empty, empty)
+
+    starts = np.r_[0, np.nonzero(np.diff(item))[0] + 1]
+    lengths = np.diff(np.r_[starts, len(item)])
+    ends = starts + lengths - 1
+    codes = item[starts]
+
+    def segmented_cumsum(values):
+        total = np.cumsum(values)
+        return total - np.repeat(total[starts] - values[starts], lengths)
+
+    # Custo médio: V_k = V_{k-1} * a_k + b_k, com a_k = 1 - q/Q_{k-1} nas saídas.
+    # Uma saída que zera o saldo (a_k = 0) reinicia o valor; no último trecho de
+    # cada item V_final = soma b_k * exp(L_final - L_k), L = soma acumulada de log a.
+    signed = np.where(is_in, q, -q)
+    balance = segmented_cumsum(signed)
+    previous = balance - signed
+    reset = ~is_in & (previous <= q)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_a = np.where(~is_in & ~reset, np.log1p(-q / np.where(previous > 0, previous, 1)), 0.0)
+    segment = segmented_cumsum(reset.astype(np.int64))
+    log_total = np.cumsum(log_a)
+    last_of = np.repeat(ends, lengths)
+    live = is_in & (segment == segment[last_of])
+    contribution = np.where(live, q * price * np.exp(log_total[last_of] - log_total), 0.0)
+    quantity = balance[ends]
+    item_pos = np.repeat(np.arange(len(starts)), lengths)
+    average = np.bincount(item_pos, weights=contribution, minlength=len(starts))
+    average = np.where(quantity > 0, average, 0.0)
+
+    # PEPS: as saídas consomem as primeiras unidades de entrada, então o que resta
+    # de cada entrada k é max(0, min(q_k, C_k - O)), C = entradas acumuladas e O = total de saídas.
+    in_q = np.where(is_in, q, 0.0)
+    received = segmented_cumsum(in_q)
+    issued = np.repeat(np.add.reduceat(np.where(is_in, 0.0, q), starts), lengths)
+    remaining = np.where(is_in, np.clip(received - issued, 0.0, in_q), 0.0)
+    fifo = np.bincount(item_pos, weights=remaining * price, minlength=len(starts))
+
+    layer_rows = np.nonzero(remaining > 0)[0]
+    layers = (item[layer_rows], remaining[layer_rows], price[layer_rows])
+    return codes, quantity, average, fifo, layers
+
+
+def valuation(conn, method='average', on_date=None, item_id=None):
+    """
+    Valor do estoque a custo por item: [{item_id, quantidade, valor, custoMedio}].
+
+    Sem `on_date` lê o estado incremental de inventory_valuation; com data,
+    recalcula de forma vetorizada só com as movimentações até o fim daquele dia.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Método de custeio inválido: {method}")
+    if on_date is None:
+        ensure_schema(conn, SCHEMA, "valuation")
+        with conn:
+            _replay_dirty(conn)
+        query = "SELECT * FROM inventory_valuation"
+        params = ()
+        if item_id:
+            query += " WHERE item_id = ?"
+            params = (item_id,)
+        rows = [
+            (row['item_id'], row['quantity'],
+             ItemCost(row['quantity'], row['average_value'], json.loads(row['fifo_layers'])).value(method))
+            for row in conn.execute(query, params)
+        ]
+    else:
+        store = get_movement_store(conn)
+        codes, quantity, average, fifo, _ = valuation_arrays(store, parse_day(on_date))
+        values = fifo if method == 'fifo' else average
+        rows = [(store.item_ids[c], qty, value)
+                for c, qty, value in zip(codes.tolist(), quantity.tolist(), values.tolist())
+                if store.item_ids[c] is not None and (not item_id or store.item_ids[c] == item_id)]
+
+    result = [
+        {
+            "item_id": item,
+            "quantidade": qty,
+            "valor": round(value, 2),
+            "custoMedio": round(value / qty, 4) if qty > 0 else 0.0,
+        }
+        for item, qty, value in rows
+    ]
+    return {
+        "method": method,
+        "date": on_date,
+        "itens": result,
+        "total": round(sum(row["valor"] for row in result), 2),
+    }
+
+
+def rebuild_valuation(conn):
+    """Reconstrói inventory_valuation a partir de todas as movimentações (vetorizado)."""
+    ensure_schema(conn, SCHEMA, "valuation")
+    store = get_movement_store(conn)
+    codes, quantity, average, _, (layer_item, layer_q, layer_price) = valuation_arrays(store)
+    layer_lists = {}
+    for code, q, p in zip(layer_item.tolist(), layer_q.tolist(), layer_price.tolist()):
+        layers = layer_lists.setdefault(code, [])
+        if layers and layers[-1][1] == p:
+            layers[-1][0] += q
+        else:
+            layers.append([q, p])
+    last_days = {}
+    for code, day in zip(store.item_code.tolist(), store.day.tolist()):
+        if day > last_days.get(code, -1 << 62):
+            last_days[code] = day
+
+    states = {}
+    for code, qty, avg in zip(codes.tolist(), quantity.tolist(), average.tolist()):
+        item_id = store.item_ids[code]
+        if item_id is None:
+            continue
+        layers = layer_lists.get(code, [])
+        # Pendência PEPS = saídas que não encontraram entrada para consumir
+        states[item_id] = ItemCost(qty, avg, layers, max(0.0, -qty), str(np.datetime64(last_days[code], 'D')))
+    with conn:
+        conn.execute("DELETE FROM inventory_valuation")
+        conn.execute("DELETE FROM valuation_dirty")
+        _save_state(conn, states)
+    return len(states)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    import time
+
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        conn = get_connection(sys.argv[2] if len(sys.argv) > 2 else None)
+        start = time.perf_counter()
+        count = rebuild_valuation(conn)
+        print(f"{count} itens valorizados em {time.perf_counter() - start:.2f} s")
+        sys.exit(0)
+
+    # Benchmark + conferência contra o caminho incremental: python -m api.valuation
+    rng = np.random.default_rng(7)
+    n_items, n = 50_000, 2_000_000
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    conn = get_connection(path)
+    conn.executemany("INSERT INTO items (id, name) VALUES (?, ?)", [(f"item_{i}", f"Item {i}") for i in range(n_items)])
+    days = np.datetime64('2022-01-01') + rng.integers(0, 1000, n).astype('timedelta64[D]')
+    conn.executemany(
+        "INSERT INTO movements (id, item_id, type, quantity, price, date) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"mov_{i}", f"item_{it}", 'out' if o else 'in', int(q), float(p), f"{d}T10:00:00Z")
+         for i, (it, o, q, p, d) in enumerate(zip(
+             rng.integers(0, n_items, n), rng.random(n) < 0.45, rng.integers(1, 100, n),
+             rng.uniform(1, 50, n).round(2), days.astype(str)))),
+    )
+    conn.commit()
+
+    start = time.perf_counter()
+    get_movement_store(conn)
+    print(f"Carga de {n} movimentações: {time.perf_counter() - start:.2f} s")
+    for method in METHODS:
+        start = time.perf_counter()
+        total = valuation(conn, method, "2024-06-30")["total"]
+        print(f"valuation {method} em data passada ({n_items} itens): "
+              f"{time.perf_counter() - start:.2f} s, total {total:,.2f}")
+    start = time.perf_counter()
+    rebuild_valuation(conn)
+    print(f"rebuild_valuation: {time.perf_counter() - start:.2f} s")
+
+    sample = [f"item_{i}" for i in rng.integers(0, n_items, 200)]
+    mismatches = 0
+    for item_id in sample:
+        state = _replay(conn, item_id)
+        for method in METHODS:
+            row = next(r for r in valuation(conn, method, item_id=item_id)["itens"])
+            if abs(row["valor"] - round(state.value(method), 2)) > 0.01:
+                mismatches += 1
+    print(f"Conferência incremental x vetorizado (200 itens): {mismatches} divergências")
@@ -0,0 +1,279 @@
+"""
+Detecção de anomalias de peso nas NF-e.
+
+parse_nfe_xml troca o peso declarado (qTrib em kg) pelo calculado a partir da
+descrição sempre que os dois diferem em mais de 0,01 kg, e nada ficava
+registrado. Agora o parser anota {"declarado", "auditado"} em
+produto["auditoriaPeso"] e cada nota gravada no nfe_store deixa em
+weight_audit uma linha por item com o peso declarado, o auditado e a
+quantidade comercial.
+
+A referência de cada (CNPJ do emitente, cProd) é o kg declarado por unidade
+comercial nas notas anteriores: mediana e desvio absoluto mediano (MAD), que
+não se deixam levar pelos próprios erros que queremos achar. As estatísticas
+de todos os produtos saem de uma vez com NumPy: as linhas são ordenadas por
+(grupo, valor) com lexsort e a mediana de cada grupo é lida direto nas
+posições do meio de cada trecho, sem laço por produto.
+
+Um item é marcado quando:
+
+* o declarado diverge do calculado pela descrição (o caso que o parser
+  corrige calado);
+* o kg por unidade foge da referência do produto (z robusto acima de
+  Z_THRESHOLD, com pelo menos MIN_HISTORY notas anteriores).
+"""
+import numpy as np
+
+from .db import ensure_schema
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weight_audit (
+    access_key TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    cnpj TEXT NOT NULL,
+    code TEXT NOT NULL,
+    data_emissao TEXT,
+    quantity REAL NOT NULL,
+    declared_kg REAL NOT NULL,
+    audited_kg REAL,
+    PRIMARY KEY (access_key, line)
+);
+CREATE INDEX IF NOT EXISTS idx_weight_audit_product ON weight_audit(cnpj, code);
+CREATE INDEX IF NOT EXISTS idx_weight_audit_data ON weight_audit(data_emissao);
+"""
+
+MIN_HISTORY = 5
+Z_THRESHOLD = 3.5
+# Divergência declarado x descrição tolerada: a maior entre 0,01 kg (a do parser) e 5%
+DIVERGENCE_KG = 0.01
+DIVERGENCE_RATIO = 0.05
+# MAD -> desvio-padrão numa distribuição normal
+MAD_SCALE = 1.4826
+# Limite de variáveis por consulta do SQLite
+QUERY_CHUNK = 900
+
+COLUMNS = "access_key, line, cnpj, code, data_emissao, quantity, declared_kg, audited_kg"
+
+
+def _note_rows(access_key, parsed):
+    cnpj = (parsed.get("fornecedor") or {}).get("cnpj")
+    if not cnpj:
+        return []
+    data_emissao = (parsed.get("notaFiscal") or {}).get("dataEmissao")
+    rows = []
+    for line, product in enumerate(parsed.get("produtos", [])):
+        quantity = product.get("quantity") or 0
+        if not product.get("code") or quantity <= 0:
+            continue
+        audit = product.get("auditoriaPeso")
+        declared = audit["declarado"] if audit else product.get("calculated_qty_kg") or 0.0
+        rows.append((access_key, line, cnpj, product["code"], data_emissao, quantity,
+                     declared, audit["auditado"] if audit else None))
+    return rows
+
+
+def record_weights(conn, access_key, parsed):
+    """Registra os pesos dos itens de uma nota; chamado pelo nfe_store na mesma transação da gravação."""
+    ensure_schema(conn, SCHEMA, "weight_anomalies")
+    conn.executemany(
+        f"INSERT OR REPLACE INTO weight_audit ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        _note_rows(access_key, parsed),
+    )
+
+
+def delete_weights(conn, access_key):
+    """Tira da referência os itens de uma nota (cancelada)."""
+    ensure_schema(conn, SCHEMA, "weight_anomalies")
+    conn.execute("DELETE FROM weight_audit WHERE access_key = ?", (access_key,))
+
+
+def _columns(rows):
+    """Linhas de weight_audit (COLUMNS) -> arrays de quantidade, declarado e auditado."""
+    quantity = np.array([row[5] for row in rows], dtype=np.float64)
+    declared = np.array([row[6] for row in rows], dtype=np.float64)
+    audited = np.array([np.nan if row[7] is None else row[7] for row in rows], dtype=np.float64)
+    return quantity, declared, audited
+
+
+def _sorted_median(values, starts, counts):
+    return (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+
+
+def group_baselines(groups, values):
+    """
+    Mediana, MAD e contagem por grupo. `groups` são inteiros 0..g-1;
+    NaN em `values` é ignorado.
+    """
+    valid = ~np.isnan(values)
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    counts = np.bincount(groups[valid], minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    median = np.full(n_groups, np.nan)
+    mad = np.full(n_groups, np.nan)
+    present = counts > 0
+    g, v = groups[valid], values[valid]
+    order = np.lexsort((v, g))
+    median[present] = _sorted_median(v[order], starts[present], counts[present])
+    deviation = np.abs(v - median[g])
+    order = np.lexsort((deviation, g))
+    mad[present] = _sorted_median(deviation[order], starts[present], counts[present])
+    return median, mad, counts
+
+
+def _flags(quantity, declared, audited, median, mad, counts):
+    """Motivos por linha, dado o histórico do produto de cada linha (arrays alinhados)."""
+    per_unit = np.where(declared > 0, declared / quantity, np.nan)
+    tolerance = np.maximum(DIVERGENCE_KG, DIVERGENCE_RATIO * np.nan_to_num(audited))
+    divergent = (declared > 0) & ~np.isnan(audited) & (np.abs(declared - np.nan_to_num(audited)) > tolerance)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # MAD zero (histórico todo igual): qualquer variação acima de 1% conta como fora
+        scale = np.where(mad > 0, MAD_SCALE * mad, 0.01 * np.abs(median) / Z_THRESHOLD)
+        z = np.abs(per_unit - median) / scale
+    outlier = (counts >= MIN_HISTORY) & ~np.isnan(per_unit) & (z > Z_THRESHOLD)
+    return per_unit, z, divergent, outlier
+
+
+def _describe(row, per_unit, median, mad, count, z, divergent, outlier):
+    reasons = []
+    if divergent:
+        reasons.append("Peso declarado difere do calculado pela descrição")
+    if outlier:
+        reasons.append("Kg por unidade fora do histórico do produto")
+    return {
+        "code": row[3],
+        "linha": row[1],
+        "pesoDeclarado": row[6],
+        "pesoAuditado": row[7],
+        "kgPorUnidade": None if np.isnan(per_unit) else round(float(per_unit), 6),
+        "mediana": None if np.isnan(median) else round(float(median), 6),
+        "mad": None if np.isnan(mad) else round(float(mad), 6),
+        "historico": int(count),
+        "zRobusto": None if not np.isfinite(z) else round(float(z), 2),
+        "motivos": reasons,
+    }
+
+
+def check_note(conn, access_key, parsed):
+    """
+    Confere os itens de uma nota contra o histórico dos mesmos produtos do
+    fornecedor (sem a própria nota). Devolve só os itens marcados.
+    """
+    ensure_schema(conn, SCHEMA, "weight_anomalies")
+    rows = _note_rows(access_key, parsed)
+    if not rows:
+        return []
+    cnpj = rows[0][2]
+    codes = sorted({row[3] for row in rows})
+    history = []
+    for start in range(0, len(codes), QUERY_CHUNK):
+        chunk = codes[start:start + QUERY_CHUNK]
+        history += conn.execute(
+            f"SELECT {COLUMNS} FROM weight_audit WHERE cnpj = ? AND code IN ({','.join('?' * len(chunk))}) "
+            "AND access_key != ?",
+            (cnpj, *chunk, access_key),
+        ).fetchall()
+
+    index = {code: i for i, code in enumerate(codes)}
+    median = np.full(len(codes), np.nan)
+    mad = np.full(len(codes), np.nan)
+    counts = np.zeros(len(codes), dtype=np.int64)
+    if history:
+        h_quantity, h_declared, _ = _columns(history)
+        h_groups = np.array([index[row[3]] for row in history])
+        per_unit = np.where(h_declared > 0, h_declared / h_quantity, np.nan)
+        m, d, c = group_baselines(h_groups, per_unit)
+        # Produtos sem histórico ficam com NaN/0
+        median[:len(m)], mad[:len(d)], counts[:len(c)] = m, d, c
+
+    quantity, declared, audited = _columns(rows)
+    groups = np.array([index[row[3]] for row in rows])
+    per_unit, z, divergent, outlier = _flags(quantity, declared, audited, median[groups], mad[groups], counts[groups])
+    return [
+        _describe(row, per_unit[i], median[groups[i]], mad[groups[i]], counts[groups[i]], z[i], divergent[i], outlier[i])
+        for i, row in enumerate(rows) if divergent[i] or outlier[i]
+    ]
+
+
+def scan_weights(conn, start=None, end=None, limit=1000):
+    """
+    Varre as notas emitidas entre start e end: referência de cada produto
+    calculada sobre o período inteiro e os itens marcados, do maior z para o menor.
+    """
+    ensure_schema(conn, SCHEMA, "weight_anomalies")
+    cursor = conn.cursor()
+    cursor.row_factory = None  # tuplas simples: sqlite3.Row pesa em centenas de milhares de linhas
+    rows = cursor.execute(
+        "SELECT rowid, cnpj || char(0) || code, quantity, declared_kg, audited_kg FROM weight_audit "
+        "WHERE data_emissao >= ? AND data_emissao <= ?",
+        (start or '', end or '9999-12-31'),
+    ).fetchall()
+    if not rows:
+        return {"itens": 0, "marcados": 0, "anomalias": []}
+    rowids, products, quantity, declared, audited = zip(*rows)
+    # Produto -> inteiro com um dict: bem mais barato que ORDER BY no SQLite ou np.unique em strings
+    index = {}
+    groups = np.array([index.setdefault(product, len(index)) for product in products], dtype=np.int64)
+    quantity = np.array(quantity, dtype=np.float64)
+    declared = np.array(declared, dtype=np.float64)
+    audited = np.array(audited, dtype=np.float64)  # None vira nan
+    per_unit = np.where(declared > 0, declared / quantity, np.nan)
+    median, mad, counts = group_baselines(groups, per_unit)
+    # A linha está dentro da própria referência: exige MIN_HISTORY outras além dela
+    per_unit, z, divergent, outlier = _flags(quantity, declared, audited, median[groups], mad[groups], counts[groups] - 1)
+    marked = divergent | outlier
+    flagged = np.nonzero(marked)[0]
+    flagged = flagged[np.argsort(-z[flagged], kind='stable')][:limit]
+
+    details = {}
+    selected = [rowids[i] for i in flagged.tolist()]
+    for chunk_start in range(0, len(selected), QUERY_CHUNK):
+        chunk = selected[chunk_start:chunk_start + QUERY_CHUNK]
+        for row in conn.execute(f"SELECT rowid, {COLUMNS} FROM weight_audit WHERE rowid IN ({','.join('?' * len(chunk))})", chunk):
+            details[row[0]] = tuple(row)[1:]
+    anomalies = []
+    for i in flagged.tolist():
+        row = details[rowids[i]]
+        g = groups[i]
+        anomalies.append({
+            **_describe(row, per_unit[i], median[g], mad[g], counts[g] - 1, z[i], divergent[i], outlier[i]),
+            "cnpj": row[2], "chaveAcesso": row[0], "dataEmissao": row[4],
+        })
+    return {"itens": len(rows), "marcados": int(marked.sum()), "anomalias": anomalies}
+
+
+if __name__ == "__main__":
+    # Um ano de notas (≈600 mil itens): python -m api.weight_anomalies
+    import os
+    import random
+    import tempfile
+    import time
+    from datetime import date, timedelta
+
+    from .db import get_connection
+
+    conn = get_connection(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    ensure_schema(conn, SCHEMA, "weight_anomalies")
+    rng = random.Random(1)
+    suppliers = [f"{rng.randrange(10 ** 14):014d}" for _ in range(300)]
+    weights = {(cnpj, f"P{i}"): rng.choice([0.2, 0.4, 0.5, 1.0, 5.0, 10.0]) for cnpj in suppliers for i in range(40)}
+    products = list(weights)
+    rows = []
+    for n in range(60_000):  # ~165 notas por dia
+        day = (date(2024, 1, 1) + timedelta(days=n % 365)).isoformat()
+        for line in range(10):
+            cnpj, code = products[rng.randrange(len(products))]
+            quantity = rng.randint(1, 50)
+            declared = quantity * weights[cnpj, code] * (10 if rng.random() < 0.002 else 1)
+            rows.append((f"N{n}", line, cnpj, code, day, quantity, declared, None))
+    with conn:
+        conn.executemany(f"INSERT INTO weight_audit ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    start = time.perf_counter()
+    result = scan_weights(conn, "2024-01-01", "2024-12-31")
+    print(f"{result['itens']} itens em {time.perf_counter() - start:.2f} s, {result['marcados']} marcados "
+          f"(≈{sum(1 for r in rows if r[6] > r[5] * weights[r[2], r[3]] * 1.5)} inseridos)")
+    note = {"fornecedor": {"cnpj": products[0][0]}, "notaFiscal": {"dataEmissao": "2025-01-02"},
+            "produtos": [{"code": products[0][1], "quantity": 10, "calculated_qty_kg": 10 * weights[products[0]] * 3}]}
+    start = time.perf_counter()
+    flags = check_note(conn, "nova", note)
+    print(f"check_note: {(time.perf_counter() - start) * 1000:.1f} ms, {flags}")
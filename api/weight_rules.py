@@ -0,0 +1,184 @@
+"""
+Regras de embalagem aprendidas por fornecedor e produto.
+
+O mesmo produto de um fornecedor (CNPJ + cProd) vem sempre com a mesma
+embalagem, mas cada upload relia a descrição com as regex do units.py (e o
+lru_cache de parse_description morre a cada cold start da função). Aqui a
+primeira auditoria de cada produto fica em weight_rules — unidades por
+embalagem, valor e tipo da unidade, ou "sem peso" — e as notas seguintes do
+mesmo fornecedor usam a regra direto, sem regex.
+
+Regras automáticas guardam a descrição de onde saíram: se o fornecedor mudar a
+descrição do cProd, a regra é refeita. Regras manuais (source='manual')
+corrigem descrições que a gramática lê errado e nunca são sobrescritas pelo
+aprendizado; apagar a regra (ou todas as automáticas do fornecedor) volta a
+derivar da descrição.
+"""
+from .db import ensure_schema
+from .units import UNIT_LABELS, parse_description, spec_weight, unit_spec
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weight_rules (
+    cnpj TEXT NOT NULL,
+    code TEXT NOT NULL,
+    description TEXT,
+    units_per_package REAL,
+    unit_value REAL,
+    unit_type TEXT,
+    source TEXT NOT NULL DEFAULT 'auto',
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    PRIMARY KEY (cnpj, code)
+) WITHOUT ROWID;
+"""
+
+SOURCES = ("auto", "manual")
+
+
+def _spec(row):
+    if row['unit_type'] is None:
+        return None  # regra "sem peso"
+    return unit_spec(row['units_per_package'], row['unit_value'], row['unit_type'])
+
+
+class SupplierRules:
+    """Regras de um fornecedor durante um parse; acumula as que forem aprendidas."""
+
+    def __init__(self, cnpj, rows):
+        self.cnpj = cnpj
+        self.rules = {row['code']: row for row in rows}
+        self.learned = []
+        self.hits = 0
+
+    def resolve(self, code, description):
+        rule = self.rules.get(code)
+        if rule is not None and (rule['source'] == 'manual' or rule['description'] == description):
+            self.hits += 1
+            return _spec(rule)
+        spec = parse_description(description)
+        if code:
+            self.learned.append((self.cnpj, code, description, *(spec[:3] if spec else (None, None, None))))
+        return spec
+
+    def audited_weight(self, code, description, quantity):
+        """Mesmo contrato de units.audited_weight, pela regra do produto quando houver."""
+        if not description or quantity == 0:
+            return (None, None)
+        return spec_weight(self.resolve(code, description), quantity)
+
+
+class WeightRules:
+    """Acesso às regras numa conexão; parse_nfe_xml recebe uma instância em weight_rules."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.suppliers = []
+        ensure_schema(conn, SCHEMA, "weight_rules")
+
+    def for_supplier(self, cnpj):
+        rows = self.conn.execute(
+            "SELECT code, description, units_per_package, unit_value, unit_type, source FROM weight_rules WHERE cnpj = ?",
+            (cnpj or '',),
+        ).fetchall()
+        supplier = SupplierRules(cnpj or '', rows)
+        self.suppliers.append(supplier)
+        return supplier
+
+    def save(self):
+        """Grava as regras aprendidas; regras manuais não são tocadas."""
+        learned = [row for supplier in self.suppliers for row in supplier.learned if row[0]]
+        if learned:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO weight_rules (cnpj, code, description, units_per_package, unit_value, unit_type) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (cnpj, code) DO UPDATE SET "
+                    "description = excluded.description, units_per_package = excluded.units_per_package, "
+                    "unit_value = excluded.unit_value, unit_type = excluded.unit_type, "
+                    "updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') WHERE source = 'auto'",
+                    learned,
+                )
+        for supplier in self.suppliers:
+            supplier.learned = []
+        return len(learned)
+
+
+def list_rules(conn, cnpj):
+    ensure_schema(conn, SCHEMA, "weight_rules")
+    rows = conn.execute("SELECT * FROM weight_rules WHERE cnpj = ? ORDER BY code", (cnpj,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def set_rule(conn, cnpj, code, units_per_package, unit_value, unit_type):
+    """Regra manual; unit_type None marca o produto como sem peso na descrição."""
+    ensure_schema(conn, SCHEMA, "weight_rules")
+    if unit_type is not None:
+        unit_type = unit_type.strip().lower()
+        if unit_type == 'gr':
+            unit_type = 'g'
+        if unit_type not in UNIT_LABELS:
+            raise ValueError(f"Unidade inválida: {unit_type} (use {', '.join(UNIT_LABELS)})")
+        if not units_per_package or units_per_package <= 0 or not unit_value or unit_value <= 0:
+            raise ValueError("unitsPerPackage e unitMeasureValue devem ser maiores que zero.")
+    else:
+        units_per_package = unit_value = None
+    with conn:
+        conn.execute(
+            "INSERT INTO weight_rules (cnpj, code, units_per_package, unit_value, unit_type, source) "
+            "VALUES (?, ?, ?, ?, ?, 'manual') ON CONFLICT (cnpj, code) DO UPDATE SET "
+            "description = NULL, units_per_package = excluded.units_per_package, unit_value = excluded.unit_value, "
+            "unit_type = excluded.unit_type, source = 'manual', updated_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now')",
+            (cnpj, code, units_per_package, unit_value, unit_type),
+        )
+    return dict(conn.execute("SELECT * FROM weight_rules WHERE cnpj = ? AND code = ?", (cnpj, code)).fetchone())
+
+
+def delete_rules(conn, cnpj, code=None, source=None):
+    """Apaga uma regra, ou as do fornecedor (opcionalmente só de uma origem). Devolve quantas."""
+    ensure_schema(conn, SCHEMA, "weight_rules")
+    if source is not None and source not in SOURCES:
+        raise ValueError(f"Origem inválida: {source} (use {', '.join(SOURCES)})")
+    conditions, params = ["cnpj = ?"], [cnpj]
+    if code is not None:
+        conditions.append("code = ?")
+        params.append(code)
+    if source is not None:
+        conditions.append("source = ?")
+        params.append(source)
+    with conn:
+        return conn.execute(f"DELETE FROM weight_rules WHERE {' AND '.join(conditions)}", params).rowcount
+
+
+if __name__ == "__main__":
+    # Notas repetidas de um fornecedor com e sem regras, com o lru_cache frio (cold start): python -m api.weight_rules
+    import contextlib
+    import glob
+    import io
+    import os
+    import tempfile
+    import time
+
+    from .db import get_connection
+    from .index import parse_nfe_xml
+
+    conn = get_connection(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    contents = [open(path, 'rb').read() for path in
+                sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))]
+    rounds = 200
+
+    def run(with_rules):
+        rules = WeightRules(conn) if with_rules else None
+        with contextlib.redirect_stdout(io.StringIO()):  # os prints DEBUG do parser
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for content in contents:
+                    parse_description.cache_clear()
+                    parsed = parse_nfe_xml(content, weight_rules=rules)
+            if rules is not None:
+                rules.save()
+        return (time.perf_counter() - start) / (rounds * len(contents)), parsed
+
+    without, reference = run(False)
+    run(True)  # aprende as regras
+    with_rules, parsed = run(True)
+    assert parsed == reference
+    print(f"{len(contents)} XMLs: sem regras {without * 1000:.3f} ms/nota, com regras {with_rules * 1000:.3f} ms/nota, "
+          f"{conn.execute('SELECT count(*) FROM weight_rules').fetchone()[0]} regras")
@@ -0,0 +1,176 @@
+"""
+Compressão dos XMLs de NF-e com zstd e dicionário treinado no próprio acervo.
+
+As notas repetem quase tudo entre si (namespaces, nomes de tags, blocos de
+emitente e transporte do mesmo fornecedor), mas cada XML tem só 5-20 KB: um
+compressor sem contexto mal chega a aproveitar essa redundância. Com um
+dicionário treinado sobre as notas já gravadas (zstd.train_dictionary), cada
+XML é comprimido como se viesse depois de centenas de notas parecidas.
+
+O dicionário fica em nfe_dictionaries e o codec de cada documento em
+nfe_documents.codec ('zlib' ou 'zstd-dict:<id>'), então dicionários novos
+não invalidam os documentos antigos. Enquanto não houver dicionário (ou sem o
+pacote zstandard) as notas continuam em zlib; train_archive e
+recompress_documents, no nfe_store, migram o acervo.
+
+open_stream devolve um arquivo que descomprime sob demanda: parse_nfe_xml lê
+dele direto, sem materializar o XML inteiro antes do parse.
+"""
+import io
+import threading
+import zlib
+
+from .db import conn_path, ensure_schema
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nfe_dictionaries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data BLOB NOT NULL,
+    samples INTEGER NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+"""
+
+CODEC_PREFIX = 'zstd-dict:'
+LEVEL = 12
+DICT_SIZE = 64 * 1024
+# O treino do zstd precisa de bem mais amostras que o tamanho de uma nota
+MIN_SAMPLES = 20
+
+# Dicionários são imutáveis depois de gravados: cache por (banco, id)
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("O arquivo de XMLs com dicionário requer o pacote zstandard (pip install zstandard).") from e
+    return zstandard
+
+
+def _zstd_available():
+    try:
+        _zstd()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _dictionary(conn, dict_id):
+    key = (conn_path(conn), dict_id)
+    dictionary = _dictionaries.get(key)
+    if dictionary is None:
+        row = conn.execute("SELECT data FROM nfe_dictionaries WHERE id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Dicionário de compressão {dict_id} não encontrado.")
+        dictionary = _zstd().ZstdCompressionDict(bytes(row['data']))
+        dictionary.precompute_compress(level=LEVEL)
+        with _dictionaries_lock:
+            _dictionaries[key] = dictionary
+    return dictionary
+
+
+def current_dictionary_id(conn):
+    """Id do dicionário mais recente, usado para as notas novas; None se ainda não houver."""
+    ensure_schema(conn, SCHEMA, "xml_archive")
+    row = conn.execute("SELECT max(id) AS id FROM nfe_dictionaries").fetchone()
+    return row['id']
+
+
+def compress_xml(conn, xml_content):
+    """Comprime com o dicionário atual; sem dicionário (ou sem zstandard), zlib."""
+    dict_id = current_dictionary_id(conn) if _zstd_available() else None
+    if dict_id is None:
+        return 'zlib', zlib.compress(xml_content, 9)
+    # ZstdCompressor não é thread-safe: um por chamada (barato com o dicionário pré-computado)
+    compressor = _zstd().ZstdCompressor(level=LEVEL, dict_data=_dictionary(conn, dict_id))
+    return f"{CODEC_PREFIX}{dict_id}", compressor.compress(xml_content)
+
+
+def open_stream(conn, codec, data):
+    """Arquivo somente leitura que descomprime o XML conforme é lido."""
+    if codec == 'zlib':
+        return io.BytesIO(zlib.decompress(data))
+    if codec.startswith(CODEC_PREFIX):
+        dictionary = _dictionary(conn, int(codec[len(CODEC_PREFIX):]))
+        return _zstd().ZstdDecompressor(dict_data=dictionary).stream_reader(io.BytesIO(data))
+    raise ValueError(f"Codec de XML desconhecido: {codec}")
+
+
+def decompress_xml(conn, codec, data):
+    if codec.startswith(CODEC_PREFIX):
+        dictionary = _dictionary(conn, int(codec[len(CODEC_PREFIX):]))
+        return _zstd().ZstdDecompressor(dict_data=dictionary).decompress(data)
+    return open_stream(conn, codec, data).read()
+
+
+def train_dictionary(conn, samples, size=DICT_SIZE):
+    """
+    Treina um dicionário com os XMLs de `samples` e o torna o atual.
+    Devolve {"id", "amostras", "bytes"}.
+    """
+    zstandard = _zstd()
+    ensure_schema(conn, SCHEMA, "xml_archive")
+    if len(samples) < MIN_SAMPLES:
+        raise ValueError(f"São necessárias ao menos {MIN_SAMPLES} notas para treinar o dicionário ({len(samples)} gravadas).")
+    try:
+        dictionary = zstandard.train_dictionary(size, samples, level=LEVEL)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Falha ao treinar o dicionário: {e}") from e
+    data = dictionary.as_bytes()
+    with conn:
+        cursor = conn.execute("INSERT INTO nfe_dictionaries (data, samples) VALUES (?, ?)", (data, len(samples)))
+    return {"id": cursor.lastrowid, "amostras": len(samples), "bytes": len(data)}
+
+
+if __name__ == "__main__":
+    # Razão de compressão e custo do reparse sobre um acervo sintético: python -m api.xml_archive
+    import contextlib
+    import glob
+    import os
+    import random
+    import re
+    import tempfile
+    import time
+
+    from .db import get_connection
+    from .index import parse_nfe_xml
+    from .nfe_store import archive_stats, open_xml, recompress_documents, store_nfe, train_archive
+
+    templates = [open(path, 'rb').read() for path in
+                 sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))]
+    rng = random.Random(1)
+
+    def variant(i):
+        # Mesma nota com chave, número e valores trocados, como notas seguidas do mesmo fornecedor
+        xml = templates[i % len(templates)]
+        key = f"{rng.randrange(10 ** 44):044d}".encode()
+        xml = re.sub(rb'(Id="NFe)\d{44}', rb'\g<1>' + key, xml)
+        xml = re.sub(rb'<nNF>\d+', f"<nNF>{i}".encode(), xml)
+        return re.sub(rb'<(vProd|vUnCom|qCom)>[\d.]+', lambda m: m.group(0)[:-2] + f"{rng.randrange(100):02d}".encode(), xml)
+
+    conn = get_connection(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    n = 3_000
+    with contextlib.redirect_stdout(io.StringIO()):  # os prints DEBUG do parser
+        for i in range(n):
+            store_nfe(conn, variant(i), parse_nfe_xml)
+    keys = [row['access_key'] for row in conn.execute("SELECT access_key FROM nfe_documents")]
+    print("zlib:", archive_stats(conn))
+
+    start = time.perf_counter()
+    dictionary = train_archive(conn)
+    recompressed = recompress_documents(conn)
+    print(f"dicionário {dictionary} + {recompressed} notas recomprimidas em {time.perf_counter() - start:.2f} s")
+    # Só 7 modelos de nota: a razão aqui é um teto; num acervo real os fornecedores variam mais
+    print("zstd:", archive_stats(conn))
+
+    sample = rng.sample(keys, 500)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for key in sample:
+            with open_xml(conn, key) as stream:
+                parse_nfe_xml(stream)
+        elapsed = time.perf_counter() - start
+    print(f"reparse a partir do acervo: {elapsed / len(sample) * 1000:.2f} ms/nota")
@@ -0,0 +1,109 @@
+"""
+Codificação dos XMLs de NF-e antes do parse.
+
+Exportações antigas de fornecedores vêm em ISO-8859-1, com ou sem declaração.
+parse_nfe_xml remove a declaração <?xml ...?> antes do etree.fromstring e,
+sem ela, a lxml assume UTF-8: o primeiro "ç" de um xProd em Latin-1 derruba o
+parse (ou, com recover, vira "�" no nome do produto).
+
+detect_encoding olha só o começo do arquivo — BOM e atributo encoding da
+declaração — e xml_parser entrega a codificação para a lxml, que decodifica
+enquanto monta a árvore: o buffer não é transcodificado antes. UTF-8 continua
+no parser padrão, sem custo extra além da leitura do cabeçalho.
+
+Sem BOM nem declaração não há como saber pelo cabeçalho: tenta-se UTF-8 e,
+se a lxml acusar bytes inválidos (ERR_INVALID_ENCODING), o parse é refeito em
+FALLBACK_ENCODING. O mesmo vale para quem declara UTF-8 e grava em Latin-1;
+lendo de um arquivo (reparse do acervo) a declaração é seguida, porque o
+stream não volta atrás.
+"""
+import codecs
+import re
+
+from lxml import etree
+
+# A declaração cabe folgada nisto; o resto do arquivo não é lido aqui
+HEAD_SIZE = 256
+DEFAULT_ENCODING = 'UTF-8'
+# Latin-1 aceita qualquer byte: nunca falha, no pior caso troca um caractere
+FALLBACK_ENCODING = 'ISO-8859-1'
+
+BOMS = (
+    (codecs.BOM_UTF8, 'UTF-8'),
+    (codecs.BOM_UTF16_LE, 'UTF-16LE'),
+    (codecs.BOM_UTF16_BE, 'UTF-16BE'),
+)
+DECLARATION = re.compile(rb'^[ \t\r\n]*<\?xml[^>]*?\sencoding[ \t\r\n]*=[ \t\r\n]*["\']([A-Za-z][A-Za-z0-9._-]*)["\']')
+# Nome do codec no Python -> nome que a libxml2 reconhece
+LIBXML_NAMES = {'utf-8': 'UTF-8', 'iso8859-1': 'ISO-8859-1', 'iso8859-15': 'ISO-8859-15', 'cp1252': 'windows-1252',
+                'ascii': 'UTF-8'}  # ASCII é subconjunto de UTF-8: fica no parser padrão
+
+
+def detect_encoding(head):
+    """
+    (codificação, origem) a partir dos primeiros bytes; origem é 'bom',
+    'declaracao' ou None (nada declarado: UTF-8 presumido).
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, 'bom'
+    match = DECLARATION.match(head[:HEAD_SIZE])
+    if match is None:
+        return DEFAULT_ENCODING, None
+    label = match.group(1).decode('ascii')
+    try:
+        name = codecs.lookup(label).name
+    except LookupError:
+        raise ValueError(f"Codificação declarada no XML não suportada: {label}")
+    return LIBXML_NAMES.get(name, label), 'declaracao'
+
+
+def can_fall_back(encoding, source):
+    """UTF-8 presumido ou declarado pode ser Latin-1 na prática; BOM e outras declarações são confiáveis."""
+    return encoding == DEFAULT_ENCODING and source != 'bom'
+
+
+def xml_parser(encoding, recover=False):
+    """Parser para a codificação; None (parser padrão da lxml) no caso comum de UTF-8 sem recuperação."""
+    if encoding == DEFAULT_ENCODING and not recover:
+        return None
+    return etree.XMLParser(encoding=None if encoding == DEFAULT_ENCODING else encoding,
+                           recover=recover, resolve_entities=False)
+
+
+def is_encoding_error(code):
+    """Código de XMLSyntaxError.code ou do error_log: bytes inválidos na codificação."""
+    return code == etree.ErrorTypes.ERR_INVALID_ENCODING
+
+
+if __name__ == "__main__":
+    # Custo da detecção e do parse UTF-8 x Latin-1 (casos de referência em tests/test_xml_encoding.py):
+    # python -m api.xml_encoding
+    import contextlib
+    import glob
+    import io
+    import os
+    import time
+
+    from .index import parse_nfe_xml
+
+    contents = [open(path, 'rb').read() for path in
+                sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))]
+
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for content in contents:
+            detect_encoding(content)
+    detect_time = (time.perf_counter() - start) / (rounds * len(contents))
+    latin = [re.sub(rb'^<\?xml[^>]*\?>', b'', content).decode('utf-8').encode('latin-1') for content in contents]
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):  # os prints DEBUG do parser
+        for label, batch in (("UTF-8", contents), ("Latin-1 sem declaração", latin)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for content in batch:
+                    parse_nfe_xml(content)
+            timings[label] = (time.perf_counter() - start) / (rounds * len(batch))
+    print(f"detecção {detect_time * 1000000:.2f} µs/nota; parse "
+          + ", ".join(f"{label} {elapsed * 1000:.3f} ms/nota" for label, elapsed in timings.items()))
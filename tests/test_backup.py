@@ -0,0 +1,90 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from api.backup import iter_backup_gzip, restore_backup, restore_backup_file
+from api.db import get_connection
+from api.ledger import stock_at
+from api.reports import fiscal_report
+from api.rollups import daily_movements, insert_movements
+from api.valuation import valuation
+
+HEADER = json.dumps({"format": "controle-estoque-backup", "version": 1})
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "backup.db")
+    conn = get_connection(path)
+    with conn:
+        conn.execute("INSERT INTO items (id, name) VALUES ('i1', 'Item')")
+    insert_movements(conn, [{"id": "m1", "item_id": "i1", "type": "in", "quantity": 10, "price": 2,
+                             "reason": "Entrada NF-e: 15", "date": "2026-10-01"}])
+    conn.close()
+    return path
+
+
+def _line(table, row):
+    return json.dumps({"table": table, "row": row})
+
+
+@pytest.mark.parametrize("lines, message", [
+    ([HEADER, _line("sqlite_master", {"id": "x"})], "Tabela desconhecida"),
+    ([HEADER, _line("items; DROP TABLE items", {"id": "x"})], "Tabela desconhecida"),
+    ([HEADER, json.dumps({"row": {"id": "x"}})], "Tabela desconhecida"),
+    ([HEADER, json.dumps({"table": "items"})], "Linha de backup inválida"),
+    ([HEADER, "[1, 2]"], "Linha de backup inválida"),
+    ([HEADER, "{não é json"], "JSON inválido"),
+    (["[]"], "não é um backup"),
+    ([json.dumps({"format": "controle-estoque-backup", "version": "1"})], "Versão"),
+    ([HEADER, _line("movements", {"id": "m2", "item_id": "i1", "type": "in", "quantity": None})], "Falha ao restaurar"),
+])
+def test_invalid_backups_raise_value_error(path, lines, message):
+    with pytest.raises(ValueError, match=message):
+        restore_backup(lines, path)
+    assert get_connection(path).execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+
+
+def test_corrupted_gzip_raises_value_error(path):
+    data = gzip.compress((HEADER + "\n").encode() * 100)
+    with pytest.raises(ValueError, match="Falha ao restaurar"):
+        restore_backup_file(io.BytesIO(data[:len(data) // 2]), path)
+
+
+def test_restore_rebuilds_derived_tables(path, tmp_path):
+    conn = get_connection(path)
+    backup = b"".join(iter_backup_gzip(conn))
+    assert stock_at(conn, "2026-10-31", "i1") == 10
+
+    target = str(tmp_path / "restored.db")
+    assert restore_backup_file(io.BytesIO(backup), target) == {"items": 1, "movements": 1}
+    restored = get_connection(target)
+    assert daily_movements(restored, "2026-10-01", "2026-10-01")[0]["quantidade"] == 10
+    assert stock_at(restored, "2026-10-31", "i1") == 10
+    assert valuation(restored)["total"] == 20
+
+    # Mesmo backup com a movimentação corrigida sobre o banco original
+    fixed = [HEADER, _line("movements", {"id": "m1", "item_id": "i1", "type": "in", "quantity": 4, "price": 2,
+                                         "reason": "Entrada NF-e: 15", "date": "2026-10-01"})]
+    fiscal_report(conn, 2026)  # carrega o cache de relatórios antes da restauração
+    restore_backup(fixed, path)
+    assert daily_movements(conn, "2026-10-01", "2026-10-01")[0]["quantidade"] == 4
+    assert stock_at(conn, "2026-10-31", "i1") == 4
+    assert valuation(conn)["total"] == 8
+    assert fiscal_report(conn, 2026)["notas"][0]["total"] == 8
+
+
+def test_failed_restore_still_rebuilds_derived_tables(path):
+    lines = [HEADER,
+             _line("movements", {"id": "m2", "item_id": "i1", "type": "in", "quantity": 5, "price": 2,
+                                 "date": "2026-10-02"}),
+             "{não é json"]
+    with pytest.raises(ValueError, match="JSON inválido"):
+        restore_backup(lines, path, batch_size=1)
+    conn = get_connection(path)
+    # O lote gravado antes do erro continua lá, e os derivados o incluem
+    assert stock_at(conn, "2026-10-31", "i1") == 15
+    assert daily_movements(conn, "2026-10-02", "2026-10-02")[0]["quantidade"] == 5
+    assert valuation(conn)["total"] == 30
@@ -0,0 +1,29 @@
+import pytest
+
+from api.documents import compute_invoice_totals, render_invoice_pdf
+from api.invoice import InvoiceModel
+
+DATA = {
+    "invoiceNumber": "T-1",
+    "ptaxRate": 5,
+    "costs": [{"desc": "FREIGHT", "value": 100}],
+    "distribution": {"active": True, "type": "fixed", "value": 30},
+    "suppliers": [{"info": "FORNECEDOR", "items": [
+        {"qty": 2, "qty_kg": 4, "price": 10, "desc": "A"},
+        {"qty": 1, "qty_kg": 5, "price": 20, "desc": "B"},
+        {"qty": 0, "qty_kg": 1, "price": 20, "desc": "C"},
+    ]}],
+}
+
+
+def test_pdf_totals_match_invoice_model():
+    totals = compute_invoice_totals(DATA)
+    expected = InvoiceModel(DATA).totals()
+    for key, value in expected.items():
+        assert totals[key] == pytest.approx(value)
+    # 30 BRL distribuídos sobre price*qty = 40: preços x 1,75; linha sem qty vai a zero
+    assert [row[6] for row in totals["rows"] if not isinstance(row, str)] == ["3.50", "7.00", "0.00"]
+
+
+def test_render_invoice_pdf():
+    assert render_invoice_pdf(DATA).startswith(b"%PDF")
@@ -0,0 +1,30 @@
+import codecs
+import io
+
+import pytest
+
+from api.db import get_connection
+from api.importer import diff_item_file
+
+CSV = "code;name;quantity;costPrice\nSKU-1;Açúcar cristal;5;1.234,50\nSKU-2;Feijão – 1kg;2;3,5\n"
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = get_connection(str(tmp_path / "import.db"))
+    with conn:
+        conn.execute("INSERT INTO items (id, code, name, quantity) VALUES ('i1', 'SKU-1', 'Açúcar cristal', 5)")
+    return conn
+
+
+@pytest.mark.parametrize("content, name", [
+    (CSV.encode('utf-8'), "Feijão – 1kg"),
+    (codecs.BOM_UTF8 + CSV.encode('utf-8'), "Feijão – 1kg"),
+    (CSV.encode('cp1252'), "Feijão – 1kg"),  # Excel em pt-BR
+    (CSV.replace('–', '-').encode('latin-1'), "Feijão - 1kg"),
+])
+def test_csv_encodings(conn, content, name):
+    result = diff_item_file(conn, io.BytesIO(content), "itens.csv")
+    assert [row["name"] for row in result["novos"]] == [name]
+    assert result["alterados"][0]["campos"]["cost_price"] == {"de": 0.0, "para": 1234.5}
+    assert not result["erros"]
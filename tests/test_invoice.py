@@ -0,0 +1,118 @@
+import math
+import random
+
+import pytest
+
+from api.invoice import InvoiceModel, InvoiceSessions, full_totals
+
+
+def _data(lines=200, distribution=None):
+    rng = random.Random(7)
+    return {
+        "ptaxRate": 5.2,
+        "costs": [{"desc": "FREIGHT", "value": 1200}],
+        "distribution": distribution,
+        "suppliers": [{"items": [
+            {"qty": rng.randint(0, 50), "qty_kg": rng.uniform(1, 400), "price": rng.uniform(5, 60)}
+            for _ in range(lines)
+        ]} for _ in range(3)],
+    }
+
+
+def _assert_close(incremental, full):
+    for key, value in full.items():
+        assert math.isclose(value, incremental[key], rel_tol=1e-9, abs_tol=1e-6), (key, value, incremental[key])
+
+
+def _client_subtotal(data):
+    """Subtotal em USD como o updatePreview() do invoice.js (sem o arredondamento a 4 casas)."""
+    items = [item for supplier in data["suppliers"] for item in supplier["items"]]
+    total = sum(item["price"] * item["qty"] for item in items)
+    distribution = data.get("distribution") or {}
+    subtotal = 0.0
+    for item in items:
+        price = item["price"]
+        if distribution.get("active") and total > 0:
+            amount = total * distribution["value"] / 100 if distribution["type"] == "percentage" else distribution["value"]
+            price = (price * item["qty"] + amount * price * item["qty"] / total) / item["qty"] if item["qty"] > 0 else 0
+        subtotal += item["qty_kg"] * price / data["ptaxRate"]
+    return subtotal
+
+
+@pytest.mark.parametrize("distribution", [
+    None,
+    {"active": True, "type": "percentage", "value": 8},
+    {"active": True, "type": "fixed", "value": 2500},
+])
+def test_incremental_matches_full_recompute(distribution):
+    rng = random.Random(1)
+    model = InvoiceModel(_data(distribution=distribution))
+    for step in range(3000):
+        line_ids = list(model.lines)
+        choice = step % 7
+        if choice == 0:
+            model.apply_delta({"op": "set_line", "id": rng.choice(line_ids),
+                               "fields": {"qty_kg": rng.uniform(1, 400), "price": rng.uniform(5, 60)}})
+        elif choice == 1:
+            model.apply_delta({"op": "set_line", "id": rng.choice(line_ids), "fields": {"qty": rng.randint(0, 50)}})
+        elif choice == 2:
+            model.apply_delta({"op": "remove_line", "id": rng.choice(line_ids)})
+        elif choice == 3:
+            model.apply_delta({"op": "add_line", "group": rng.randint(0, 2),
+                               "fields": {"qty": rng.randint(1, 50), "qty_kg": 10, "price": 12.5}})
+        elif choice == 4:
+            model.apply_delta({"op": "add_cost", "desc": "EXTRA", "value": rng.uniform(10, 100)})
+        elif choice == 5:
+            model.apply_delta({"op": "set_ptax", "value": rng.uniform(4.8, 5.6)})
+        else:
+            model.apply_delta({"op": "set_distribution", "fields": {"value": rng.uniform(0, 10)}})
+    incremental = model.totals()
+    _assert_close(incremental, model.recompute())
+    _assert_close(model.totals(), incremental)
+
+
+@pytest.mark.parametrize("distribution", [
+    None,
+    {"active": False, "type": "percentage", "value": 8},
+    {"active": True, "type": "percentage", "value": 8},
+    {"active": True, "type": "fixed", "value": 2500},
+])
+def test_totals_follow_client_distribution(distribution):
+    data = _data(lines=50, distribution=distribution)
+    expected = _client_subtotal(data)
+    assert math.isclose(InvoiceModel(data).totals()["productSubtotal"], expected, rel_tol=1e-9)
+    items = [item for supplier in data["suppliers"] for item in supplier["items"]]
+    assert math.isclose(full_totals(items, data["costs"], 5.2, distribution=distribution)["productSubtotal"],
+                        expected, rel_tol=1e-9)
+
+
+def test_line_totals_use_distributed_price():
+    model = InvoiceModel({"ptaxRate": 2, "distribution": {"active": True, "type": "percentage", "value": 10},
+                          "suppliers": [{"items": [{"qty": 2, "qty_kg": 4, "price": 10},
+                                                   {"qty": 0, "qty_kg": 3, "price": 10}]}]})
+    assert model.line_totals("0.0")["priceUSD"] == pytest.approx(5.5)
+    assert model.line_totals("0.1")["totalUSD"] == 0
+
+
+def test_added_line_ids_do_not_collide_after_remove():
+    model = InvoiceModel({"suppliers": [{"items": [{"qty": 1}, {"qty": 1}]}]})
+    first = model.apply_delta({"op": "add_line", "group": 0, "fields": {"qty": 1}})
+    model.apply_delta({"op": "remove_line", "id": "0.0"})
+    second = model.apply_delta({"op": "add_line", "group": 0, "fields": {"qty": 1}})
+    third = model.apply_delta({"op": "add_line", "group": 0, "fields": {"qty": 1}})
+    assert len({first, second, third}) == 3
+    assert model.totals()["totalPackages"] == 4
+
+
+def test_sessions_are_bounded_and_expire():
+    now = [0.0]
+    sessions = InvoiceSessions(max_sessions=2, ttl=10, clock=lambda: now[0])
+    sessions.put("a", "A")
+    sessions.put("b", "B")
+    sessions.get("a")
+    sessions.put("c", "C")
+    assert sessions.get("b") is None  # menos usada sai primeiro
+    assert sessions.get("a") == "A"
+    now[0] = 11
+    assert sessions.get("c") is None
+    assert len(sessions) == 0
@@ -0,0 +1,30 @@
+from api.db import get_connection
+from api.nfe_store import get_xml, store_nfe
+
+ACCESS_KEY = "35261012345678000190550010000001231000001234"
+PARSED = {
+    "fornecedor": {"cnpj": "12345678000190"},
+    "notaFiscal": {"numero": "123", "serie": "1", "dataEmissao": "2026-10-01"},
+    "produtos": [{"code": "A1", "costPrice": 10.5, "quantity": 2}],
+}
+
+
+def _xml(note):
+    return f'<NFe><infNFe Id="NFe{ACCESS_KEY}"><obs>{note}</obs></infNFe></NFe>'.encode()
+
+
+def test_same_key_with_different_content_is_a_conflict(tmp_path):
+    conn = get_connection(str(tmp_path / "store.db"))
+    parses = []
+
+    def parse(xml):
+        parses.append(xml)
+        return PARSED
+
+    assert store_nfe(conn, _xml("original"), parse)[1:] == (False, False)
+    assert store_nfe(conn, _xml("original"), parse)[1:] == (True, False)
+    parsed, duplicate, conflict = store_nfe(conn, _xml("alterado"), parse)
+    assert (duplicate, conflict) == (True, True)
+    # Vale a primeira gravação: o XML novo não é parseado nem substitui o gravado
+    assert parses == [_xml("original")]
+    assert get_xml(conn, ACCESS_KEY) == _xml("original")
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+import pytest
+
+from api.importer import _normalize_batch
+from api.parsing import parse_date, parse_dates, parse_number, parse_numbers
+
+NUMBER_CASES = {
+    "22.50": 22.5, "1000": 1000.0, "22,50": 22.5, "1.234,50": 1234.5, "1,234.50": 1234.5,
+    "1.234.567": 1234567.0, "1.234.567,89": 1234567.89, "1,234,567.89": 1234567.89,
+    "R$ 1.234,50": 1234.5, "US$ 12.00": 12.0, "-3,5": -3.5, " 7 ": 7.0, ",5": 0.5,
+    "0.400": 0.4, "12": 12.0, "": None, "abc": None, "1,234,567": 1234567.0, "12x400g": None,
+    # float() aceita, o parseBrazilianNumber não
+    "1e5": None, "1E5": None, "2,5e3": None, "inf": None, "-inf": None, "Infinity": None, "nan": None,
+    "NaN": None, "1_000": None, "9" * 400: None, "1-2": None, "1.2.3,4,5": None, "-": None, ".": None,
+}
+
+DATE_CASES = {
+    "2024-03-05": "2024-03-05", "2025-10-27T10:15:00-03:00": "2025-10-27", "05/03/2024": "2024-03-05",
+    "5/3/2024": "2024-03-05", "05/03/24": "2024-03-05", "31/02/2024": None, "2024-13-01": None,
+    "29/02/2024": "2024-02-29", "29/02/2023": None, "": None, "ontem": None,
+}
+
+
+def _same(got, expected):
+    return math.isnan(got) if expected is None else math.isclose(got, expected)
+
+
+@pytest.mark.parametrize("text, expected", NUMBER_CASES.items())
+def test_parse_number(text, expected):
+    got = parse_number(text, None)
+    assert got == expected or (got is not None and expected is not None and math.isclose(got, expected))
+
+
+def test_parse_numbers_matches_scalar_path():
+    values = list(NUMBER_CASES)
+    for text, got in zip(values, parse_numbers(values).tolist()):
+        assert _same(got, NUMBER_CASES[text]), (text, got)
+
+
+@pytest.mark.parametrize("text", ["1e5", "inf", "nan", "12"])
+def test_parse_numbers_plain_chunk(text):
+    # Bloco só com números "limpos" (sem cair no caminho escalar)
+    got = parse_numbers(["1.234,50", text, "3"]).tolist()
+    assert got[0] == 1234.5 and got[2] == 3.0
+    assert _same(got[1], NUMBER_CASES[text])
+
+
+def test_parse_numbers_default():
+    assert parse_numbers(["", "inf", "2"], default=0.0).tolist() == [0.0, 0.0, 2.0]
+    assert len(parse_numbers([])) == 0
+
+
+def test_import_batch_turns_invalid_numbers_into_zero():
+    rows = [("1", "1e5", "inf"), ("2", "nan", "2,5"), ("3", "9" * 30, "")]
+    batch = _normalize_batch({"code": 0, "quantity": 1, "cost_price": 2}, rows)
+    assert [row["quantity"] for row in batch] == [0, 0, 0]
+    assert [row["cost_price"] for row in batch] == [0.0, 2.5, 0.0]
+
+
+def test_parse_dates_matches_scalar_path():
+    for (text, expected), got in zip(DATE_CASES.items(), parse_dates(list(DATE_CASES)).tolist()):
+        scalar = parse_date(text)
+        assert (scalar.isoformat() if scalar else None) == expected, (text, scalar)
+        assert (got.isoformat() if got else None) == expected, (text, got)
+    assert np.isnat(parse_dates(["ontem"]))[0]
@@ -0,0 +1,32 @@
+from api.db import get_connection
+from api.nfe_store import record_event, store_nfe
+from api.price_history import rebuild_price_history
+
+ACCESS_KEY = "35261012345678000190550010000001231000001234"
+XML = f'<NFe><infNFe Id="NFe{ACCESS_KEY}"></infNFe></NFe>'.encode()
+PARSED = {
+    "fornecedor": {"cnpj": "12345678000190"},
+    "notaFiscal": {"numero": "123", "serie": "1", "dataEmissao": "2026-10-01"},
+    "produtos": [{"code": "A1", "costPrice": 10.5, "quantity": 2}],
+}
+
+
+def _cancel(registered=True):
+    return {"chaveAcesso": ACCESS_KEY, "tipoEvento": "110111", "sequencia": 1, "dataEvento": "2026-10-02T10:00:00",
+            "protocolo": "1", "registrado": registered, "justificativa": "Erro na emissão", "cancelamento": True}
+
+
+def test_rebuild_skips_cancelled_notes(tmp_path):
+    conn = get_connection(str(tmp_path / "prices.db"))
+    store_nfe(conn, XML, lambda xml: PARSED)
+    assert rebuild_price_history(conn) == 1
+    record_event(conn, _cancel(), b"<evento/>")
+    assert conn.execute("SELECT count(*) FROM price_history").fetchone()[0] == 0
+    assert rebuild_price_history(conn) == 0
+
+
+def test_rebuild_keeps_notes_with_unregistered_cancellation(tmp_path):
+    conn = get_connection(str(tmp_path / "prices.db"))
+    store_nfe(conn, XML, lambda xml: PARSED)
+    record_event(conn, _cancel(registered=False), b"<evento/>")
+    assert rebuild_price_history(conn) == 1
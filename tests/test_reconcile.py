@@ -0,0 +1,22 @@
+from api.reconcile import reconcile_purchase_order
+
+SUPPLIERS = [{"id": "s1", "cnpj": "12.345.678/0001-90"}]
+ORDER_ITEMS = [
+    {"supplier_id": "s1", "code": "A1", "name": "Queijo minas"},
+    {"supplier_id": "s1", "code": "B2", "name": "Manteiga"},
+    {"supplier_id": "s1", "code": "A1", "name": "Queijo minas (2)"},
+]
+
+
+def test_repeated_code_matches_like_find():
+    nfe = {"fornecedor": {"cnpj": "12345678000190"}, "produtos": [
+        {"code": "A1", "name": "Queijo", "costPrice": 10},
+        {"code": " A1 ", "name": "Queijo", "costPrice": 12},
+        {"code": "C3", "name": "Requeijão", "costPrice": 5},
+    ]}
+    result = reconcile_purchase_order(nfe, ORDER_ITEMS, SUPPLIERS)
+    # As duas linhas de A1 casam com o primeiro item, que fica com o custo da última
+    assert [(m["product"], m["orderItem"]) for m in result["matched"]] == [(0, 0), (1, 0)]
+    assert result["items"][0]["costPrice"] == 12 and "costPrice" not in result["items"][2]
+    assert [u["code"] for u in result["unmatched"]] == ["C3"]
+    assert result["unmatchedOrderItems"] == [1, 2]
@@ -0,0 +1,70 @@
+import gc
+import shutil
+
+import pytest
+
+from api.backup import restore_backup
+from api.db import get_connection
+from api.reports import fiscal_report, get_movement_store, parse_day
+
+
+def _database(path, movements):
+    conn = get_connection(str(path))
+    with conn:
+        conn.execute("INSERT INTO items (id, name) VALUES ('i1', 'Item')")
+        conn.executemany("INSERT INTO movements (id, item_id, type, quantity, price, date) VALUES (?, 'i1', ?, ?, 2, ?)",
+                         movements)
+    return conn
+
+
+@pytest.fixture
+def conn(tmp_path):
+    return _database(tmp_path / "reports.db", [("m1", "in", 10, "2026-10-01"), ("m2", "out", 4, "2026-10-02")])
+
+
+def _quantities(conn):
+    store = get_movement_store(conn)
+    return sorted(zip(store.day.tolist(), store.quantity.tolist()))
+
+
+def test_parse_day_accepts_iso_and_brazilian_dates():
+    assert parse_day("19/10/2026") == parse_day("2026-10-19") == parse_day("2026-10-19T10:00:00Z")
+    for value in ("foo", "2026-13-01", "", None):
+        with pytest.raises(ValueError):
+            parse_day(value)
+
+
+def test_store_sees_updates_and_deletes(conn):
+    first, second = parse_day("2026-10-01"), parse_day("2026-10-02")
+    assert _quantities(conn) == [(first, 10), (second, 4)]
+    with conn:
+        conn.execute("UPDATE movements SET quantity = 7 WHERE id = 'm1'")
+    assert _quantities(conn) == [(first, 7), (second, 4)]
+    with conn:
+        conn.execute("DELETE FROM movements WHERE id = 'm2'")
+    assert _quantities(conn) == [(first, 7)]
+
+
+def test_store_sees_restored_rows(conn, tmp_path):
+    _quantities(conn)
+    lines = ['{"format": "controle-estoque-backup", "version": 1}',
+             '{"table": "movements", "row": {"id": "m1", "item_id": "i1", "type": "in", "quantity": 3, '
+             '"price": 2, "reason": "Entrada NF-e: 15", "date": "2026-10-01"}}']
+    restore_backup(lines, str(tmp_path / "reports.db"))
+    assert _quantities(conn)[0] == (parse_day("2026-10-01"), 3)
+    assert [nota["total"] for nota in fiscal_report(conn, 2026)["notas"]] == [6]
+
+
+def test_store_sees_recreated_database(tmp_path):
+    path = tmp_path / "reports.db"
+    conn = _database(path, [("m1", "in", 10, "2026-10-01"), ("m2", "out", 4, "2026-10-02")])
+    assert len(get_movement_store(conn).day) == 2
+    other = _database(tmp_path / "other.db",
+                      [("m9", "in", 5, "2026-10-05"), ("m8", "in", 1, "2026-10-06"), ("m7", "in", 1, "2026-10-07")])
+    get_movement_store(other)  # cria movements_version no outro banco
+    conn.close()
+    other.close()
+    gc.collect()
+    shutil.copy(tmp_path / "other.db", path)
+    conn = get_connection(str(path))
+    assert [quantity for _, quantity in _quantities(conn)] == [5, 1, 1]
@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from api.db import get_connection
+from api.ledger import rebuild_snapshots
+from api.rollups import daily_movements, insert_movements, product_ranking, rebuild_rollups
+from api.valuation import rebuild_valuation, valuation
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = get_connection(str(tmp_path / "rollups.db"))
+    with conn:
+        conn.executemany("INSERT INTO items (id, name, units_per_package) VALUES (?, ?, 6)",
+                         [("i1", "Arroz"), ("i2", "Feijão")])
+    insert_movements(conn, [
+        {"item_id": "i1", "type": "in", "quantity": 10, "price": 2, "date": "2026-10-01"},
+        {"item_id": "i1", "type": "out", "quantity": 4, "price": 2, "date": "2026-10-02T09:00:00Z"},
+        {"item_id": "i2", "type": "out", "quantity": 7, "price": 3, "date": "2026-10-02"},
+        {"item_id": "i2", "type": "out", "quantity": 1, "price": 3, "date": "2026-08-01"},
+    ])
+    return conn
+
+
+@pytest.mark.parametrize("movement, message", [
+    ({"item_id": None, "type": "in", "quantity": 1}, "item_id"),
+    ({"type": "in", "quantity": 1}, "item_id"),
+    ({"item_id": "nope", "type": "in", "quantity": 1}, "Item não encontrado"),
+    ({"item_id": "i1", "type": "in", "quantity": 1, "date": "19/10/2026"}, "Data inválida"),
+    ({"item_id": "i1", "type": "in", "quantity": 1, "date": "2026-02-30"}, "Data inválida"),
+    ({"item_id": "i1", "type": "in", "quantity": 1, "id": "dup"}, "rejeitada"),
+])
+def test_invalid_movements_raise_value_error(conn, movement, message):
+    insert_movements(conn, [{"id": "dup", "item_id": "i1", "type": "in", "quantity": 1, "date": "2026-10-03"}])
+    before = conn.execute("SELECT COUNT(*) FROM movement_rollups_daily").fetchone()[0]
+    with pytest.raises(ValueError, match=message):
+        insert_movements(conn, [movement])
+    assert conn.execute("SELECT COUNT(*) FROM movement_rollups_daily").fetchone()[0] == before
+
+
+def test_daily_movements_reads_rollups(conn):
+    expected = [
+        {"date": "2026-10-02", "type": "out", "movimentos": 2, "quantidade": 11.0, "valor": 29.0},
+        {"date": "2026-10-01", "type": "in", "movimentos": 1, "quantidade": 10.0, "valor": 20.0},
+    ]
+    assert daily_movements(conn, "2026-10-01", "2026-10-31") == expected
+    assert daily_movements(conn, "01/10/2026", "31/10/2026") == expected
+    rebuild_rollups(conn)
+    assert daily_movements(conn, "2026-10-01", "2026-10-31") == expected
+
+
+@pytest.mark.parametrize("start, end", [("foo", "bar"), ("2026-10-01", "2026-13-01"), ("2026-10-31", "2026-10-01")])
+def test_daily_movements_rejects_invalid_period(conn, start, end):
+    with pytest.raises(ValueError):
+        daily_movements(conn, start, end)
+
+
+def test_product_ranking(conn):
+    ranking = product_ranking(conn, 30, today="2026-10-19")
+    assert [(row["id"], row["quantidade"], row["embalagens"]) for row in ranking["maisVendidos"]] == \
+        [("i2", 7.0, 1), ("i1", 4.0, 0)]
+    assert [row["id"] for row in product_ranking(conn)["maisVendidos"]] == ["i2", "i1"]
+    assert product_ranking(conn)["maisVendidos"][0]["quantidade"] == 8.0
+    with pytest.raises(ValueError):
+        product_ranking(conn, 30, today="ontem")
+
+
+def _derived(conn):
+    tables = {table: sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                            for row in conn.execute(f"SELECT * FROM {table}"))
+              for table in ("movement_rollups_daily", "movement_rollups_monthly", "stock_snapshots")}
+    tables["valuation"] = sorted((row["item_id"], round(row["valor"], 6)) for row in valuation(conn)["itens"])
+    return tables
+
+
+def test_updates_and_deletes_keep_derived_tables_in_sync(conn):
+    rng = random.Random(5)
+    with conn:
+        conn.execute("INSERT INTO suppliers (id, name) VALUES ('s1', 'Fornecedor')")
+        conn.execute("INSERT INTO items (id, name) VALUES ('i3', 'Milho')")
+    insert_movements(conn, [
+        {"item_id": rng.choice(["i1", "i2", "i3"]), "type": rng.choice(["in", "out"]), "quantity": rng.randint(1, 20),
+         "price": rng.randint(1, 9), "date": f"2026-{rng.randint(1, 10):02d}-{rng.randint(1, 28):02d}"}
+        for _ in range(200)
+    ])
+    with conn:
+        conn.execute("UPDATE movements SET quantity = quantity + 3, price = 7 WHERE rowid % 5 = 0")
+        conn.execute("UPDATE movements SET date = '2026-11-02', type = 'in' WHERE rowid % 7 = 0")
+        conn.execute("UPDATE movements SET item_id = 'i1' WHERE rowid % 11 = 0")
+        conn.execute("UPDATE movements SET reason = 'só o motivo' WHERE rowid % 3 = 0")
+        conn.execute("DELETE FROM movements WHERE rowid % 13 = 0")
+        conn.execute("UPDATE items SET supplier_id = 's1' WHERE id = 'i2'")
+    insert_movements(conn, [{"item_id": "i2", "type": "in", "quantity": 5, "price": 2, "date": "2026-06-15"}])
+    with conn:
+        conn.execute("DELETE FROM items WHERE id = 'i3'")  # ON DELETE CASCADE nas movimentações
+    incremental = _derived(conn)
+    rebuild_rollups(conn)
+    rebuild_snapshots(conn)
+    rebuild_valuation(conn)
+    assert incremental == _derived(conn)
+
+
+def test_deleted_movements_leave_the_reports(conn):
+    with conn:
+        conn.execute("DELETE FROM movements")
+    assert daily_movements(conn, "2026-01-01", "2026-12-31") == []
+    assert product_ranking(conn)["maisVendidos"] == []
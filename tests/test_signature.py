@@ -0,0 +1,83 @@
+import glob
+import os
+
+import pytest
+from lxml import etree
+
+from api.signature import DS_NS, DEFAULT_C14N, _canonical, verify_xml_signature
+
+pytest.importorskip("cryptography")
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))
+INJECTED = (b'<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><injetado>'
+            b'<det nItem="99"><prod><cProd>X</cProd></prod></det></injetado></Signature>')
+
+
+@pytest.fixture(scope="module", params=SAMPLES, ids=os.path.basename)
+def content(request):
+    with open(request.param, 'rb') as f:
+        return f.read()
+
+
+def test_samples_are_valid(content):
+    result = verify_xml_signature(content)
+    assert result["valida"] and result["certificado"]["cnpjConfere"], result
+
+
+def test_changed_content_breaks_digest(content):
+    result = verify_xml_signature(content.replace(b'<qCom>', b'<qCom>1', 1))
+    assert result["assinada"] and not result["digestValido"] and result["assinaturaValida"]
+
+
+def test_injected_signature_is_part_of_digest(content):
+    # Uma <Signature> inserida no <infNFe> não é a assinatura da nota: a transformação enveloped não a remove
+    tampered = content.replace(b'<det ', INJECTED + b'<det ', 1)
+    assert tampered != content
+    result = verify_xml_signature(tampered)
+    assert result["assinada"] and not result["valida"] and not result["digestValido"], result
+
+
+def test_missing_signature(content):
+    stripped = content.replace(b'<Signature', b'<Assinatura', 1).replace(b'</Signature>', b'</Assinatura>', 1)
+    assert not verify_xml_signature(stripped)["assinada"]
+
+
+def test_enveloped_removes_only_the_given_signature():
+    root = etree.fromstring(
+        f'<a><b>1</b><Signature xmlns="{DS_NS}"><x/></Signature><c><Signature xmlns="{DS_NS}"><y/></Signature></c></a>')
+    own, other = root.findall(f'.//{{{DS_NS}}}Signature')
+    assert b'<x>' not in _canonical(root, DEFAULT_C14N, own) and b'<y>' in _canonical(root, DEFAULT_C14N, own)
+    assert b'<y>' in _canonical(root[2], DEFAULT_C14N, own)  # assinatura fora do elemento: nada é removido
+    assert len(root.findall(f'.//{{{DS_NS}}}Signature')) == 2  # a árvore original não muda
+
+
+def test_upload_of_conflicting_duplicate_checks_the_stored_xml(content, tmp_path):
+    from fastapi.testclient import TestClient
+
+    from api.db import get_connection
+    from api.index import app, get_db
+
+    def db():
+        conn = get_connection(str(tmp_path / "upload.db"))
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    app.dependency_overrides[get_db] = db
+    try:
+        client = TestClient(app)
+
+        def upload(data):
+            response = client.post("/api/upload/", params={"assinatura": "true"}, headers={"Authorization": "secret"},
+                                   files={"file": ("nota.xml", data, "text/xml")})
+            assert response.status_code == 200, response.text
+            return response.json()
+
+        # A versão adulterada chega primeiro e fica gravada; o XML íntegro depois é um conflito
+        assert not upload(content.replace(b'<qCom>', b'<qCom>1', 1))["assinatura"]["valida"]
+        genuine = upload(content)
+        assert genuine["duplicada"] and genuine["conflito"]
+        assert not genuine["assinatura"]["valida"]
+    finally:
+        del app.dependency_overrides[get_db]
@@ -0,0 +1,115 @@
+import sqlite3
+import time
+
+import pytest
+
+from api.db import SCHEMA, get_connection
+from api.sync import fetch_changes
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = get_connection(str(tmp_path / "sync.db"))
+    with conn:
+        conn.execute("INSERT INTO items (id, name) VALUES ('i1', 'Item')")
+    return conn
+
+
+def _sync(conn, table, since=None, limit=1000):
+    """Todas as páginas a partir de since: (ids, novo watermark)."""
+    ids, cursor = [], None
+    while True:
+        page = fetch_changes(conn, table, since=since, cursor=cursor, limit=limit)
+        ids += [row["id"] for row in page["rows"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            return ids, page["watermark"]
+
+
+def _movement(conn, movement_id, date):
+    with conn:
+        conn.execute("INSERT INTO movements (id, item_id, type, quantity, date) VALUES (?, 'i1', 'entrada', 1, ?)",
+                     (movement_id, date))
+
+
+def test_backdated_movement_is_synced(conn):
+    _movement(conn, "m1", "2026-10-01")
+    ids, watermark = _sync(conn, "movements")
+    assert ids == ["m1"]
+    _movement(conn, "m2", "2025-01-01")  # lançamento retroativo
+    assert _sync(conn, "movements", since=watermark)[0] == ["m2"]
+
+
+def test_ties_on_watermark_are_not_skipped(conn):
+    with conn:
+        conn.executemany("INSERT INTO suppliers (id, name, updated_at) VALUES (?, 'F', '2026-01-01T00:00:00.000Z')",
+                         [(f"s{i}",) for i in range(5)])
+    ids, watermark = _sync(conn, "suppliers", limit=2)
+    assert ids == [f"s{i}" for i in range(5)]
+    with conn:
+        conn.execute("INSERT INTO suppliers (id, name, updated_at) VALUES ('s9', 'F', '2026-01-01T00:00:00.000Z')")
+    assert _sync(conn, "suppliers", since=watermark)[0] == ["s9"]
+
+
+def test_update_bumps_updated_at(conn):
+    ids, watermark = _sync(conn, "items")
+    assert ids == ["i1"]
+    time.sleep(0.002)
+    with conn:
+        conn.execute("UPDATE items SET name = 'Novo nome' WHERE id = 'i1'")
+    assert _sync(conn, "items", since=watermark)[0] == ["i1"]
+
+
+@pytest.mark.parametrize("table, column", [("operations", "total"), ("movements", "quantity")])
+def test_updates_of_operations_and_movements_are_synced(conn, table, column):
+    with conn:
+        conn.execute("INSERT INTO operations (id, type) VALUES ('o1', 'venda')")
+    _movement(conn, "m1", "2026-10-01")
+    ids, watermark = _sync(conn, table)
+    assert len(ids) == 1
+    time.sleep(0.002)
+    with conn:
+        conn.execute(f"UPDATE {table} SET {column} = 5")
+    assert _sync(conn, table, since=watermark)[0] == ids
+
+
+def test_deletions_are_returned(conn):
+    _movement(conn, "m1", "2026-10-01")
+    with conn:
+        conn.execute("INSERT INTO suppliers (id, name) VALUES ('s1', 'F')")
+    first = fetch_changes(conn, "movements")
+    assert first["deleted"] == []
+    with conn:
+        conn.execute("DELETE FROM suppliers WHERE id = 's1'")
+        conn.execute("DELETE FROM items WHERE id = 'i1'")  # apaga m1 em cascata
+    page = fetch_changes(conn, "movements", since=first["watermark"], deleted_since=first["deletedWatermark"])
+    assert page["rows"] == [] and page["deleted"] == ["m1"]
+    assert fetch_changes(conn, "items", deleted_since=first["deletedWatermark"])["deleted"] == ["i1"]
+    assert fetch_changes(conn, "suppliers")["deleted"] == ["s1"]
+    again = fetch_changes(conn, "movements", deleted_since=page["deletedWatermark"])
+    assert again["deleted"] == []
+
+
+def test_old_database_gets_updated_at(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.executescript(SCHEMA.replace(
+        ",\n    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))\n);\n\nCREATE TABLE IF NOT EXISTS movements",
+        "\n);\n\nCREATE TABLE IF NOT EXISTS movements",
+    ))
+    old.execute("INSERT INTO operations (id, type, created_at) VALUES ('o1', 'venda', '2026-01-01T00:00:00.000Z')")
+    old.commit()
+    old.close()
+    conn = get_connection(path)
+    assert conn.execute("SELECT updated_at FROM operations").fetchone()[0] == "2026-01-01T00:00:00.000Z"
+    ids, watermark = _sync(conn, "operations")
+    with conn:
+        conn.execute("UPDATE operations SET total = 1")
+    assert _sync(conn, "operations", since=watermark)[0] == ["o1"]
+
+
+def test_invalid_cursor(conn):
+    with pytest.raises(ValueError):
+        fetch_changes(conn, "movements", cursor="abc|")
+    with pytest.raises(ValueError):
+        fetch_changes(conn, "movements", deleted_since="abc")
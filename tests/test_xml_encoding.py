@@ -0,0 +1,80 @@
+import codecs
+import glob
+import io
+import logging
+import os
+import re
+
+import pytest
+from fastapi import HTTPException
+
+from api.index import parse_nfe_xml
+from api.xml_encoding import can_fall_back, detect_encoding
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'xml', '*.xml')))
+ACCENTED = 'AÇÚCAR CRISTAL ÓLEO DE SOJA LIMÃO 1KG'
+
+
+@pytest.fixture(scope="module", params=SAMPLES, ids=os.path.basename)
+def note(request):
+    """A nota de exemplo em UTF-8 com um xProd acentuado, o corpo sem declaração e o parse de referência."""
+    with open(request.param, 'rb') as f:
+        content = f.read()
+    utf8 = re.sub(rb'<xProd>[^<]*', b'<xProd>' + ACCENTED.encode('utf-8'), content)
+    body = re.sub(rb'^<\?xml[^>]*\?>', b'', utf8).decode('utf-8')
+    reference = parse_nfe_xml(utf8)
+    assert ACCENTED in reference["produtos"][0]["name"]
+    return utf8, body, reference
+
+
+@pytest.mark.parametrize("head, expected", [
+    (codecs.BOM_UTF8 + b'<?xml version="1.0" encoding="ISO-8859-1"?><a/>', ('UTF-8', 'bom')),
+    (codecs.BOM_UTF16_LE + '<a/>'.encode('utf-16-le'), ('UTF-16LE', 'bom')),
+    (b'<?xml version="1.0" encoding="ISO-8859-1"?><a/>', ('ISO-8859-1', 'declaracao')),
+    (b"\n<?xml version='1.0' encoding='latin1'?><a/>", ('ISO-8859-1', 'declaracao')),
+    (b'<?xml version="1.0" encoding="windows-1252"?><a/>', ('windows-1252', 'declaracao')),
+    (b'<?xml version="1.0" encoding="us-ascii"?><a/>', ('UTF-8', 'declaracao')),
+    (b'<?xml version="1.0"?><a/>', ('UTF-8', None)),
+    (b'<a/>', ('UTF-8', None)),
+])
+def test_detect_encoding(head, expected):
+    assert detect_encoding(head) == expected
+
+
+def test_unsupported_declaration():
+    with pytest.raises(ValueError, match="não suportada"):
+        detect_encoding(b'<?xml version="1.0" encoding="x-nao-existe"?><a/>')
+    with pytest.raises(HTTPException) as error:
+        parse_nfe_xml(b'<?xml version="1.0" encoding="x-nao-existe"?><a/>')
+    assert error.value.status_code == 400
+
+
+def test_only_utf8_without_bom_falls_back():
+    assert can_fall_back('UTF-8', None) and can_fall_back('UTF-8', 'declaracao')
+    assert not can_fall_back('UTF-8', 'bom') and not can_fall_back('ISO-8859-1', 'declaracao')
+
+
+@pytest.mark.parametrize("label", ["bom utf-8", "bom utf-16", "iso-8859-1 declarado", "windows-1252 declarado",
+                                   "latin-1 sem declaração", "latin-1 declarado como utf-8"])
+def test_parse_matches_utf8(note, label):
+    utf8, body, reference = note
+    data = {
+        "bom utf-8": codecs.BOM_UTF8 + utf8,
+        "bom utf-16": codecs.BOM_UTF16_LE + body.encode('utf-16-le'),
+        "iso-8859-1 declarado": b'<?xml version="1.0" encoding="ISO-8859-1"?>' + body.encode('latin-1'),
+        "windows-1252 declarado": b"<?xml version='1.0' encoding='windows-1252'?>" + body.encode('cp1252'),
+        "latin-1 sem declaração": body.encode('latin-1'),
+        "latin-1 declarado como utf-8": b'<?xml version="1.0" encoding="UTF-8"?>' + body.encode('latin-1'),
+    }[label]
+    assert parse_nfe_xml(data) == reference
+    assert parse_nfe_xml(data, recover=True)["produtos"] == reference["produtos"]
+    if label != "latin-1 declarado como utf-8":  # o stream não volta atrás: ver get_nfe no index.py
+        assert parse_nfe_xml(io.BytesIO(data)) == reference
+
+
+def test_fallback_is_logged_and_reported(note, caplog):
+    _, body, _ = note
+    with caplog.at_level(logging.INFO, logger="api.index"):
+        result = parse_nfe_xml(body.encode('latin-1'), recover=True)
+    assert "lendo como ISO-8859-1" in caplog.text
+    assert any("não está em UTF-8" in warning for warning in result["avisos"])